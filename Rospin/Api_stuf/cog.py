@@ -0,0 +1,81 @@
+# cog.py
+"""
+Cloud-Optimised GeoTIFF output.
+
+Rasters are first written block by block to a plain tiled GeoTIFF and then
+converted with write_cog(): tiled, DEFLATE (or LZW) compressed, 1-bit for
+binary masks, with internal overviews placed ahead of the full-resolution
+tiles, so viewers and remote readers fetch a handful of tiles or a coarse
+overview instead of the whole raster. GDAL >= 3.1 has a COG driver for this;
+older GDAL gets the same layout from GTiff with COPY_SRC_OVERVIEWS.
+"""
+import os
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+COG_BLOCKSIZE = 512
+
+
+def _has_cog_driver():
+    with rasterio.Env() as env:
+        return "COG" in env.drivers()
+
+
+def _overview_factors(width, height, blocksize):
+    factors, f = [], 2
+    while max(width, height) / f >= blocksize / 2:
+        factors.append(f)
+        f *= 2
+    return factors
+
+
+def write_cog(src_path, dst_path, nbits=None, resampling=Resampling.average,
+              compress="DEFLATE", blocksize=COG_BLOCKSIZE):
+    """
+    Copy src_path to a COG at dst_path (atomically replaced). nbits=1 for 0/1 masks;
+    resampling is used for the overviews (Resampling.mode suits masks and classes).
+    """
+    with rasterio.open(src_path) as src:
+        width, height, dtype = src.width, src.height, src.dtypes[0]
+    floating = np.issubdtype(np.dtype(dtype), np.floating)
+    options = {"COMPRESS": compress, "BIGTIFF": "IF_SAFER", "NUM_THREADS": "ALL_CPUS"}
+    if nbits:
+        options["NBITS"] = nbits
+
+    tmp = f"{dst_path}.{os.getpid()}.tmp.tif"
+    try:
+        with rasterio.Env(GDAL_PAM_ENABLED="NO"):  # no .aux.xml sidecars next to the temporary files
+            _copy(src_path, tmp, width, height, floating, options, resampling, blocksize)
+        os.replace(tmp, dst_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return dst_path
+
+
+def _copy(src_path, tmp, width, height, floating, options, resampling, blocksize):
+    if _has_cog_driver():
+        options.update(BLOCKSIZE=blocksize, OVERVIEWS="AUTO", RESAMPLING=resampling.name.upper())
+        if floating:
+            options["PREDICTOR"] = "YES"
+        rasterio.shutil.copy(src_path, tmp, driver="COG", **options)
+    else:
+        # overviews go into a scratch copy first, COPY_SRC_OVERVIEWS then writes them ahead of the data
+        scratch = f"{tmp}.ovr.tif"
+        try:
+            rasterio.shutil.copy(src_path, scratch, driver="GTiff", TILED="YES",
+                                 BLOCKXSIZE=blocksize, BLOCKYSIZE=blocksize, BIGTIFF="IF_SAFER")
+            factors = _overview_factors(width, height, blocksize)
+            if factors:
+                with rasterio.open(scratch, "r+") as ds:
+                    ds.build_overviews(factors, resampling)
+            options.update(TILED="YES", BLOCKXSIZE=blocksize, BLOCKYSIZE=blocksize, COPY_SRC_OVERVIEWS="YES")
+            if floating:
+                options["PREDICTOR"] = 3
+            rasterio.shutil.copy(scratch, tmp, driver="GTiff", **options)
+        finally:
+            if os.path.exists(scratch):
+                os.remove(scratch)
@@ -0,0 +1,290 @@
+# copernicus_client.py
+"""
+Copernicus Data Space client and catalogue search, shared by the CLI
+(Download_V2) and the flood service (Api_stuf); both keep an identical copy,
+since each builds from its own Docker context.
+
+CopernicusClient holds one pooled session and keeps the token fresh.
+search_products() pages through the resto catalogue and caches answers on
+disk for a TTL (expired entries are pruned whenever a new one is written);
+search_many() fans several queries and time slices out over a thread pool.
+"""
+import os, re, time, json, hashlib, threading, requests
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+CLIENT_ID = "cdse-public"
+CATALOGUE_URL = "https://catalogue.dataspace.copernicus.eu/resto/api/collections/{collection}/search.json"
+TOKEN_URL = "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
+SEARCH_PAGE_SIZE = 1000         # records per catalogue page
+SEARCH_CACHE_DIR = "search_cache"
+SEARCH_CACHE_TTL = 6 * 3600     # seconds a cached catalogue answer stays valid
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CopernicusClient:
+    """
+    Owns one connection-pooled requests.Session for catalogue and download calls
+    and keeps the access token valid, refreshing it with the refresh token
+    shortly before it expires.
+    """
+    def __init__(self, username, password, pool_size: int = 10, retries: int = 5,
+                 backoff: float = 1.0, refresh_margin: int = 60):
+        """
+        :param pool_size: max connections kept open per host; size it to the number
+                          of concurrent requests (download workers * segments).
+        :param refresh_margin: seconds before expiry at which the token is refreshed.
+        """
+        self.username = username
+        self._password = password
+        self.refresh_margin = refresh_margin
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["GET", "HEAD", "POST"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self.access_token = None
+        self.refresh_token = None
+        self._expires_at = 0.0
+        self._refresh_expires_at = 0.0
+        self._request_token({"grant_type": "password", "username": username, "password": password})
+
+    def _request_token(self, data):
+        data = dict(data, client_id=CLIENT_ID)
+        response = self.session.post(TOKEN_URL, data=data, timeout=60)
+        response.raise_for_status()
+        token_data = response.json()
+        now = time.time()
+        self.access_token = token_data["access_token"]
+        self.refresh_token = token_data.get("refresh_token")
+        self._expires_at = now + float(token_data.get("expires_in", 600))
+        self._refresh_expires_at = now + float(token_data.get("refresh_expires_in", 3600))
+
+    def _ensure_token(self, force=False):
+        with self._lock:
+            now = time.time()
+            if not force and now < self._expires_at - self.refresh_margin:
+                return
+            if self.refresh_token and now < self._refresh_expires_at - self.refresh_margin:
+                try:
+                    self._request_token({"grant_type": "refresh_token", "refresh_token": self.refresh_token})
+                    return
+                except Exception as e:
+                    print(f"⚠️ Token refresh failed, logging in again: {e}")
+            self._request_token({"grant_type": "password", "username": self.username, "password": self._password})
+
+    def auth_headers(self) -> dict:
+        self._ensure_token()
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+    def get(self, url, headers=None, auth=True, **kwargs):
+        """
+        GET through the pooled session. Transient 5xx/429 responses are retried with
+        backoff by the adapter; a 401 forces one token refresh and a second attempt.
+        """
+        kwargs.setdefault("timeout", 60)
+        req_headers = dict(headers or {})
+        if auth:
+            req_headers.update(self.auth_headers())
+        response = self.session.get(url, headers=req_headers, **kwargs)
+        if auth and response.status_code == 401:
+            response.close()
+            self._ensure_token(force=True)
+            req_headers.update({"Authorization": f"Bearer {self.access_token}"})
+            response = self.session.get(url, headers=req_headers, **kwargs)
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+def get_tokens(username, password):
+    client = CopernicusClient(username, password, pool_size=1)
+    client.close()
+    return client.access_token, client.refresh_token
+
+# ------------------------
+# Catalogue search
+# ------------------------
+def _normalize_wkt(aoi_wkt):
+    """Canonical WKT text: upper-case, single spaces, coordinates rounded to 1e-6 deg."""
+    text = " ".join(str(aoi_wkt).upper().split())
+    text = re.sub(r"\s*([(),])\s*", r"\1", text)
+    return re.sub(r"-?\d+(?:\.\d+)?", lambda m: f"{float(m.group()):.6f}".rstrip("0").rstrip("."), text)
+
+def _normalize_date(value):
+    try:
+        d = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return str(value).strip()
+    if d.tzinfo is not None:
+        d = d.astimezone(timezone.utc).replace(tzinfo=None)
+    return d.strftime("%Y-%m-%dT%H:%M:%S.%fZ")  # sub-second slice edges must not share a key
+
+def search_cache_key(collection, aoi_wkt, start_date, end_date, extra_params=None, maxRecords=None):
+    query = {
+        "collection": collection,
+        "geometry": _normalize_wkt(aoi_wkt),
+        "start": _normalize_date(start_date),
+        "end": _normalize_date(end_date),
+        "params": {str(k): str(v) for k, v in sorted((extra_params or {}).items())},
+        "maxRecords": maxRecords,
+    }
+    return hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()
+
+def _search_cache_get(cache_dir, key, ttl):
+    path = os.path.join(cache_dir, f"{key}.json")
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path) as f:
+            return json.load(f)["features"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _search_cache_put(cache_dir, key, features, ttl):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.json")
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"created": time.time(), "features": features}, f)
+    os.replace(tmp, path)
+    _search_cache_prune(cache_dir, ttl)
+
+def _search_cache_prune(cache_dir, ttl):
+    """Delete expired answers (and temporary files left by interrupted writes)."""
+    cutoff = time.time() - ttl
+    for name in os.listdir(cache_dir):
+        if not name.endswith((".json", ".tmp")):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass  # already removed by a concurrent writer
+
+def _next_page_url(data):
+    for link in (data.get("properties") or {}).get("links") or []:
+        if link.get("rel") == "next" and link.get("href"):
+            return link["href"]
+    return None
+
+def search_products(client, aoi_wkt, start_date, end_date, collection, extra_params=None, maxRecords=None,
+                    cache_dir=SEARCH_CACHE_DIR, cache_ttl=SEARCH_CACHE_TTL):
+    """
+    Generic search function for Sentinel-1 or Sentinel-2.
+    collection: "Sentinel1" or "Sentinel2"
+
+    Follows the resto "next" links so the whole result set is returned
+    (or the first maxRecords features). Answers are cached on disk under
+    cache_dir for cache_ttl seconds, keyed by the normalised query, and expired
+    ones are deleted whenever a new answer is stored; pass cache_ttl=0 to bypass
+    the cache.
+    """
+    key = search_cache_key(collection, aoi_wkt, start_date, end_date, extra_params, maxRecords)
+    if cache_ttl:
+        cached = _search_cache_get(cache_dir, key, cache_ttl)
+        if cached is not None:
+            return cached
+
+    url = CATALOGUE_URL.format(collection=collection)
+    query_params = {
+        "startDate": start_date,
+        "completionDate": end_date,
+        "geometry": aoi_wkt,
+        "maxRecords": min(maxRecords or SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE),
+    }
+    if extra_params:
+        query_params.update(extra_params)
+
+    features = []
+    while url:
+        response = client.get(url, params=query_params)
+        response.raise_for_status()
+        data = response.json()
+        page = data.get("features", [])
+        features.extend(page)
+        if not page or (maxRecords and len(features) >= maxRecords):
+            break
+        url, query_params = _next_page_url(data), None  # next link already carries the query
+
+    if maxRecords:
+        features = features[:maxRecords]
+    if cache_ttl:
+        _search_cache_put(cache_dir, key, features, cache_ttl)
+    return features
+
+def _parse_utc(value):
+    d = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    if d.tzinfo is not None:
+        d = d.astimezone(timezone.utc).replace(tzinfo=None)
+    return d
+
+def _format_utc(d):
+    return d.strftime("%Y-%m-%dT%H:%M:%S.%fZ" if d.microsecond else "%Y-%m-%dT%H:%M:%SZ")
+
+def split_time_range(start_date, end_date, slice_days) -> List[Tuple[str, str]]:
+    """
+    Split [start, end] into contiguous slices of slice_days: each slice ends exactly
+    where the next one begins, i.e. [lo, hi) with only the last one closed at `end`,
+    so no instant falls between two slices. The catalogue treats both bounds as
+    inclusive, so a product exactly on an edge comes back from both neighbours;
+    search_many merges it by id. Edges sit on fixed multiples of slice_days since
+    1970-01-01, so overlapping jobs produce identical interior slices and share
+    their cached catalogue answers.
+    """
+    start, end = _parse_utc(start_date), _parse_utc(end_date)
+    if not slice_days or end <= start:
+        return [(start_date, end_date)]
+    step = timedelta(days=slice_days)
+    epoch = datetime(1970, 1, 1)
+    edge = epoch + step * ((start - epoch) // step) + step
+    slices = []
+    lo = start
+    while edge < end:
+        slices.append((lo, edge))
+        lo, edge = edge, edge + step
+    slices.append((lo, end))
+    return [(_format_utc(a), _format_utc(b)) for a, b in slices]
+
+def search_many(client, aoi_wkt, start_date, end_date, queries: Dict[str, Tuple[str, Optional[dict]]],
+                slice_days=None, max_workers=8) -> Dict[str, list]:
+    """
+    Run several catalogue queries for one job at the same time.
+
+    queries maps a name to (collection, extra_params). Each query is split into
+    time slices (see split_time_range) and every (query, slice) pair is searched
+    on a thread pool. Returns name -> features merged across slices, deduplicated
+    by product id and ordered newest first like the catalogue default.
+    """
+    slices = split_time_range(start_date, end_date, slice_days)
+    results: Dict[str, Dict[str, dict]] = {name: {} for name in queries}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        future_to_name = {
+            executor.submit(search_products, client, aoi_wkt, lo, hi, collection, extra_params): name
+            for name, (collection, extra_params) in queries.items()
+            for lo, hi in slices
+        }
+        for future in as_completed(future_to_name):
+            name = future_to_name[future]
+            for feature in future.result():
+                results[name].setdefault(feature["id"], feature)
+
+    return {
+        name: sorted(found.values(), key=lambda f: f["properties"].get("startDate", ""), reverse=True)
+        for name, found in results.items()
+    }
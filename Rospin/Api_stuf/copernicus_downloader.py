@@ -1,47 +1,59 @@
-import os, requests, zipfile
+import os, zipfile
 from getpass import getpass
 
-CLIENT_ID = "cdse-public"
-
-def get_tokens(username, password):
-    token_url = "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
-    response = requests.post(
-        token_url,
-        data={"client_id": CLIENT_ID, "username": username, "password": password, "grant_type": "password"}
-    )
-    token_data = response.json()
-    return token_data["access_token"], token_data["refresh_token"]
-
-def search_products(headers, aoi_wkt, start_date, end_date, maxRecords=1):
-    BASE_URL = "https://catalogue.dataspace.copernicus.eu/resto/api/collections/Sentinel1/search.json"
-    query_params = {
-        "startDate": start_date,
-        "completionDate": end_date,
-        "productType": "GRD",
-        "sensorMode": "IW",
-        "geometry": aoi_wkt,
-        "maxRecords": maxRecords
-    }
-    response = requests.get(BASE_URL, params=query_params, headers=headers)
-    response.raise_for_status()
-    return response.json().get("features", [])
-
-def download_and_extract(product, headers, download_dir):
+# client and catalogue search are shared with Download_V2 (copernicus_client.py); re-exported here
+from copernicus_client import CopernicusClient, get_tokens, search_products as search_catalogue
+
+
+def search_products(client, aoi_wkt, start_date, end_date, maxRecords=None, **kwargs):
+    """
+    Sentinel-1 IW GRD products over the AOI, through the shared paginated and
+    TTL-cached catalogue search (cache_dir / cache_ttl pass through to it).
+    """
+    return search_catalogue(client, aoi_wkt, start_date, end_date, "Sentinel1",
+                            extra_params={"productType": "GRD", "sensorMode": "IW"},
+                            maxRecords=maxRecords, **kwargs)
+
+def download_and_extract(product, client, download_dir, extract=True, store=None):
+    """
+    Download and extract a product. With a ProductStore the files are kept under
+    the store (keyed by product id) and space is reclaimed under its quota.
+    """
     title = product["properties"]["title"]
     product_id = product["id"]
-    extract_path = os.path.join(download_dir, title)  # Directory name matches zip (without .zip)
-    zip_file_path = os.path.join(download_dir, f"{title}.zip")
+    if store is not None:
+        zip_file_path, extract_path = store.paths(product_id, title)
+        os.makedirs(os.path.dirname(zip_file_path), exist_ok=True)
+        store.adopt_legacy(product_id, title)  # reuse a copy from the flat download layout
+        store.lookup(product_id)  # refresh last access of a cached product
+    else:
+        extract_path = os.path.join(download_dir, title)  # Directory name matches zip (without .zip)
+        zip_file_path = os.path.join(download_dir, f"{title}.zip")
 
     if not os.path.exists(zip_file_path):
         url = f"https://download.dataspace.copernicus.eu/odata/v1/Products({product_id})/$value"
-        with requests.get(url, headers=headers, stream=True) as r:
+        if store is not None:
+            size = product["properties"].get("services", {}).get("download", {}).get("size")
+            store.ensure_space(int(size or 0), keep=[product_id])
+        part_path = zip_file_path + ".part"
+        with client.get(url, stream=True) as r:
             r.raise_for_status()
-            with open(zip_file_path, "wb") as f:
-                for chunk in r.iter_content(8192):
+            with open(part_path, "wb") as f:
+                for chunk in r.iter_content(1024 * 1024):
                     f.write(chunk)
+        os.replace(part_path, zip_file_path)
+        if store is not None:
+            store.record_zip(product_id, title)
+
+    if not extract:
+        return zip_file_path
+
     # Always extract to extract_path, even if SAFE folder is inside the zip
     if not os.path.exists(extract_path):
         with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
             zip_ref.extractall(extract_path)
+        if store is not None:
+            store.record_extracted(product_id, title)
+            store.ensure_space(0, keep=[product_id])
 
     return extract_path
@@ -0,0 +1,172 @@
+# coregister.py
+"""
+Lazy alignment of two scenes (pre/post) on one common grid.
+
+The grid is north-up UTM at a fixed resolution over the overlap of both
+scene footprints, optionally clipped to the AOI. Nothing is reprojected up
+front: reading a grid window maps its outline into each scene, reads only the
+source pixels under it and reprojects them into the window, through the GCPs
+of GRD measurement TIFFs or the CRS of georeferenced rasters. Only the overlap
+is ever decoded. Pixels outside a scene are NaN.
+
+(A WarpedVRT with an explicit target grid is not used: rasterio then warps
+GCP-only sources through their identity geotransform instead of the GCPs.)
+"""
+import math
+import threading
+
+import numpy as np
+import rasterio
+import shapely
+from rasterio.control import GroundControlPoint
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin, rowcol, xy
+from rasterio.warp import reproject, transform as warp_transform
+from rasterio.windows import Window
+from shapely import wkt as shapely_wkt
+from shapely.geometry import Polygon
+
+from aoi_window import _bbox_outline, georeferencing
+
+GRID_RESOLUTION = 10.0  # metres, GRDH pixel spacing
+SOURCE_MARGIN = 8       # source pixels around a window: resampling kernel + GCP fit slack
+OUTLINE_SEGMENT_DEG = 0.01
+SNAP_EPS = 1e-6         # in pixels
+
+
+def utm_crs_for(lon, lat):
+    """UTM zone (WGS84) containing a lon/lat point."""
+    zone = int(math.floor((lon + 180.0) / 6.0)) % 60 + 1
+    return rasterio.crs.CRS.from_epsg((32600 if lat >= 0 else 32700) + zone)
+
+
+def footprint(src):
+    """Outline of the raster in lon/lat (image border mapped through its transform or GCPs)."""
+    ref, crs = georeferencing(src)
+    if ref is None:
+        raise ValueError(f"{src.name} has neither a CRS nor GCPs")
+    cols, rows = _bbox_outline((0, 0, src.width, src.height))
+    xs, ys = xy(ref, rows, cols, offset="ul")
+    if crs is not None and crs != rasterio.crs.CRS.from_epsg(4326):
+        xs, ys = warp_transform(crs, "EPSG:4326", xs, ys)
+    poly = Polygon(zip(xs, ys))
+    return poly if poly.is_valid else poly.buffer(0)
+
+
+class CommonGrid:
+    def __init__(self, crs, transform, width, height):
+        self.crs = crs
+        self.transform = transform
+        self.width = int(width)
+        self.height = int(height)
+
+    @classmethod
+    def over(cls, area, resolution=GRID_RESOLUTION):
+        """UTM grid covering `area` (lon/lat), snapped to multiples of the resolution."""
+        c = area.centroid
+        crs = utm_crs_for(c.x, c.y)
+        # project the outline itself: the lon/lat bbox of a UTM-aligned scene is larger than the scene
+        coords = shapely.get_coordinates(shapely.segmentize(area, OUTLINE_SEGMENT_DEG))
+        xs, ys = warp_transform("EPSG:4326", crs, coords[:, 0].tolist(), coords[:, 1].tolist())
+        # snap outwards to the resolution, ignoring round-trip noise
+        minx = math.floor(min(xs) / resolution + SNAP_EPS) * resolution
+        maxx = math.ceil(max(xs) / resolution - SNAP_EPS) * resolution
+        miny = math.floor(min(ys) / resolution + SNAP_EPS) * resolution
+        maxy = math.ceil(max(ys) / resolution - SNAP_EPS) * resolution
+        width = max(1, int(round((maxx - minx) / resolution)))
+        height = max(1, int(round((maxy - miny) / resolution)))
+        return cls(crs, from_origin(minx, maxy, resolution, resolution), width, height)
+
+
+def common_grid(pre_src, post_src, aoi_wkt=None, resolution=GRID_RESOLUTION):
+    """Grid over the overlap of both scenes (and the AOI); ValueError if they do not overlap."""
+    area = footprint(pre_src).intersection(footprint(post_src))
+    if aoi_wkt is not None:
+        area = area.intersection(shapely_wkt.loads(aoi_wkt))
+    if area.is_empty or area.area == 0:
+        raise ValueError(f"{pre_src.name} and {post_src.name} do not overlap"
+                         + (" inside the AOI" if aoi_wkt is not None else ""))
+    return CommonGrid.over(area, resolution)
+
+
+class _GridSource:
+    """One scene resampled onto the grid, one grid window at a time."""
+    def __init__(self, src, grid, resampling, src_nodata):
+        self.src = src
+        self.grid = grid
+        self.resampling = resampling
+        self.src_nodata = src_nodata if src_nodata is not None else src.nodata
+        self.ref, self.crs = georeferencing(src)
+
+    def source_window(self, window):
+        """Source pixels under a grid window (plus a margin), or None outside the scene."""
+        xs, ys = _bbox_outline(rasterio.windows.bounds(window, self.grid.transform))
+        if self.crs != self.grid.crs:
+            xs, ys = warp_transform(self.grid.crs, self.crs, xs, ys)
+        rows, cols = rowcol(self.ref, xs, ys)
+        row0, row1 = max(0, min(rows) - SOURCE_MARGIN), min(self.src.height, max(rows) + 1 + SOURCE_MARGIN)
+        col0, col1 = max(0, min(cols) - SOURCE_MARGIN), min(self.src.width, max(cols) + 1 + SOURCE_MARGIN)
+        if row1 <= row0 or col1 <= col0:
+            return None
+        return Window(int(col0), int(row0), int(col1 - col0), int(row1 - row0))
+
+    def read(self, window):
+        out = np.full((int(window.height), int(window.width)), np.nan, dtype="float32")
+        src_window = self.source_window(window)
+        if src_window is None:
+            return out
+        data = self.src.read(1, window=src_window).astype("float32")
+        if isinstance(self.ref, list):
+            # GCP-georeferenced: tie points shifted into the window
+            row0, col0 = src_window.row_off, src_window.col_off
+            georef = {"gcps": [GroundControlPoint(row=g.row - row0, col=g.col - col0, x=g.x, y=g.y, z=g.z)
+                               for g in self.ref]}
+        else:
+            georef = {"src_transform": rasterio.windows.transform(src_window, self.ref)}
+        reproject(data, out, src_crs=self.crs, src_nodata=self.src_nodata,
+                  dst_transform=rasterio.windows.transform(window, self.grid.transform),
+                  dst_crs=self.grid.crs, dst_nodata=np.nan, resampling=self.resampling, **georef)
+        return out
+
+
+class AlignedPair:
+    """
+    pre and post resampled onto one CommonGrid on demand. Every thread opens its own
+    datasets (GDAL handles are not thread-safe); close() releases all of them.
+    """
+    def __init__(self, pre_path, post_path, grid, resampling=Resampling.bilinear, src_nodata=None):
+        self.paths = (pre_path, post_path)
+        self.grid = grid
+        self.resampling = resampling
+        self.src_nodata = src_nodata  # None: each file's own nodata
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def _sources(self):
+        sources = getattr(self._local, "sources", None)
+        if sources is None:
+            sources = []
+            for path in self.paths:
+                src = rasterio.open(path)
+                with self._lock:
+                    self._opened.append(src)
+                sources.append(_GridSource(src, self.grid, self.resampling, self.src_nodata))
+            self._local.sources = sources
+        return sources
+
+    def read(self, window):
+        """(pre, post) float32 arrays of one grid window, NaN where a scene has no data."""
+        pre, post = self._sources()
+        return pre.read(window), post.read(window)
+
+    def diff(self, window):
+        """pre - post over one grid window."""
+        pre, post = self.read(window)
+        np.subtract(pre, post, out=pre)
+        return pre
+
+    def close(self):
+        for ds in self._opened:
+            ds.close()
+        self._opened.clear()
@@ -1,6 +1,14 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text
+from sqlalchemy import (create_engine, inspect, text, select, table, column, and_, or_,
+                        Column, Integer, String, Float, DateTime, Text, LargeBinary)
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, declarative_base
 from datetime import datetime
+import numpy as np
+import shapely
+from shapely import wkb, wkt
+
+RTREE_TABLE = "flood_events_rtree"
+QUERY_BATCH = 512  # candidate rows fetched per round trip while filtering a page
 
 Base = declarative_base()
 
@@ -12,25 +20,104 @@ class FloodEvent(Base):
     pre_product_id = Column(String, nullable=False)
     post_product_id = Column(String, nullable=False)
     pre_date = Column(DateTime, nullable=False)
-    post_date = Column(DateTime, nullable=False)
+    post_date = Column(DateTime, nullable=False, index=True)
     flood_mask_path = Column(String, nullable=False)
     flooded_pct = Column(Float, nullable=False)
-    flood_geom = Column(Text)  
+    flood_geom = Column(Text)  # legacy WKT; new rows store WKB in flood_geom_wkb
+    flood_geom_wkb = Column(LargeBinary)
+    # lon/lat bounding box of the AOI, mirrored into the R-tree
+    min_lon = Column(Float)
+    min_lat = Column(Float)
+    max_lon = Column(Float)
+    max_lat = Column(Float)
+
+    @property
+    def geometry(self):
+        """Flooded area as a shapely geometry (mask CRS), from whichever column is set."""
+        if self.flood_geom_wkb is not None:
+            return wkb.loads(self.flood_geom_wkb)
+        return wkt.loads(self.flood_geom) if self.flood_geom else None
+
 engine = create_engine("sqlite:///flood_risk.db")
 Base.metadata.create_all(engine)
 SessionLocal = sessionmaker(bind=engine)
 
+rtree = table(RTREE_TABLE, column("id"), column("min_lon"), column("max_lon"), column("min_lat"), column("max_lat"))
+HAS_RTREE = False  # set by _migrate(); without the SQLite R-tree module the bbox columns are filtered directly
+
+def _bbox(aoi_wkt):
+    return wkt.loads(aoi_wkt).bounds
+
+def _create_rtree(conn):
+    """R-tree over the bbox columns, kept in sync by triggers (so any writer keeps it current)."""
+    t = FloodEvent.__tablename__
+    conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} USING rtree(id, min_lon, max_lon, min_lat, max_lat)"))
+    upsert = (f"INSERT OR REPLACE INTO {RTREE_TABLE} VALUES (new.id, new.min_lon, new.max_lon, new.min_lat, new.max_lat)")
+    conn.execute(text(f"""CREATE TRIGGER IF NOT EXISTS {t}_rtree_insert AFTER INSERT ON {t}
+        WHEN new.min_lon IS NOT NULL BEGIN {upsert}; END"""))
+    conn.execute(text(f"""CREATE TRIGGER IF NOT EXISTS {t}_rtree_update AFTER UPDATE OF min_lon, min_lat, max_lon, max_lat ON {t}
+        WHEN new.min_lon IS NOT NULL BEGIN {upsert}; END"""))
+    conn.execute(text(f"""CREATE TRIGGER IF NOT EXISTS {t}_rtree_delete AFTER DELETE ON {t}
+        BEGIN DELETE FROM {RTREE_TABLE} WHERE id = old.id; END"""))
+
+def _migrate(engine):
+    """
+    create_all() does not alter existing tables: add columns and indexes introduced
+    since, create the R-tree and backfill bounding boxes of older rows.
+    """
+    global HAS_RTREE
+    t = FloodEvent.__tablename__
+    existing = {c["name"] for c in inspect(engine).get_columns(t)}
+    with engine.begin() as conn:
+        if "flood_geom_wkb" not in existing:
+            conn.execute(text(f"ALTER TABLE {t} ADD COLUMN flood_geom_wkb BLOB"))
+        for name in ("min_lon", "min_lat", "max_lon", "max_lat"):
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {t} ADD COLUMN {name} FLOAT"))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{t}_post_date ON {t} (post_date)"))
+
+    try:
+        with engine.begin() as conn:
+            _create_rtree(conn)
+        HAS_RTREE = True
+    except OperationalError:
+        HAS_RTREE = False  # SQLite built without the R-tree module
+
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"SELECT id, aoi_wkt FROM {t} WHERE min_lon IS NULL")).fetchall()
+        # unparsable AOIs get no bbox and never match spatial queries
+        bounds = shapely.bounds(shapely.from_wkt([r[1] for r in rows], on_invalid="ignore")) if rows else []
+        updates = [{"id": r[0], "a": b[0], "b": b[1], "c": b[2], "d": b[3]}
+                   for r, b in zip(rows, bounds.tolist() if rows else []) if b[0] == b[0]]  # NaN: no geometry
+        if updates:
+            conn.execute(text(f"UPDATE {t} SET min_lon = :a, min_lat = :b, max_lon = :c, max_lat = :d WHERE id = :id"),
+                         updates)
+        if HAS_RTREE:
+            # rows written while the R-tree did not exist yet
+            conn.execute(text(f"""INSERT INTO {RTREE_TABLE}
+                SELECT id, min_lon, max_lon, min_lat, max_lat FROM {t}
+                WHERE min_lon IS NOT NULL AND id NOT IN (SELECT id FROM {RTREE_TABLE})"""))
+
+_migrate(engine)
+
 def save_flood_result(aoi_wkt, pre_product, post_product, flood_mask_path, flooded_pct, flooded_geom):
+    """flooded_geom: WKB bytes (detect_flood) or, for older callers, a WKT string."""
+    minx, miny, maxx, maxy = _bbox(aoi_wkt)
     session = SessionLocal()
     event = FloodEvent(
         aoi_wkt=aoi_wkt,
+        min_lon=minx,
+        min_lat=miny,
+        max_lon=maxx,
+        max_lat=maxy,
         pre_product_id=pre_product["id"],
         post_product_id=post_product["id"],
         pre_date=datetime.fromisoformat(pre_product["properties"]["startDate"].replace("Z", "")),
         post_date=datetime.fromisoformat(post_product["properties"]["startDate"].replace("Z", "")),
         flood_mask_path=flood_mask_path,
         flooded_pct=flooded_pct,
-        flood_geom=flooded_geom
+        flood_geom=flooded_geom if isinstance(flooded_geom, str) else None,
+        flood_geom_wkb=flooded_geom if isinstance(flooded_geom, (bytes, bytearray)) else None
     )
     session.add(event)
     session.commit()
@@ -50,3 +137,88 @@ def get_flood_events(aoi_filter=None, date_range=None):
     results = query.all()
     session.close()
     return results
+
+def _rtree_bounds(lo, hi):
+    """
+    (lo, hi) as the SQLite R-tree stores them: float32, nudged outwards by a relative
+    2**-23 whenever rounding went inwards (rtreeValueDown / rtreeValueUp in rtree.c).
+    """
+    down, up = 1.0 - 1.0 / 8388608.0, 1.0 + 1.0 / 8388608.0
+    f_lo, f_hi = float(np.float32(lo)), float(np.float32(hi))  # compare in double precision
+    if f_lo > lo:
+        f_lo = float(np.float32(lo * (up if lo < 0 else down)))
+    if f_hi < hi:
+        f_hi = float(np.float32(hi * (down if hi < 0 else up)))
+    return f_lo, f_hi
+
+def _bbox_filter(bounds, within):
+    """
+    SQL condition on the event bbox: overlapping `bounds`, or inside it for within.
+    R-tree boxes are float32 rounded outwards, so for within the query box is widened
+    the same way (an event's own AOI must still match); the exact test in
+    query_flood_events then decides.
+    """
+    minx, miny, maxx, maxy = bounds
+    cols = rtree.c if HAS_RTREE else FloodEvent
+    if within and HAS_RTREE:
+        (minx, maxx), (miny, maxy) = _rtree_bounds(minx, maxx), _rtree_bounds(miny, maxy)
+    if within:
+        cond = and_(cols.min_lon >= minx, cols.max_lon <= maxx, cols.min_lat >= miny, cols.max_lat <= maxy)
+    else:
+        cond = and_(cols.max_lon >= minx, cols.min_lon <= maxx, cols.max_lat >= miny, cols.min_lat <= maxy)
+    return FloodEvent.id.in_(select(rtree.c.id).where(cond)) if HAS_RTREE else cond
+
+def query_flood_events(intersects=None, within=None, start=None, end=None, limit=100, after=None):
+    """
+    Flood events, newest post_date first, one page at a time.
+
+    intersects / within: geometry (shapely or WKT, lon/lat) the event AOI must intersect /
+    lie within. Candidates come from the R-tree on the AOI bounding boxes and only those
+    are tested exactly. start / end bound post_date (inclusive).
+    Pagination is by cursor: pass the returned `next_after` as `after` for the next page
+    (None when there is none), so deep pages cost the same as the first one.
+    Returns (events, next_after).
+    """
+    if limit <= 0:
+        return [], after
+    area, is_within = (within, True) if within is not None else (intersects, False)
+    if isinstance(area, str):
+        area = wkt.loads(area)
+    if area is not None:
+        shapely.prepare(area)
+
+    session = SessionLocal()
+    try:
+        query = session.query(FloodEvent)
+        if area is not None:
+            query = query.filter(_bbox_filter(area.bounds, is_within))
+        if start is not None:
+            query = query.filter(FloodEvent.post_date >= start)
+        if end is not None:
+            query = query.filter(FloodEvent.post_date <= end)
+        query = query.order_by(FloodEvent.post_date.desc(), FloodEvent.id.desc())
+
+        page, cursor = [], after
+        while True:
+            batch_query = query
+            if cursor is not None:
+                post_date, event_id = cursor
+                batch_query = batch_query.filter(or_(FloodEvent.post_date < post_date,
+                                                     and_(FloodEvent.post_date == post_date, FloodEvent.id < event_id)))
+            size = QUERY_BATCH if area is not None else limit - len(page)
+            batch = batch_query.limit(size).all()
+            if area is not None and batch:
+                aois = shapely.from_wkt([e.aoi_wkt for e in batch], on_invalid="ignore")
+                hits = shapely.within(aois, area) if is_within else shapely.intersects(aois, area)
+            else:
+                hits = [True] * len(batch)
+            for event, hit in zip(batch, hits):
+                cursor = (event.post_date, event.id)  # rejected candidates are skipped for good
+                if hit:
+                    page.append(event)
+                    if len(page) == limit:
+                        return page, cursor
+            if len(batch) < size:
+                return page, None
+    finally:
+        session.close()
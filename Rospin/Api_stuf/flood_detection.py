@@ -1,8 +1,22 @@
 import os
+import re
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import rasterio
 import numpy as np
-import rasterio.features
-from shapely.geometry import shape, MultiPolygon
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from aoi_window import aoi_window, window_transform
+from cog import write_cog
+from coregister import GRID_RESOLUTION, AlignedPair, common_grid
+from flood_polygons import MIN_MAPPING_UNIT_PX, polygonize_mask, to_wkb
+
+BLOCK_SIZE = 1024        # pixels per block side in the windowed passes
+MAX_HIST_BINS = 1 << 18  # integer differences up to this range get one exact bin per value
+S1_NODATA = 0            # GRD measurement TIFFs pad the swath border with 0, without a nodata tag
 
 def find_measurement_tiff(safe_dir):
     """
@@ -16,53 +30,196 @@ def find_measurement_tiff(safe_dir):
                     return os.path.join(measurement_dir, f)
     raise FileNotFoundError(f"No measurement TIFF found in SAFE folder: {safe_dir}")
 
-def get_sentinel1_georef(safe_path):
+def find_measurement_member(zip_path, polarisation=None):
+    """
+    Locate the first measurement GeoTIFF inside a Sentinel-1 .zip using only the
+    central directory, and return a /vsizip/ path rasterio can open in place.
+    """
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        for name in zf.namelist():
+            parts = name.lower().split("/")
+            if len(parts) >= 2 and parts[-2] == "measurement" and parts[-1].endswith((".tif", ".tiff")):
+                if polarisation and f"-{polarisation.lower()}-" not in parts[-1]:
+                    continue
+                return f"/vsizip/{os.path.abspath(zip_path)}/{name}"
+    raise FileNotFoundError(f"No measurement TIFF found in SAFE archive: {zip_path}")
+
+def measurement_path(safe_path):
+    """Measurement TIFF of an extracted .SAFE folder or .zip product; other paths are returned as is."""
     if os.path.isdir(safe_path):
-        tiff_path = find_measurement_tiff(safe_path)
-    else:
-        tiff_path = safe_path
+        return find_measurement_tiff(safe_path)
+    if safe_path.lower().endswith(".zip"):
+        return find_measurement_member(safe_path)
+    return safe_path
+
+def _region(src, aoi_wkt):
+    if aoi_wkt is None:
+        return Window(0, 0, src.width, src.height)
+    window = aoi_window(src, aoi_wkt)
+    if window is None:
+        raise ValueError(f"AOI does not intersect {src.name}")
+    return window
+
+def get_sentinel1_georef(safe_path, aoi_wkt=None):
+    """
+    safe_path may be an extracted .SAFE folder, a .zip product or a measurement TIFF
+    (plain path or /vsizip/ path).
+    With aoi_wkt (lon/lat), only the window covering the AOI is read, and the
+    returned transform/crs describe that window (GCP fit for GRD products).
+    """
+    tiff_path = measurement_path(safe_path)
     with rasterio.open(tiff_path) as src:
-        arr = src.read(1).astype("float32")
-        return arr, src.transform, src.crs
+        if aoi_wkt is None:
+            arr = src.read(1).astype("float32")
+            return arr, src.transform, src.crs
+        window = _region(src, aoi_wkt)
+        arr = src.read(1, window=window).astype("float32")
+        win_transform, crs = window_transform(src, window)
+        return arr, win_transform, crs
+
+def _blocks(height, width, block_size):
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+def _map_blocks(fn, blocks, workers):
+    """fn over every block, in block order; threaded when workers > 1."""
+    if workers <= 1:
+        return [fn(b) for b in blocks]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fn, blocks))
 
-def detect_flood(pre_safe, post_safe, output_mask):
+def _diff_threshold(reader, blocks, percentile, workers, integer):
     """
-    Detects flooded areas between two Sentinel-1 .SAFE folders
+    Percentile of the difference image from streaming passes, matching np.percentile
+    (linear interpolation). Pass 1 takes min/max/count, which already answers p=0 and
+    p=100 exactly. Otherwise pass 2 histograms the differences over [min, max]: with one
+    bin per value for integer inputs (exact), else MAX_HIST_BINS bins (bin centres).
+    """
+    def extent(block):
+        d = reader.diff(block)
+        d = d[np.isfinite(d)]
+        return (float(d.min()), float(d.max()), d.size) if d.size else (np.inf, -np.inf, 0)
+
+    parts = _map_blocks(extent, blocks, workers)
+    vmin = min(p[0] for p in parts)
+    vmax = max(p[1] for p in parts)
+    n = sum(p[2] for p in parts)
+    if n == 0:
+        return np.nan
+    if percentile <= 0 or vmax == vmin:
+        return vmin
+    if percentile >= 100:
+        return vmax
+
+    if integer and vmax - vmin < MAX_HIST_BINS:
+        bins, lo, hi = int(vmax - vmin) + 1, vmin - 0.5, vmax + 0.5
+    else:
+        bins, lo, hi = MAX_HIST_BINS, vmin, vmax
+
+    def histogram(block):
+        d = reader.diff(block)
+        return np.histogram(d[np.isfinite(d)], bins=bins, range=(lo, hi))[0]
+
+    counts = np.sum(_map_blocks(histogram, blocks, workers), axis=0)
+    cum = np.cumsum(counts)
+    centres = lo + (np.arange(bins) + 0.5) * (hi - lo) / bins
+
+    def order_stat(i):
+        return centres[int(np.searchsorted(cum, i, side="right"))]
+
+    rank = percentile / 100.0 * (n - 1)
+    below = int(np.floor(rank))
+    v0, v1 = order_stat(below), order_stat(min(below + 1, n - 1))
+    return float(v0 + (rank - below) * (v1 - v0))
+
+def event_mask_path(output_dir, pre_product, post_product):
+    """
+    Unique mask path per flood event (run): post/pre acquisition dates, product ids and
+    the creation time, so earlier masks referenced by stored events are never overwritten.
+    """
+    def date(product):
+        return product["properties"]["startDate"][:10].replace("-", "")
+
+    def short_id(product):
+        return re.sub(r"[^A-Za-z0-9]", "", str(product["id"]))[:8]
+
+    created = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    name = f"flood_mask_{date(post_product)}_{date(pre_product)}_{short_id(post_product)}_{short_id(pre_product)}_{created}.tif"
+    return os.path.join(output_dir, name)
+
+def detect_flood(pre_safe, post_safe, output_mask, aoi_wkt=None, percentile=0.0,
+                 block_size=BLOCK_SIZE, workers=1, min_pixels=MIN_MAPPING_UNIT_PX, tolerance=None,
+                 resolution=GRID_RESOLUTION, resampling=Resampling.bilinear):
+    """
+    Detects flooded areas between two Sentinel-1 .SAFE folders (or their .zip archives)
     and writes a flood mask GeoTIFF.
-    Returns: output_mask path, flooded percentage, flooded polygons WKT.
+
+    The scenes may come from different frames or orbits: both are warped lazily onto
+    one UTM grid (resolution in m) over their overlap, clipped to aoi_wkt if given, and
+    the mask covers that grid. Only source pixels under the overlap are decoded.
+    Pixels outside either scene are 0 in the mask and do not count in the percentage.
+
+    Works block by block, so peak memory depends on block_size, not on the scene:
+    the threshold (percentile of pre - post) comes from streaming passes, then the
+    mask is computed and written per block (workers threads). Polygons are sieved to
+    min_pixels and simplified to tolerance (mask CRS units), see flood_polygons.
+    The mask is written as a 1-bit DEFLATE Cloud-Optimised GeoTIFF with overviews.
+    Returns: output_mask path, flooded percentage, flooded polygons WKB.
     """
-    pre_arr, pre_transform, pre_crs = get_sentinel1_georef(pre_safe)
-    post_arr, post_transform, post_crs = get_sentinel1_georef(post_safe)
+    pre_path, post_path = measurement_path(pre_safe), measurement_path(post_safe)
+    with rasterio.open(pre_path) as pre_src, rasterio.open(post_path) as post_src:
+        grid = common_grid(pre_src, post_src, aoi_wkt, resolution)
+        # resampled values are no longer integers unless picked by nearest neighbour
+        integer = resampling == Resampling.nearest and all(
+            np.issubdtype(np.dtype(s.dtypes[0]), np.integer) for s in (pre_src, post_src))
 
-    # Difference and threshold
-    diff = pre_arr - post_arr
-    threshold = np.percentile(diff, 0)  # adjust as needed
-    flood_mask = (diff > threshold).astype("uint8")
+    height, width = grid.height, grid.width
+    blocks = list(_blocks(height, width, block_size))
+    reader = AlignedPair(pre_path, post_path, grid, resampling=resampling, src_nodata=S1_NODATA)
 
-    # Prepare metadata for output mask
     meta = {
         "driver": "GTiff",
         "dtype": "uint8",
         "count": 1,
-        "height": flood_mask.shape[0],
-        "width": flood_mask.shape[1],
-        "transform": post_transform,
-        "crs": post_crs
+        "height": height,
+        "width": width,
+        "transform": grid.transform,
+        "crs": grid.crs,
+        "tiled": True,
+        "blockxsize": 512,
+        "blockysize": 512,
+        "compress": "deflate",
     }
+    write_lock = threading.Lock()
+    # blocks land in a plain tiled GeoTIFF first; the COG is derived from it at the end
+    blocks_path = f"{output_mask}.blocks.tif"
+
+    try:
+        threshold = _diff_threshold(reader, blocks, percentile, workers, integer)
+
+        with rasterio.open(blocks_path, "w", **meta) as dst:
+            def mask_block(block):
+                d = reader.diff(block)
+                flood_mask = (d > threshold).astype("uint8")
+                with write_lock:
+                    dst.write(flood_mask, 1, window=block)
+                return int(flood_mask.sum()), int(np.isfinite(d).sum())
 
-    # Write flood mask
-    with rasterio.open(output_mask, "w", **meta) as dst:
-        dst.write(flood_mask, 1)
+            counts = _map_blocks(mask_block, blocks, workers)
+            flooded = sum(f for f, _ in counts)
+            valid = sum(v for _, v in counts)
+    finally:
+        reader.close()
 
-    # Extract polygons of flooded areas
-    flooded_shapes = [
-        shape(geom)
-        for geom, value in rasterio.features.shapes(flood_mask, mask=flood_mask, transform=post_transform)
-        if value == 1
-    ]
-    flooded_geom = MultiPolygon(flooded_shapes).wkt if flooded_shapes else None
+    try:
+        flooded_geom = to_wkb(polygonize_mask(blocks_path, min_pixels=min_pixels, tolerance=tolerance,
+                                              workers=workers))
+        write_cog(blocks_path, output_mask, nbits=1, resampling=Resampling.mode)
+    finally:
+        os.remove(blocks_path)
 
     # Percentage flooded
-    flooded_pct = 100 * flood_mask.sum() / flood_mask.size
+    flooded_pct = 100 * flooded / float(valid) if valid else 0.0
 
     return output_mask, flooded_pct, flooded_geom
@@ -0,0 +1,113 @@
+# flood_polygons.py
+"""
+Vectorisation of a flood mask GeoTIFF into one compact (multi)polygon.
+
+The mask is processed tile by tile on a thread pool:
+- each tile is read with a halo of min_pixels and sieved (regions smaller than
+  the minimum mapping unit are dropped, small holes filled). A region smaller
+  than min_pixels always fits inside the halo, so the result is the same as
+  sieving the whole mask at once;
+- the sieved tile core is vectorised (4-connected, so every polygon is valid);
+  polygons touching the tile border are set aside for the merge.
+Border polygons are then unioned across tiles, and all polygons are simplified
+together as a coverage (shapely >= 2.1), so neighbouring parts never overlap
+after simplification; older shapely simplifies polygon by polygon. Tolerance
+is in mask CRS units (one pixel by default).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+import rasterio.features
+import shapely
+from rasterio.windows import Window
+from shapely import wkb
+from shapely.geometry import MultiPolygon, box, shape
+
+MIN_MAPPING_UNIT_PX = 16  # 16 GRD pixels = 1600 m2
+POLYGON_TILE_SIZE = 2048
+
+def _tiles(height, width, tile_size):
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            yield Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+
+def _simplify(polygons, tolerance):
+    if not tolerance or not len(polygons):
+        return polygons
+    if hasattr(shapely, "coverage_simplify"):
+        return shapely.coverage_simplify(polygons, tolerance)
+    return shapely.simplify(polygons, tolerance, preserve_topology=True)
+
+def polygonize_mask(mask_path, min_pixels=MIN_MAPPING_UNIT_PX, tolerance=None,
+                    tile_size=POLYGON_TILE_SIZE, workers=1, connectivity=8):
+    """
+    Flooded (value 1) areas of a mask GeoTIFF as a shapely MultiPolygon in the mask
+    CRS, or None when nothing is left after sieving.
+    """
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+
+    with rasterio.open(mask_path) as src:
+        height, width, transform = src.height, src.width, src.transform
+    if tolerance is None:
+        tolerance = abs(transform.a)
+    halo = max(0, int(min_pixels)) if min_pixels and min_pixels > 1 else 0
+
+    def source():
+        src = getattr(local, "src", None)
+        if src is None:
+            src = local.src = rasterio.open(mask_path)
+            with lock:
+                opened.append(src)
+        return src
+
+    def work(tile):
+        row0, col0 = max(0, tile.row_off - halo), max(0, tile.col_off - halo)
+        row1 = min(height, tile.row_off + tile.height + halo)
+        col1 = min(width, tile.col_off + tile.width + halo)
+        data = source().read(1, window=Window(col0, row0, col1 - col0, row1 - row0))
+        data = (data == 1).astype("uint8")
+        if halo:
+            data = rasterio.features.sieve(data, size=halo, connectivity=connectivity)
+        r, c = tile.row_off - row0, tile.col_off - col0
+        core = np.ascontiguousarray(data[r:r + tile.height, c:c + tile.width])
+        if not core.any():
+            return np.empty(0, dtype=object), np.empty(0, dtype=object)
+
+        tile_transform = rasterio.windows.transform(tile, transform)
+        border = box(*rasterio.windows.bounds(tile, transform)).boundary
+        polygons = np.array([
+            shape(geom)
+            for geom, value in rasterio.features.shapes(core, mask=core.astype(bool), transform=tile_transform)
+            if value == 1
+        ], dtype=object)
+        on_border = shapely.intersects(polygons, border)
+        return polygons[~on_border], polygons[on_border]
+
+    tiles = list(_tiles(height, width, tile_size))
+    try:
+        if workers <= 1:
+            results = [work(t) for t in tiles]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(work, tiles))
+    finally:
+        for src in opened:
+            src.close()
+
+    polygons = [inner for inner, _ in results]
+    edge = np.concatenate([e for _, e in results])
+    if len(edge):
+        # polygons cut by tile borders are joined again
+        merged = shapely.get_parts(shapely.union_all(edge))
+        polygons.append(merged[shapely.get_type_id(merged) == 3])
+    polygons = _simplify(np.concatenate(polygons), tolerance)
+    polygons = polygons[~shapely.is_empty(polygons)]
+    return MultiPolygon(list(polygons)) if len(polygons) else None
+
+def to_wkb(geom):
+    """Compact binary encoding for storage; None stays None."""
+    return wkb.dumps(geom) if geom is not None else None
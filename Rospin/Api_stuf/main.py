@@ -6,9 +6,11 @@ from shapely.ops import transform
 import pyproj
 from getpass import getpass
 
-from copernicus_downloader import get_tokens, search_products, download_and_extract
-from flood_detection import detect_flood
-from database import save_flood_result, get_flood_events
+from copernicus_downloader import CopernicusClient, search_products, download_and_extract
+from flood_detection import detect_flood, event_mask_path
+from database import save_flood_result, query_flood_events
+from product_store import ProductStore
+from product_selection import aoi_geometry, select_cover
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Flood risk assessment with Sentinel-1 data.")
@@ -22,6 +24,24 @@ def parse_arguments():
                         help="Buffer around AOI in meters (default: 2000m)")
     parser.add_argument("--download_dir", type=str, default="copernicus_data_S1",
                         help="Directory to store downloaded Sentinel-1 products")
+    parser.add_argument("--min_coverage", type=float, default=0.95,
+                        help="Fraction of the AOI a scene footprint must cover (default: 0.95)")
+    parser.add_argument("--quota_gb", type=float, default=None,
+                        help="Disk quota of the product store in GB (LRU eviction); unlimited if omitted")
+    parser.add_argument("--no_extract", action="store_true",
+                        help="Keep products zipped and read the measurement TIFF in place (/vsizip/)")
+    parser.add_argument("--clip_aoi", action="store_true",
+                        help="Only read the AOI window of each scene; the flood mask covers the AOI")
+    parser.add_argument("--block_size", type=int, default=1024,
+                        help="Block side in pixels for change detection; bounds its memory use (default: 1024)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Threads processing change-detection blocks (default: 1)")
+    parser.add_argument("--min_pixels", type=int, default=16,
+                        help="Minimum mapping unit in pixels; smaller flooded regions are sieved out (default: 16)")
+    parser.add_argument("--simplify", type=float, default=None,
+                        help="Polygon simplification tolerance in mask CRS units (default: one pixel)")
+    parser.add_argument("--resolution", type=float, default=10.0,
+                        help="Pixel size in m of the common UTM grid pre/post are aligned on (default: 10)")
     return parser.parse_args()
 
 def prepare_aoi(aoi_str, buffer_m):
@@ -61,50 +81,66 @@ def main():
         args.password = getpass("Enter Copernicus password: ")
 
     os.makedirs(args.download_dir, exist_ok=True)
+    store = ProductStore(args.download_dir, quota_bytes=int(args.quota_gb * 1024 ** 3) if args.quota_gb else None)
 
     # Prepare AOI
     aoi_wkt = prepare_aoi(args.aoi, args.buffer)
 
     # Authenticate
-    access_token, refresh_token = get_tokens(args.username, args.password)
-    headers = {"Authorization": f"Bearer {access_token}"}
+    client = CopernicusClient(args.username, args.password, pool_size=2)
 
     # Search
-    products = search_products(headers, aoi_wkt, args.start, args.end)
+    products = search_products(client, aoi_wkt, args.start, args.end)
     if not products:
         print("No products found.")
         return
 
-    products.sort(key=lambda x: x["properties"]["startDate"])
-    pre_product, post_product = products[0], products[-1]
+    # Best single scene per acquisition date, by AOI coverage; prefer products already stored
+    groups = select_cover(products, aoi_geometry(aoi_wkt), threshold=args.min_coverage,
+                          max_scenes=1, download_dir=args.download_dir, store=store)
+    covering = sorted((g for g in groups if g["coverage"] >= args.min_coverage), key=lambda g: g["date"])
+    if len(covering) < 2:
+        print(f"Need two acquisition dates covering {100 * args.min_coverage:.0f}% of the AOI, found {len(covering)}.")
+        return
+    pre_product, post_product = covering[0]["products"][0], covering[-1]["products"][0]
 
     # Download & extract
-    pre_path = download_and_extract(pre_product, headers, args.download_dir)
-    post_path = download_and_extract(post_product, headers, args.download_dir)
+    store.pin([pre_product["id"], post_product["id"]])
+    pre_path = download_and_extract(pre_product, client, args.download_dir, extract=not args.no_extract, store=store)
+    post_path = download_and_extract(post_product, client, args.download_dir, extract=not args.no_extract, store=store)
 
-    # Pick one TIFF file from SAFE folder (simplified)
-    pre_measurements = find_measurement_folder(pre_path)
-    post_measurements = find_measurement_folder(post_path)
+    if args.no_extract:
+        # detect_flood opens the measurement member straight from the zip
+        pre_tif, post_tif = pre_path, post_path
+    else:
+        # Pick one TIFF file from SAFE folder (simplified)
+        pre_measurements = find_measurement_folder(pre_path)
+        post_measurements = find_measurement_folder(post_path)
 
-    pre_tif_files = [os.path.join(pre_measurements, f) for f in os.listdir(pre_measurements) if f.endswith(".tiff")]
-    post_tif_files = [os.path.join(post_measurements, f) for f in os.listdir(post_measurements) if f.endswith(".tiff")]
+        pre_tif_files = [os.path.join(pre_measurements, f) for f in os.listdir(pre_measurements) if f.endswith(".tiff")]
+        post_tif_files = [os.path.join(post_measurements, f) for f in os.listdir(post_measurements) if f.endswith(".tiff")]
 
-    if not pre_tif_files or not post_tif_files:
-        raise FileNotFoundError("No .tiff files found in measurement folders.")
+        if not pre_tif_files or not post_tif_files:
+            raise FileNotFoundError("No .tiff files found in measurement folders.")
 
-    pre_tif = pre_tif_files[0]
-    post_tif = post_tif_files[0]
+        pre_tif = pre_tif_files[0]
+        post_tif = post_tif_files[0]
 
     # Flood detection
-    mask_path, flooded_pct, flooded_geom = detect_flood(pre_tif, post_tif, os.path.join(args.download_dir, "flood_mask.tif"))
+    mask_path, flooded_pct, flooded_geom = detect_flood(pre_tif, post_tif,
+                                                        event_mask_path(args.download_dir, pre_product, post_product),
+                                                        aoi_wkt=aoi_wkt if args.clip_aoi else None,
+                                                        block_size=args.block_size, workers=args.workers,
+                                                        min_pixels=args.min_pixels, tolerance=args.simplify,
+                                                        resolution=args.resolution)
 
     # Save results
     save_flood_result(aoi_wkt, pre_product, post_product, mask_path, flooded_pct, flooded_geom)
     print(f"Flood detection completed. {flooded_pct:.2f}% flooded. Results saved to DB.")
 
     # Show DB results
-    events = get_flood_events()
-    print("\nStored flood events:")
+    events, _ = query_flood_events(intersects=aoi_wkt, limit=10)
+    print("\nLatest stored flood events intersecting the AOI:")
     for e in events:
         print(f" - Event {e.id}: {e.flooded_pct:.2f}% flooded on {e.post_date.date()}")
 
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flood_detection import MAX_HIST_BINS, _blocks, _diff_threshold  # noqa: E402
+
+PERCENTILES = [0.0, 0.5, 5.0, 33.3, 50.0, 95.0, 100.0]
+
+
+class _Reader:
+    """Serves windows of a precomputed difference image, like AlignedPair.diff."""
+
+    def __init__(self, diff):
+        self.array = diff
+
+    def diff(self, window):
+        return self.array[window.toslices()]
+
+
+def _finite(diff):
+    return diff[np.isfinite(diff)]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("percentile", PERCENTILES)
+def test_integer_differences_match_np_percentile(percentile, workers):
+    rng = np.random.default_rng(0)
+    diff = rng.integers(-500, 800, size=(300, 260)).astype(np.float32)
+    diff[rng.random(diff.shape) < 0.1] = np.nan
+    got = _diff_threshold(_Reader(diff), list(_blocks(*diff.shape, 64)), percentile, workers, integer=True)
+    assert got == pytest.approx(np.percentile(_finite(diff), percentile), abs=1e-9)
+
+
+@pytest.mark.parametrize("percentile", PERCENTILES)
+def test_float_differences_match_np_percentile_to_a_bin(percentile):
+    rng = np.random.default_rng(1)
+    diff = rng.normal(0.0, 3.0, size=(256, 256)).astype(np.float32)
+    diff[:5] = np.inf
+    values = _finite(diff)
+    bin_width = float(values.max() - values.min()) / MAX_HIST_BINS
+    got = _diff_threshold(_Reader(diff), list(_blocks(*diff.shape, 100)), percentile, 2, integer=False)
+    assert got == pytest.approx(np.percentile(values, percentile), abs=bin_width)
+
+
+def test_no_finite_difference_gives_nan():
+    diff = np.full((8, 8), np.nan, dtype=np.float32)
+    assert np.isnan(_diff_threshold(_Reader(diff), list(_blocks(*diff.shape, 4)), 50.0, 1, integer=True))
@@ -0,0 +1,53 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+AOI = "POLYGON((26.1 44.4, 26.2 44.4, 26.2 44.5, 26.1 44.5, 26.1 44.4))"
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the module opens ./flood_risk.db
+    sys.modules.pop("database", None)
+    module = importlib.import_module("database")
+    yield module
+    module.engine.dispose()
+    sys.modules.pop("database", None)
+
+
+def _save(database, aoi_wkt, day):
+    product = {"id": f"p{day}", "properties": {"startDate": f"2023-01-{day:02d}T00:00:00Z"}}
+    database.save_flood_result(aoi_wkt, product, product, "mask.tif", 1.0, None)
+
+
+def test_within_its_own_aoi_survives_float32_rtree_bounds(database):
+    _save(database, AOI, 1)
+    within, _ = database.query_flood_events(within=AOI)
+    intersects, _ = database.query_flood_events(intersects=AOI)
+    assert [e.aoi_wkt for e in within] == [AOI]
+    assert [e.aoi_wkt for e in intersects] == [AOI]
+
+
+def test_within_and_intersects_filter_exactly(database):
+    inside = "POLYGON((26.12 44.42, 26.18 44.42, 26.18 44.48, 26.12 44.48, 26.12 44.42))"
+    crossing = "POLYGON((26.15 44.45, 26.3 44.45, 26.3 44.6, 26.15 44.6, 26.15 44.45))"
+    outside = "POLYGON((27 45, 27.1 45, 27.1 45.1, 27 45.1, 27 45))"
+    for day, aoi in enumerate((inside, crossing, outside), start=1):
+        _save(database, aoi, day)
+    within, _ = database.query_flood_events(within=AOI)
+    intersects, _ = database.query_flood_events(intersects=AOI)
+    assert [e.aoi_wkt for e in within] == [inside]
+    assert [e.aoi_wkt for e in intersects] == [crossing, inside]  # newest first
+
+
+def test_pages_follow_the_cursor(database):
+    for day in range(1, 6):
+        _save(database, AOI, day)
+    first, after = database.query_flood_events(intersects=AOI, limit=3)
+    second, last = database.query_flood_events(intersects=AOI, limit=3, after=after)
+    assert [e.post_date.day for e in first + second] == [5, 4, 3, 2, 1]
+    assert last is None
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import rasterio
+import rasterio.features
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flood_polygons import polygonize_mask  # noqa: E402
+
+PIXEL = 10.0
+
+
+def _mask(tmp_path, seed=0, shape=(240, 310)):
+    rng = np.random.default_rng(seed)
+    noise = rng.random(shape)
+    # blobs of every size, from single pixels to regions spanning several tiles
+    smooth = noise.copy()
+    for _ in range(3):
+        smooth = (smooth + np.roll(smooth, 1, 0) + np.roll(smooth, -1, 0)
+                  + np.roll(smooth, 1, 1) + np.roll(smooth, -1, 1)) / 5
+    data = ((smooth > 0.53) | (noise > 0.985)).astype("uint8")
+    path = str(tmp_path / "mask.tif")
+    with rasterio.open(path, "w", driver="GTiff", width=shape[1], height=shape[0], count=1,
+                       dtype="uint8", crs="EPSG:32635", transform=from_origin(500000, 4900000, PIXEL, PIXEL)) as dst:
+        dst.write(data, 1)
+    return path, data
+
+
+@pytest.mark.parametrize("connectivity", [4, 8])
+@pytest.mark.parametrize("tile_size,workers", [(37, 1), (64, 3)])
+def test_tiled_polygons_match_a_full_raster_sieve(tmp_path, tile_size, workers, connectivity):
+    path, data = _mask(tmp_path)
+    whole = polygonize_mask(path, min_pixels=16, tolerance=0, tile_size=4096, connectivity=connectivity)
+    tiled = polygonize_mask(path, min_pixels=16, tolerance=0, tile_size=tile_size,
+                            workers=workers, connectivity=connectivity)
+
+    sieved = rasterio.features.sieve(data, size=16, connectivity=connectivity)
+    assert sieved.sum() < data.sum()  # the sieve had something to drop
+    assert whole.area == pytest.approx(sieved.sum() * PIXEL * PIXEL)
+    assert tiled.area == pytest.approx(whole.area)
+    assert tiled.symmetric_difference(whole).area == pytest.approx(0, abs=1e-6)
+    assert tiled.is_valid
+
+
+def test_nothing_left_after_sieving_gives_none(tmp_path):
+    path = str(tmp_path / "mask.tif")
+    data = np.zeros((50, 50), dtype="uint8")
+    data[10, 10] = data[30, 31] = 1
+    with rasterio.open(path, "w", driver="GTiff", width=50, height=50, count=1, dtype="uint8",
+                       crs="EPSG:32635", transform=from_origin(500000, 4900000, PIXEL, PIXEL)) as dst:
+        dst.write(data, 1)
+    assert polygonize_mask(path, min_pixels=16, tile_size=16) is None
@@ -0,0 +1,103 @@
+# aoi_window.py
+"""
+Pixel window of a raster covering an AOI given in lon/lat (EPSG:4326).
+
+Rasters with a CRS (S2 tiles, terrain-corrected products) get the AOI outline
+reprojected into that CRS. Sentinel-1 GRD measurement TIFFs have no CRS but
+carry the tie-point grid as GCPs; the AOI outline is mapped to pixels through
+rasterio's GCP transformer instead. Either way only the window is ever read.
+"""
+from typing import List, Optional, Tuple
+
+import rasterio
+from rasterio.transform import from_gcps, rowcol, xy
+from rasterio.warp import transform as warp_transform
+from rasterio.windows import Window
+from shapely import wkt as shapely_wkt
+
+AOI_MARGIN_PIXELS = 2   # slack for the GCP fit / pixel-edge rounding
+OUTLINE_POINTS = 16     # points per bbox edge, so curved projections still enclose the AOI
+
+
+def georeferencing(src, gcps=None):
+    """
+    (affine transform or GCP list, crs) mapping pixels to map coordinates; (None, None)
+    if neither. `gcps` (lon/lat, e.g. from the S1 annotation grid) are used when the
+    file itself carries no CRS and no GCPs.
+    """
+    if src.crs is not None:
+        return src.transform, src.crs
+    file_gcps, gcp_crs = src.gcps
+    if file_gcps:
+        return file_gcps, gcp_crs
+    if gcps:
+        return gcps, rasterio.crs.CRS.from_epsg(4326)
+    return None, None
+
+
+def _bbox_outline(bounds, per_edge: int = OUTLINE_POINTS) -> Tuple[List[float], List[float]]:
+    minx, miny, maxx, maxy = bounds
+    t = [i / per_edge for i in range(per_edge)]
+    xs = ([minx + (maxx - minx) * f for f in t] + [maxx] * per_edge +
+          [maxx - (maxx - minx) * f for f in t] + [minx] * per_edge)
+    ys = ([miny] * per_edge + [miny + (maxy - miny) * f for f in t] +
+          [maxy] * per_edge + [maxy - (maxy - miny) * f for f in t])
+    return xs, ys
+
+
+def aoi_window(src, aoi, margin: int = AOI_MARGIN_PIXELS, gcps=None) -> Optional[Window]:
+    """
+    Window of src covering the bounding box of `aoi` (shapely geometry or WKT,
+    lon/lat), clipped to the raster; None if they do not overlap.
+    Raises ValueError if src has no georeferencing at all (see georeferencing for gcps).
+    """
+    if isinstance(aoi, str):
+        aoi = shapely_wkt.loads(aoi)
+    ref, crs = georeferencing(src, gcps)
+    if ref is None:
+        raise ValueError("raster has neither a CRS nor GCPs")
+
+    xs, ys = _bbox_outline(aoi.bounds)
+    if crs is not None and crs != rasterio.crs.CRS.from_epsg(4326):
+        xs, ys = warp_transform("EPSG:4326", crs, xs, ys)
+    rows, cols = rowcol(ref, xs, ys)
+
+    row0, row1 = max(0, min(rows) - margin), min(src.height, max(rows) + 1 + margin)
+    col0, col1 = max(0, min(cols) - margin), min(src.width, max(cols) + 1 + margin)
+    if row1 <= row0 or col1 <= col0:
+        return None
+    return Window(int(col0), int(row0), int(col1 - col0), int(row1 - row0))
+
+
+def window_transform(src, window: Window, gcps=None):
+    """
+    (affine transform, crs) of `window` for writing derived rasters. GCP-only
+    rasters get the best-fit affine of their tie points (approximate over a
+    whole swath, close over a small AOI window).
+    """
+    ref, crs = georeferencing(src, gcps)
+    if ref is None:
+        base = src.transform
+    elif crs is not None and src.crs is not None:
+        base = ref
+    else:
+        base = from_gcps(ref)
+    return rasterio.windows.transform(window, base), crs
+
+
+def window_center_latlon(src, window: Optional[Window] = None, gcps=None) -> Tuple[Optional[float], Optional[float]]:
+    """Centre of `window` (default: the whole raster) in lat/lon, or (None, None)."""
+    ref, crs = georeferencing(src, gcps)
+    if ref is None:
+        return (None, None)
+    window = window or Window(0, 0, src.width, src.height)
+    row = int(window.row_off) + int(window.height) // 2
+    col = int(window.col_off) + int(window.width) // 2
+    try:
+        x, y = xy(ref, row, col)
+        if crs is not None and crs != rasterio.crs.CRS.from_epsg(4326):
+            lon_arr, lat_arr = warp_transform(crs, "EPSG:4326", [x], [y])
+            x, y = lon_arr[0], lat_arr[0]
+        return (float(y), float(x))
+    except Exception:
+        return (None, None)
@@ -0,0 +1,128 @@
+# band_cache.py
+"""
+Opt-in on-disk cache of decoded band arrays as .npy sidecars.
+
+Decoding JPEG2000 S2 bands and large GRD TIFFs dominates feature runs, and it
+is repeated every time a threshold or a feature definition changes. Each read
+(source path + its mtime/size + the read parameters: window, output shape,
+resampling, target grid) is stored once as a .npy file and later mapped back
+with np.load(mmap_mode="r"): no decode and no copy, pages come from the OS
+cache. Arrays larger than memory are built window by window straight into a
+memory-mapped file. The directory is kept under a byte quota by evicting the
+least recently used entries (file mtime is bumped on every hit).
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+BAND_CACHE_DIR = "band_cache"
+
+
+def source_identity(path: str) -> Tuple[str, int, int]:
+    """(file, mtime_ns, size) of a raster path; /vsizip/ paths are identified by their archive."""
+    real = path
+    if path.startswith("/vsizip/"):
+        real = path[len("/vsizip/"):]
+        cut = real.lower().find(".zip/")
+        if cut >= 0:
+            real = real[:cut + 4]
+    st = os.stat(real)
+    return os.path.abspath(real), st.st_mtime_ns, st.st_size
+
+
+class BandCache:
+    def __init__(self, root: str = BAND_CACHE_DIR, quota_bytes: Optional[int] = None):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, path: str, **params) -> str:
+        ident = {"path": path, "source": source_identity(path), "params": params}
+        return hashlib.sha1(json.dumps(ident, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.npy")
+
+    def _tmp(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.npy")
+
+    def load(self, key: str) -> Optional[np.ndarray]:
+        """Read-only memory map of a cached array, or None."""
+        path = self._path(key)
+        try:
+            arr = np.load(path, mmap_mode="r")
+            os.utime(path)  # LRU: most recently used
+            return arr
+        except (OSError, ValueError):
+            return None
+
+    def _publish(self, key: str, tmp: str) -> np.ndarray:
+        path = self._path(key)
+        os.replace(tmp, path)
+        self._evict(keep=path)
+        return np.load(path, mmap_mode="r")
+
+    def store(self, key: str, arr: np.ndarray) -> np.ndarray:
+        """Store an in-memory array; returns its memory map."""
+        tmp = self._tmp(key)
+        np.save(tmp, np.ascontiguousarray(arr))
+        return self._publish(key, tmp)
+
+    def build(self, key: str, shape, dtype, fill: Callable[[np.ndarray], None]) -> np.ndarray:
+        """Create an array of `shape` by letting fill() write into a writable memory map."""
+        tmp = self._tmp(key)
+        try:
+            mm = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=tuple(shape))
+            fill(mm)
+            mm.flush()
+            del mm
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return self._publish(key, tmp)
+
+    def get_or_read(self, key: str, read: Callable[[], np.ndarray]) -> np.ndarray:
+        arr = self.load(key)
+        return arr if arr is not None else self.store(key, read())
+
+    def total_bytes(self) -> int:
+        total = 0
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".npy") and ".tmp." not in entry.name:
+                try:
+                    total += entry.stat().st_size
+                except OSError:
+                    pass
+        return total
+
+    def _evict(self, keep: Optional[str] = None):
+        if self.quota_bytes is None:
+            return
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.root):
+                if entry.name.endswith(".npy") and ".tmp." not in entry.name:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.quota_bytes:
+                    break
+                try:
+                    if keep is not None and os.path.samefile(path, keep):
+                        continue
+                    os.remove(path)  # open memory maps of it stay valid
+                    total -= size
+                except OSError:
+                    pass
@@ -0,0 +1,188 @@
+# cloud_screen.py
+"""
+Pre-screening of Sentinel-2 candidates before any full product is downloaded.
+
+Two sources are combined:
+  * the catalogue `cloudCover` property (whole-tile percentage), and
+  * the product quicklook, from which an AOI-local cloud fraction is estimated
+    by mapping the AOI onto the thumbnail and counting bright, grey pixels.
+The quicklook is a preview of the whole 109.8 km MGRS tile (nodata outside the
+swath included), so the AOI is mapped through the tile extent in its UTM zone,
+decoded from the tile id in the product title; the footprint bounds (data hull
+only) are a fallback for products without one.
+The estimate is coarse (a few hundred pixels per tile) but is far better than
+the tile-wide figure for a small AOI.
+"""
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from rasterio.warp import transform_geom
+from shapely.geometry import mapping, shape
+
+from product_selection import footprint
+
+# optional quicklook decoding (only used if installed)
+try:
+    from PIL import Image
+    _HAS_PIL = True
+except Exception:
+    _HAS_PIL = False
+
+try:
+    from shapely import contains_xy
+    _HAS_CONTAINS_XY = True
+except Exception:
+    _HAS_CONTAINS_XY = False
+
+CLOUD_BRIGHTNESS = 0.60   # min(R,G,B) above this share of full scale ...
+CLOUD_MAX_CHROMA = 0.15   # ... with max-min below this share counts as cloud
+NODATA_LEVEL = 5          # near-black quicklook pixels are outside the swath
+
+S2_TILE_SIZE = 109800     # metres, from the NW corner of the 100 km MGRS square (to within 40 m)
+_TILE_ID = re.compile(r"_T(\d{2})([C-HJ-NP-X])([A-HJ-NP-Z])([A-HJ-NP-V])(?:_|$)")
+_LAT_BANDS = "CDEFGHJKLMNPQRSTUVWX"
+_COL_LETTERS = ("ABCDEFGH", "JKLMNPQR", "STUVWXYZ")
+_ROW_LETTERS = "ABCDEFGHJKLMNPQRSTUV"
+
+
+def scene_cloud_cover(product: dict) -> Optional[float]:
+    """Catalogue cloud cover as a fraction in [0, 1], or None if not reported."""
+    value = product["properties"].get("cloudCover")
+    try:
+        return float(value) / 100.0 if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def quicklook_url(product: dict) -> Optional[str]:
+    props = product["properties"]
+    return props.get("thumbnail") or props.get("quicklook")
+
+
+def tile_extent(product: dict) -> Optional[Tuple[str, Tuple[float, float, float, float]]]:
+    """
+    (UTM CRS, (minx, miny, maxx, maxy)) of the product's MGRS tile, decoded from the
+    tile id in its title (e.g. ..._T35TLK_...), or None if there is none.
+    """
+    m = _TILE_ID.search(str(product["properties"].get("title", "")))
+    if m is None:
+        return None
+    zone, band, col, row = int(m.group(1)), m.group(2), m.group(3), m.group(4)
+    if not 1 <= zone <= 60:
+        return None
+    crs = f"EPSG:{(32600 if band >= 'N' else 32700) + zone}"
+
+    # 100 km square: column letters cycle over 3 zones, row letters every 2000 km (offset in even zones)
+    letters = _COL_LETTERS[(zone - 1) % 3]
+    if col not in letters:
+        return None
+    west = (letters.index(col) + 1) * 100000.0
+    south = ((_ROW_LETTERS.index(row) - (5 if zone % 2 == 0 else 0)) % 20) * 100000.0
+    # lift the row into the latitude band: first 2000 km cycle reaching the band's southern edge
+    band_south = -80.0 + 8.0 * _LAT_BANDS.index(band)
+    lon0 = zone * 6.0 - 183.0
+    geom = transform_geom("EPSG:4326", crs, {"type": "Point", "coordinates": (lon0, band_south)})
+    band_min = geom["coordinates"][1]
+    while south + 100000.0 <= band_min:
+        south += 2000000.0
+
+    north = south + 100000.0
+    return crs, (west, north - S2_TILE_SIZE, west + S2_TILE_SIZE, north)
+
+
+def _aoi_pixel_mask(aoi, bounds, shape):
+    """Boolean mask of quicklook pixels whose centre falls inside the AOI."""
+    minx, miny, maxx, maxy = bounds
+    h, w = shape
+    xs = minx + (np.arange(w) + 0.5) * (maxx - minx) / w
+    ys = maxy - (np.arange(h) + 0.5) * (maxy - miny) / h
+    if _HAS_CONTAINS_XY:
+        gx, gy = np.meshgrid(xs, ys)
+        return contains_xy(aoi, gx, gy)
+    ax0, ay0, ax1, ay1 = aoi.bounds  # bbox fallback for shapely < 2
+    return ((xs >= ax0) & (xs <= ax1))[None, :] & ((ys >= ay0) & (ys <= ay1))[:, None]
+
+
+def aoi_cloud_fraction(image: np.ndarray, product: dict, aoi) -> Optional[float]:
+    """
+    Fraction of valid quicklook pixels inside the AOI that look like cloud.
+    image is an (H, W, 3) uint8 RGB array covering the product's MGRS tile (see
+    tile_extent), or its footprint bounds if the tile cannot be decoded.
+    """
+    if image.ndim != 3 or image.shape[2] < 3:
+        return None
+    tile = tile_extent(product)
+    if tile is not None:
+        crs, bounds = tile
+        aoi = shape(transform_geom("EPSG:4326", crs, mapping(aoi)))
+    else:
+        fp = footprint(product)
+        if fp is None:
+            return None
+        bounds = fp.bounds
+    rgb = image[:, :, :3]
+    inside = _aoi_pixel_mask(aoi, bounds, rgb.shape[:2])
+
+    lo = rgb.min(axis=2)
+    hi = rgb.max(axis=2)
+    valid = inside & (hi > NODATA_LEVEL)
+    n_valid = int(valid.sum())
+    if n_valid == 0:
+        return None
+    cloud = valid & (lo >= CLOUD_BRIGHTNESS * 255) & ((hi - lo) <= CLOUD_MAX_CHROMA * 255)
+    return float(cloud.sum()) / n_valid
+
+
+def _fetch_quicklook(client, product) -> Optional[np.ndarray]:
+    url = quicklook_url(product)
+    if not url or not _HAS_PIL:
+        return None
+    try:
+        r = client.get(url)
+        r.raise_for_status()
+        with Image.open(io.BytesIO(r.content)) as img:
+            return np.asarray(img.convert("RGB"))
+    except Exception as e:
+        print(f"⚠️ Quicklook unavailable for {product['properties'].get('title')}: {e}")
+        return None
+
+
+def screen_s2_candidates(client, products: List[dict], aoi, max_scene_cloud: float = 0.6,
+                         max_aoi_cloud: float = 0.3,
+                         max_workers: int = 8) -> Tuple[List[dict], Dict[str, float]]:
+    """
+    Drop S2 products that are too cloudy and rank the rest, clearest first.
+
+    Products above max_scene_cloud (catalogue value) are rejected without fetching
+    anything. For the others the quicklook is downloaded in parallel and the
+    AOI-local cloud fraction must stay below max_aoi_cloud. Without a usable
+    quicklook the catalogue value is used (1.0 if there is none either).
+
+    Returns (products, {product id: cloud score}); the score map is meant for
+    select_cover(cloud=...). The catalogue dicts themselves are not modified,
+    since they may be shared with the search cache.
+    """
+    candidates = []
+    for p in products:
+        cc = scene_cloud_cover(p)
+        if cc is not None and cc > max_scene_cloud:
+            continue
+        candidates.append(p)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        images = list(executor.map(lambda p: _fetch_quicklook(client, p), candidates))
+
+    accepted = []
+    for p, img in zip(candidates, images):
+        local = aoi_cloud_fraction(img, p, aoi) if img is not None else None
+        score = local if local is not None else scene_cloud_cover(p)
+        if score is not None and score > max_aoi_cloud:
+            continue
+        accepted.append((score if score is not None else 1.0, p))
+
+    accepted.sort(key=lambda t: t[0])
+    print(f"Cloud screening: kept {len(accepted)} of {len(products)} Sentinel-2 candidates")
+    return [p for _, p in accepted], {p["id"]: score for score, p in accepted}
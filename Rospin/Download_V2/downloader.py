@@ -1,75 +1,358 @@
-import os, requests, zipfile
+import os, json, shutil, hashlib, threading, zipfile
 from getpass import getpass
+from typing import Optional, Tuple
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-CLIENT_ID = "cdse-public"
+# client and catalogue search live in copernicus_client.py (shared with Api_stuf); re-exported here
+from copernicus_client import CopernicusClient, get_tokens, search_products, search_many, split_time_range
+from s2_bands import band_of, closest_resolution
 
-def get_tokens(username, password):
-    token_url = "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
-    response = requests.post(
-        token_url,
-        data={"client_id": CLIENT_ID, "username": username, "password": password, "grant_type": "password"}
-    )
-    response.raise_for_status()
-    token_data = response.json()
-    return token_data["access_token"], token_data["refresh_token"]
-
-def search_products(headers, aoi_wkt, start_date, end_date, collection, extra_params=None, maxRecords=1):
-    """
-    Generic search function for Sentinel-1 or Sentinel-2.
-    collection: "Sentinel1" or "Sentinel2"
-    """
-    BASE_URL = f"https://catalogue.dataspace.copernicus.eu/resto/api/collections/{collection}/search.json"
-    query_params = {
-        "startDate": start_date,
-        "completionDate": end_date,
-        "geometry": aoi_wkt,
-        "maxRecords": maxRecords
-    }
-    if extra_params:
-        query_params.update(extra_params)
-
-    response = requests.get(BASE_URL, params=query_params, headers=headers)
-    response.raise_for_status()
-    return response.json().get("features", [])
-
-def download_and_extract(product, headers, download_dir):
-    title = product["properties"]["title"]
-    product_id = product["id"]
-    extract_path = os.path.join(download_dir, title)  # downloads/product_name
-    zip_file_path = os.path.join(download_dir, f"{title}.zip")
+ODATA_URL = "https://catalogue.dataspace.copernicus.eu/odata/v1/Products"
+DOWNLOAD_URL = "https://download.dataspace.copernicus.eu/odata/v1/Products"
+CHUNK_SIZE = 1024 * 1024        # 1 MiB per read
+STATE_SAVE_EVERY = 8            # persist segment progress every N chunks
+EXTRACT_BUFFER = 1024 * 1024    # bounded copy buffer per extracted member
 
-    # Download only if zip is not present
-    if not os.path.exists(zip_file_path):
-        url = f"https://download.dataspace.copernicus.eu/odata/v1/Products({product_id})/$value"
-        with requests.get(url, headers=headers, stream=True) as r:
+S2_BANDS = ("B03", "B04", "B08", "B11")
+
+
+def get_product_checksum(client, product_id) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Ask the OData catalogue for the archive size and MD5 of a product.
+    Returns (size, md5); either may be None if the catalogue does not report it.
+    """
+    try:
+        r = client.get(f"{ODATA_URL}({product_id})", auth=False)
+        r.raise_for_status()
+        data = r.json()
+    except Exception as e:
+        print(f"⚠️ Could not fetch checksum for {product_id}: {e}")
+        return None, None
+
+    size = data.get("ContentLength")
+    md5 = None
+    for c in data.get("Checksum") or []:
+        if str(c.get("Algorithm", "")).upper() == "MD5" and c.get("Value"):
+            md5 = str(c["Value"]).lower()
+    return (int(size) if size else None), md5
+
+def _probe_download(client, url) -> Tuple[Optional[int], bool]:
+    """
+    Request the first byte of the resource to learn its total size and whether
+    the server honours Range requests. Returns (total_size, supports_range).
+    """
+    with client.get(url, headers={"Range": "bytes=0-0"}, stream=True) as r:
+        r.raise_for_status()
+        if r.status_code == 206:
+            total = r.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+            return (int(total) if total.isdigit() else None), True
+        length = int(r.headers.get("Content-Length", 0))
+        return (length or None), False
+
+def _load_segments(state_path, part_path, total_size, segments):
+    """
+    Return the list of [start, end, done] byte ranges for a download.
+    Progress is restored from the state file when it matches the current size and the
+    .part is still there at full size. Without such a state, only a .part shorter than
+    the file (written by a single stream, never pre-sized) is trusted, as a contiguous
+    prefix; any other leftover may hold unwritten (zero) ranges and is started over.
+    """
+    part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if part_size == total_size and os.path.exists(state_path):
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+            if state.get("size") == total_size and state.get("segments"):
+                return state["segments"]
+        except Exception:
+            pass
+
+    existing = part_size if part_size < total_size else 0
+    if part_size and not existing:
+        with open(part_path, "r+b") as f:
+            f.truncate(0)
+    step = -(-total_size // max(1, segments))  # ceil division
+    segs = []
+    for start in range(0, total_size, step):
+        end = min(start + step, total_size) - 1
+        done = max(0, min(existing - start, end - start + 1))
+        segs.append([start, end, done])
+    return segs
+
+def _save_segments(state_path, total_size, segs):
+    tmp = state_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"size": total_size, "segments": segs}, f)
+    os.replace(tmp, state_path)
+
+def _fetch_segment(client, url, part_path, seg, lock, save_state, pbar):
+    """Download the remaining bytes of one [start, end, done] range into part_path."""
+    start, end, done = seg
+    if start + done > end:
+        return
+    range_headers = {"Range": f"bytes={start + done}-{end}"}
+    with client.get(url, headers=range_headers, stream=True) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise RuntimeError(f"Server ignored Range request for bytes {start + done}-{end}")
+        with open(part_path, "r+b") as f:
+            f.seek(start + done)
+            for i, chunk in enumerate(r.iter_content(CHUNK_SIZE), 1):
+                f.write(chunk)
+                with lock:
+                    seg[2] += len(chunk)
+                    pbar.update(len(chunk))
+                    if i % STATE_SAVE_EVERY == 0:
+                        f.flush()
+                        save_state()
+
+def _md5_file(path):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def download_file(client, url, dest_path, segments=1, expected_size=None, expected_md5=None, desc=None):
+    """
+    Resumable download of url into dest_path.
+
+    Data is written to `dest_path + ".part"` and progress per byte range is kept in
+    `dest_path + ".part.json"`, so an interrupted transfer restarts where it stopped.
+    With segments > 1 the file is split into that many byte ranges fetched in parallel.
+    The finished file is checked against expected_size / expected_md5 (when given)
+    and only then renamed to dest_path.
+    """
+    part_path = dest_path + ".part"
+    state_path = part_path + ".json"
+    desc = desc or os.path.basename(dest_path)
+
+    total_size, supports_range = _probe_download(client, url)
+    if expected_size and total_size and expected_size != total_size:
+        print(f"⚠️ {desc}: catalogue size {expected_size} differs from server size {total_size}")
+    total_size = total_size or expected_size
+
+    if not supports_range or not total_size:
+        # Plain single stream from zero: nothing to resume against
+        with client.get(url, stream=True) as r:
             r.raise_for_status()
-            total_size = int(r.headers.get("Content-Length", 0))
-            with open(zip_file_path, "wb") as f, tqdm(
-                total=total_size, unit="B", unit_scale=True, desc=title, ascii=True
+            with open(part_path, "wb") as f, tqdm(
+                total=total_size or 0, unit="B", unit_scale=True, desc=desc, ascii=True
             ) as pbar:
-                for chunk in r.iter_content(8192):
+                for chunk in r.iter_content(CHUNK_SIZE):
                     f.write(chunk)
                     pbar.update(len(chunk))
+    else:
+        segs = _load_segments(state_path, part_path, total_size, segments)
+        with open(part_path, "a+b") as f:
+            if os.path.getsize(part_path) != total_size:
+                f.truncate(total_size)
+
+        lock = threading.Lock()
+        save_state = lambda: _save_segments(state_path, total_size, segs)
+        save_state()
+        already = sum(s[2] for s in segs)
+        with tqdm(total=total_size, initial=already, unit="B", unit_scale=True, desc=desc, ascii=True) as pbar:
+            try:
+                with ThreadPoolExecutor(max_workers=len(segs)) as executor:
+                    futures = [
+                        executor.submit(_fetch_segment, client, url, part_path, seg, lock, save_state, pbar)
+                        for seg in segs
+                    ]
+                    for future in as_completed(futures):
+                        future.result()
+            finally:
+                with lock:
+                    save_state()
+        # every recorded range must be complete, whether or not a checksum follows
+        missing = sum(end - start + 1 - done for start, end, done in segs)
+        if missing:
+            raise RuntimeError(f"{desc}: {missing} bytes not downloaded, resume to complete")
+
+    # --- Verify before marking done ---
+    actual_size = os.path.getsize(part_path)
+    if expected_size and actual_size != expected_size:
+        os.remove(part_path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        raise RuntimeError(f"{desc}: size mismatch (got {actual_size}, expected {expected_size})")
+    if expected_md5:
+        actual_md5 = _md5_file(part_path)
+        if actual_md5 != expected_md5.lower():
+            os.remove(part_path)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            raise RuntimeError(f"{desc}: MD5 mismatch (got {actual_md5}, expected {expected_md5})")
+
+    os.replace(part_path, dest_path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return dest_path
+
+def product_paths(product, download_dir, store=None):
+    """(zip_path, extract_path) of a product, inside the store when one is used."""
+    title = product["properties"]["title"]
+    if store is not None:
+        return store.paths(product["id"], title)
+    return os.path.join(download_dir, f"{title}.zip"), os.path.join(download_dir, title)  # downloads/product_name
+
+def download_product(product, client, download_dir, segments=1, store=None):
+    """
+    Resumable download of a product zip; returns its path. With a ProductStore the
+    zip lives under the store (keyed by product id), is recorded in its index and
+    space is reclaimed under its quota before downloading.
+    """
+    title = product["properties"]["title"]
+    product_id = product["id"]
+    zip_file_path, _ = product_paths(product, download_dir, store)
+    if store is not None:
+        os.makedirs(os.path.dirname(zip_file_path), exist_ok=True)
+        store.adopt_legacy(product_id, title)  # reuse a copy from the flat download layout
+        store.lookup(product_id)  # refresh last access of a cached product
+
+    # A zip only appears after verification, but older runs may have left truncated ones
+    if os.path.exists(zip_file_path) and not zipfile.is_zipfile(zip_file_path):
+        print(f"⚠️ {zip_file_path} is not a valid zip, downloading again")
+        os.remove(zip_file_path)
+
+    # Download only if zip is not present
+    if not os.path.exists(zip_file_path):
+        url = f"{DOWNLOAD_URL}({product_id})/$value"
+        expected_size, expected_md5 = get_product_checksum(client, product_id)
+        if store is not None:
+            store.ensure_space(expected_size or 0, keep=[product_id])
+        download_file(
+            client, url, zip_file_path, segments=segments,
+            expected_size=expected_size, expected_md5=expected_md5, desc=title
+        )
+        if store is not None:
+            store.record_zip(product_id, title)
+
+    return zip_file_path
 
-    # Always extract, flattening top-level SAFE folder if present
+def extract_product(product, download_dir, member_filter=None, extract_workers=4, store=None):
+    """Extract an already downloaded product zip (once) and return the extracted folder."""
+    zip_file_path, extract_path = product_paths(product, download_dir, store)
     if not os.path.exists(extract_path):
-        os.makedirs(extract_path, exist_ok=True)
-        with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
-            for member in zip_ref.namelist():
-                parts = member.split("/", 1)
-                member_target = parts[1] if len(parts) > 1 else parts[0]
-
-                if member_target:  # Skip empty
-                    target_path = os.path.join(extract_path, member_target)
-                    if member.endswith("/"):  # directory
-                        os.makedirs(target_path, exist_ok=True)
-                    else:  # file
-                        os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                        with zip_ref.open(member) as src, open(target_path, "wb") as dst:
-                            dst.write(src.read())
+        extract_members(zip_file_path, extract_path, member_filter=member_filter, workers=extract_workers)
+        if store is not None:
+            store.record_extracted(product["id"], product["properties"]["title"])
+            store.ensure_space(0, keep=[product["id"]])
+    return extract_path
+
+def download_and_extract(product, client, download_dir, segments=1, member_filter=None, extract_workers=4,
+                         extract=True, store=None):
+    """
+    Download a product zip (resumable) and extract it. With extract=False the
+    verified zip path is returned as-is, for readers that open members in place.
+    """
+    zip_file_path = download_product(product, client, download_dir, segments=segments, store=store)
+    if not extract:
+        return zip_file_path
+    return extract_product(product, download_dir, member_filter=member_filter,
+                           extract_workers=extract_workers, store=store)
+
+
+# ------------------------
+# Selective extraction
+# ------------------------
+def _is_metadata_member(name):
+    base = name.rsplit("/", 1)[-1].lower()
+    return base == "manifest.safe" or (base.startswith("mtd_") and base.endswith(".xml"))
+
+def s1_member_filter(names):
+    """Keep only VV/VH measurement rasters, product annotation XML and metadata of an S1 SAFE."""
+    keep = []
+    for name in names:
+        parts = name.lower().split("/")
+        base = parts[-1]
+        if len(parts) >= 2 and parts[-2] == "measurement" and base.endswith((".tif", ".tiff")):
+            if "-vv-" in base or "-vh-" in base:
+                keep.append(name)
+        elif len(parts) >= 2 and parts[-2] == "annotation" and base.endswith(".xml"):
+            keep.append(name)  # skips annotation/calibration and annotation/rfi
+        elif _is_metadata_member(name):
+            keep.append(name)
+    return keep
+
+def make_s2_member_filter(resolution=10, bands=S2_BANDS):
+    """
+    Build a filter keeping one file per requested S2 band plus product/granule metadata.
+    For L2A products (R10m/R20m/R60m folders) the file whose resolution is closest
+    to `resolution` is chosen, preferring the finer one on ties (the same choice
+    s2_bands.S2BandIndex makes when the bands are read).
+    """
+    def _filter(names):
+        keep = [n for n in names if _is_metadata_member(n)]
+        candidates = {b: {} for b in bands}
+        for name in names:
+            key = band_of(name)
+            if key and key[0] in candidates:
+                candidates[key[0]].setdefault(key[1], name)
+        for found in candidates.values():
+            res = closest_resolution(found, resolution)
+            if res is not None:
+                keep.append(found[res])
+        return keep
+    return _filter
+
+def product_member_filter(title, s2_resolution=10):
+    """Pick the member filter matching the mission in a product title, or None for everything."""
+    if title.startswith("S1"):
+        return s1_member_filter
+    if title.startswith("S2"):
+        return make_s2_member_filter(s2_resolution)
+    return None
+
+def extract_members(zip_file_path, extract_path, member_filter=None, workers=4):
+    """
+    Extract an archive into extract_path, flattening the top-level SAFE folder.
+
+    member_filter receives the list of file names from the central directory and
+    returns the ones to extract (None = all). Members are streamed with a bounded
+    buffer and copied in parallel, each thread using its own ZipFile handle.
+    The tree is built under a temporary name and renamed once complete.
+    """
+    with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
+        names = [i.filename for i in zip_ref.infolist() if not i.is_dir()]
+    wanted = member_filter(names) if member_filter else names
+
+    tmp_path = extract_path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path, exist_ok=True)
+
+    jobs = []
+    for member in wanted:
+        parts = member.split("/", 1)
+        member_target = parts[1] if len(parts) > 1 else parts[0]
+        if member_target:  # Skip empty
+            jobs.append((member, os.path.join(tmp_path, member_target)))
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def _copy(member, target_path):
+        zf = getattr(local, "zf", None)
+        if zf is None:
+            zf = local.zf = zipfile.ZipFile(zip_file_path, "r")
+            with handles_lock:
+                handles.append(zf)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        with zf.open(member) as src, open(target_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, EXTRACT_BUFFER)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for future in [executor.submit(_copy, m, t) for m, t in jobs]:
+                future.result()
+    finally:
+        for zf in handles:
+            zf.close()
 
+    os.replace(tmp_path, extract_path)
     return extract_path
 
 
@@ -0,0 +1,54 @@
+# feature_cache.py
+"""
+Persistent per-product feature rows, so recurring runs only compute new scenes.
+
+A row is keyed by the S1 product name, the paired S2 product name (if any),
+the processor settings that change the numbers, and the feature-code version.
+Changing any of them simply misses the old entry; clear() drops everything.
+Rows are one small JSON file each, written atomically, so several processes
+(see SafeProcessor.process_safe_folders(workers=...)) can share a cache.
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+
+FEATURE_CACHE_DIR = "feature_cache"
+
+
+class FeatureCache:
+    def __init__(self, root: str = FEATURE_CACHE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(s1_name: str, s2_name: Optional[str], settings: dict) -> str:
+        ident = {"s1": s1_name, "s2": s2_name, "settings": settings}
+        return hashlib.sha1(json.dumps(ident, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)["row"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, row: dict):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            # numpy scalars -> Python numbers; NaN is written as NaN and read back as nan
+            json.dump({"row": row}, f, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+        os.replace(tmp, path)
+
+    def clear(self):
+        for name in os.listdir(self.root):
+            if name.endswith(".json"):
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
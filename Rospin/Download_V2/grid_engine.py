@@ -0,0 +1,222 @@
+# grid_engine.py
+"""
+Tiled processing of S1 and S2 rasters on one common target grid.
+
+A TargetGrid (CRS, resolution, extent, tile size) is laid over the AOI. Every
+input band is warped into it lazily, so a tile read decodes and resamples only
+the source pixels under that tile. S2 bands go through a WarpedVRT on their
+UTM geotransform. S1 GRD bands are reprojected tile by tile through their GCPs
+(a WarpedVRT with an explicit target grid ignores GCPs and warps through the
+identity geotransform). Pixels of both sensors line up exactly.
+
+run_tiles() hands each tile (all layers as float32, NaN = no data) to a tile
+function on a thread pool. Every worker thread keeps its own dataset handles
+(GDAL handles must not be shared between threads), so memory per worker is
+a handful of tile buffers. Whatever the tile function returns is reduced into
+exact RunningStats per output name and, optionally, streamed to tiled
+Cloud-Optimised GeoTIFFs on the target grid.
+"""
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Union
+
+import numpy as np
+import rasterio
+from rasterio.control import GroundControlPoint
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin, rowcol
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import reproject, transform as warp_transform, transform_bounds
+from rasterio.windows import Window
+from shapely import wkt as shapely_wkt
+
+from aoi_window import _bbox_outline, georeferencing
+from cog import write_cog
+from raster_stats import RunningStats
+
+GCP_SOURCE_MARGIN = 8  # source pixels around a tile: resampling kernel + GCP fit slack
+
+
+def utm_crs_for(lon: float, lat: float) -> rasterio.crs.CRS:
+    """UTM zone (WGS84) containing a lon/lat point."""
+    zone = int(math.floor((lon + 180.0) / 6.0)) % 60 + 1
+    return rasterio.crs.CRS.from_epsg((32600 if lat >= 0 else 32700) + zone)
+
+
+class TargetGrid:
+    def __init__(self, crs, transform, width: int, height: int, tile_size: int = 1024):
+        self.crs = rasterio.crs.CRS.from_user_input(crs)
+        self.transform = transform
+        self.width = int(width)
+        self.height = int(height)
+        self.tile_size = max(16, int(tile_size) // 16 * 16)  # GeoTIFF blocks are multiples of 16
+
+    @classmethod
+    def from_aoi(cls, aoi, resolution: float = 10.0, crs=None, tile_size: int = 1024) -> "TargetGrid":
+        """
+        North-up grid covering the AOI (shapely geometry or WKT, lon/lat), snapped to
+        multiples of the resolution. crs defaults to the UTM zone of the AOI centre,
+        the native S2 projection.
+        """
+        if isinstance(aoi, str):
+            aoi = shapely_wkt.loads(aoi)
+        c = aoi.centroid
+        crs = rasterio.crs.CRS.from_user_input(crs) if crs is not None else utm_crs_for(c.x, c.y)
+        minx, miny, maxx, maxy = transform_bounds("EPSG:4326", crs, *aoi.bounds, densify_pts=21)
+        minx = math.floor(minx / resolution) * resolution
+        maxy = math.ceil(maxy / resolution) * resolution
+        width = max(1, int(math.ceil((maxx - minx) / resolution)))
+        height = max(1, int(math.ceil((maxy - miny) / resolution)))
+        return cls(crs, from_origin(minx, maxy, resolution, resolution), width, height, tile_size)
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    def tiles(self) -> Iterator[Window]:
+        for row in range(0, self.height, self.tile_size):
+            for col in range(0, self.width, self.tile_size):
+                yield Window(col, row, min(self.tile_size, self.width - col), min(self.tile_size, self.height - row))
+
+    def profile(self, dtype="float32", nodata=np.nan) -> dict:
+        return {
+            "driver": "GTiff", "dtype": dtype, "count": 1, "nodata": nodata,
+            "width": self.width, "height": self.height, "crs": self.crs, "transform": self.transform,
+            "tiled": True, "blockxsize": self.tile_size, "blockysize": self.tile_size,
+            "compress": "deflate", "BIGTIFF": "IF_SAFER",
+        }
+
+
+class Layer(NamedTuple):
+    path: str
+    resampling: Resampling = Resampling.bilinear
+    src_nodata: Optional[float] = None   # e.g. 0 for S2 DNs; None = the file's own nodata
+    gcps: Optional[list] = None          # lon/lat tie points for files with no CRS/GCPs of their own
+
+
+class _GcpWarp:
+    """Tile-by-tile reprojection of a GCP-georeferenced source onto the grid (WarpedVRT-like read())."""
+
+    def __init__(self, src, grid: TargetGrid, gcps, gcp_crs, resampling, src_nodata):
+        self.src = src
+        self.grid = grid
+        self.gcps = gcps
+        self.gcp_crs = gcp_crs
+        self.resampling = resampling
+        self.src_nodata = src_nodata
+
+    def _source_window(self, window: Window) -> Optional[Window]:
+        xs, ys = _bbox_outline(rasterio.windows.bounds(window, self.grid.transform))
+        xs, ys = warp_transform(self.grid.crs, self.gcp_crs, xs, ys)
+        rows, cols = rowcol(self.gcps, xs, ys)
+        m = GCP_SOURCE_MARGIN
+        row0, row1 = max(0, min(rows) - m), min(self.src.height, max(rows) + 1 + m)
+        col0, col1 = max(0, min(cols) - m), min(self.src.width, max(cols) + 1 + m)
+        if row1 <= row0 or col1 <= col0:
+            return None
+        return Window(int(col0), int(row0), int(col1 - col0), int(row1 - row0))
+
+    def read(self, band: int, window: Window) -> np.ndarray:
+        out = np.full((int(window.height), int(window.width)), np.nan, dtype="float32")
+        src_window = self._source_window(window)
+        if src_window is None:
+            return out
+        data = self.src.read(band, window=src_window).astype("float32")
+        row0, col0 = src_window.row_off, src_window.col_off
+        gcps = [GroundControlPoint(row=g.row - row0, col=g.col - col0, x=g.x, y=g.y, z=g.z) for g in self.gcps]
+        reproject(data, out, gcps=gcps, src_crs=self.gcp_crs, src_nodata=self.src_nodata,
+                  dst_transform=rasterio.windows.transform(window, self.grid.transform), dst_crs=self.grid.crs,
+                  dst_nodata=np.nan, resampling=self.resampling)
+        return out
+
+    def close(self):
+        pass
+
+
+class _ThreadSources:
+    """Per-thread open datasets + WarpedVRTs / GCP warps, closed together at the end."""
+
+    def __init__(self, grid: TargetGrid, layers: Dict[str, Layer]):
+        self.grid = grid
+        self.layers = layers
+        self._local = threading.local()
+        self._opened: List = []
+        self._lock = threading.Lock()
+
+    def _open(self, layer: Layer):
+        src = rasterio.open(layer.path)
+        ref, crs = georeferencing(src, layer.gcps)
+        if src.crs is None and ref is not None:
+            nodata = layer.src_nodata if layer.src_nodata is not None else src.nodata
+            vrt = _GcpWarp(src, self.grid, ref, crs, layer.resampling, nodata)
+        else:
+            kwargs = {"src_nodata": layer.src_nodata} if layer.src_nodata is not None else {}
+            vrt = WarpedVRT(src, crs=self.grid.crs, transform=self.grid.transform, width=self.grid.width,
+                            height=self.grid.height, resampling=layer.resampling, dtype="float32",
+                            nodata=np.nan, **kwargs)
+        with self._lock:
+            self._opened.extend([vrt, src])
+        return vrt
+
+    def vrts(self) -> Dict[str, Union[WarpedVRT, _GcpWarp]]:
+        vrts = getattr(self._local, "vrts", None)
+        if vrts is None:
+            vrts = self._local.vrts = {name: self._open(layer) for name, layer in self.layers.items()}
+        return vrts
+
+    def close(self):
+        for ds in self._opened:
+            ds.close()
+        self._opened.clear()
+
+
+def run_tiles(grid: TargetGrid, layers: Dict[str, Layer],
+              tile_fn: Callable[[Dict[str, np.ndarray], Window], Dict[str, np.ndarray]],
+              workers: int = 4, outputs: Optional[Dict[str, str]] = None) -> Dict[str, RunningStats]:
+    """
+    Apply tile_fn to every tile of the grid and reduce its results.
+
+    tile_fn(arrays, window) gets one float32 array per layer (NaN outside the source
+    or at source nodata) and returns name -> array (NaN = no data) for the tile.
+    Returns name -> RunningStats over the whole grid. outputs maps result names to
+    GeoTIFF paths: tiles are streamed to a plain tiled GeoTIFF as they are computed,
+    which becomes a Cloud-Optimised GeoTIFF (with overviews) at the end.
+    """
+    sources = _ThreadSources(grid, layers)
+    write_lock = threading.Lock()
+    staging = {name: f"{path}.tiles.tif" for name, path in (outputs or {}).items()}
+    sinks = {name: rasterio.open(path, "w", **grid.profile()) for name, path in staging.items()}
+
+    def work(window: Window) -> Dict[str, RunningStats]:
+        arrays = {name: vrt.read(1, window=window) for name, vrt in sources.vrts().items()}
+        results = tile_fn(arrays, window)
+        stats = {}
+        for name, arr in results.items():
+            run = stats[name] = RunningStats()
+            run.update(arr)
+            if name in sinks:
+                with write_lock:
+                    sinks[name].write(np.asarray(arr, dtype="float32"), 1, window=window)
+        return stats
+
+    totals: Dict[str, RunningStats] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            # merge in tile order, so results do not depend on thread scheduling
+            for tile_stats in executor.map(work, grid.tiles()):
+                for name, run in tile_stats.items():
+                    totals.setdefault(name, RunningStats()).merge(run)
+        for sink in sinks.values():
+            sink.close()
+        for name, path in staging.items():
+            write_cog(path, outputs[name])
+    finally:
+        sources.close()
+        for sink in sinks.values():
+            sink.close()
+        for path in staging.values():
+            if os.path.exists(path):
+                os.remove(path)
+    return totals
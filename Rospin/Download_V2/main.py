@@ -2,10 +2,14 @@ import os
 import pandas as pd
 import argparse
 from getpass import getpass
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from downloader import get_tokens, search_products, download_and_extract
+from downloader import CopernicusClient, search_many
 from satellite_down import SafeProcessor
+from safe_archive import product_name
+from product_store import ProductStore
+from product_selection import aoi_geometry, select_cover, closest_group
+from cloud_screen import screen_s2_candidates
+from pipeline import ProductPipeline
 from predict_flood import predict_flood
 
 def parse_args():
@@ -15,6 +19,25 @@ def parse_args():
     p.add_argument("--aoi", type=str, required=True, help="ex. POLYGON((26.0 44.4, 26.2 44.4, 26.2 44.6, 26.0 44.6, 26.0 44.4))")
     p.add_argument("--start", type=str, required=True, help="ex. 2021-01-01T00:00:00Z")
     p.add_argument("--end", type=str, required=True, help="ex. 2021-12-31T23:59:59Z")
+    p.add_argument("--segments", type=int, default=4, help="parallel byte ranges per product download")
+    p.add_argument("--full-extract", action="store_true", help="extract every archive member, not only the bands we read")
+    p.add_argument("--no-extract", action="store_true", help="keep products zipped and read rasters in place (/vsizip/)")
+    p.add_argument("--quota-gb", type=float, default=None, help="disk quota of the product store (LRU eviction); unlimited if omitted")
+    p.add_argument("--slice-days", type=int, default=30, help="split the date range into slices searched in parallel (0 = no split)")
+    p.add_argument("--min-coverage", type=float, default=0.95, help="AOI fraction a date's scenes must cover")
+    p.add_argument("--max-cloud", type=float, default=60, help="max catalogue cloud cover (%%) of S2 tiles")
+    p.add_argument("--max-aoi-cloud", type=float, default=30, help="max estimated cloud cover (%%) over the AOI for S2")
+    p.add_argument("--download-workers", type=int, default=4, help="products downloaded in parallel")
+    p.add_argument("--extract-workers", type=int, default=2, help="threads extracting archives")
+    p.add_argument("--feature-workers", type=int, default=1, help="threads computing raster features")
+    p.add_argument("--feature-processes", type=int, default=1, help="worker processes computing raster features (1 = in-process)")
+    p.add_argument("--memory-budget-mb", type=float, default=None, help="memory the feature processes may use together; defaults to the available RAM")
+    p.add_argument("--s2-resolution", type=int, default=10, help="S2 band resolution to extract (10, 20 or 60 m)")
+    p.add_argument("--clip-aoi", action="store_true", help="compute features over the AOI window only, not whole scenes")
+    p.add_argument("--feature-cache", type=str, default="feature_cache", help="directory of cached per-product feature rows")
+    p.add_argument("--no-feature-cache", action="store_true", help="recompute features of every product")
+    p.add_argument("--band-cache", type=str, default=None, help="directory caching decoded bands as memory-mapped .npy (off if omitted)")
+    p.add_argument("--band-cache-gb", type=float, default=None, help="size quota of the band cache (LRU eviction); unlimited if omitted")
 
     return p.parse_args()
 
@@ -23,8 +46,8 @@ def main():
     # --- Authentication ---
     username = input("Copernicus Username: ")
     password = getpass("Copernicus Password: ")
-    access_token, _ = get_tokens(username, password)
-    headers = {"Authorization": f"Bearer {access_token}"}
+    # one pooled session for every request: each download worker holds up to `segments` connections
+    client = CopernicusClient(username, password, pool_size=args.download_workers * args.segments + 1)
 
     # --- Search area and dates (Bucharest AOI example) ---
     aoi_wkt = args.aoi
@@ -33,89 +56,75 @@ def main():
 
     download_dir = "downloads"
     os.makedirs(download_dir, exist_ok=True)
-
-    # --- Search Sentinel-1 ---
-    s1_products = search_products(
-        headers, aoi_wkt, start_date, end_date,
-        collection="Sentinel1",
-        extra_params={"productType": "GRD", "sensorMode": "IW"},
-        maxRecords=1
+    store = ProductStore(download_dir, quota_bytes=int(args.quota_gb * 1024 ** 3) if args.quota_gb else None)
+
+    # --- Search Sentinel-1 and Sentinel-2 (L2A + L1C fallback) in one fan-out ---
+    found = search_many(
+        client, aoi_wkt, start_date, end_date,
+        queries={
+            "s1": ("Sentinel1", {"productType": "GRD", "sensorMode": "IW"}),
+            "s2_l2a": ("Sentinel2", {"productType": "S2MSI2A", "cloudCover": f"[0,{args.max_cloud:g}]"}),
+            "s2_l1c": ("Sentinel2", {"productType": "S2MSI1C", "cloudCover": f"[0,{args.max_cloud:g}]"}),
+        },
+        slice_days=args.slice_days,
     )
 
-    # --- Search Sentinel-2 ---
-    s2_products = search_products(
-        headers, aoi_wkt, start_date, end_date,
-        collection="Sentinel2",
-        extra_params={"productType": "S2MSI2A"},
-        maxRecords=1
+    # --- Smallest scene set covering the AOI, preferring products already on disk ---
+    aoi = aoi_geometry(aoi_wkt)
+    s1_groups = select_cover(found["s1"], aoi, threshold=args.min_coverage, download_dir=download_dir, store=store)
+
+    # S2 candidates: drop cloudy tiles from catalogue metadata + quicklooks before downloading
+    s2_groups = []
+    for key in ("s2_l2a", "s2_l1c"):
+        clear, cloud = screen_s2_candidates(client, found[key], aoi, max_scene_cloud=args.max_cloud / 100.0,
+                                            max_aoi_cloud=args.max_aoi_cloud / 100.0)
+        s2_groups = select_cover(clear, aoi, threshold=args.min_coverage, download_dir=download_dir, store=store,
+                                 cloud=cloud)
+        if s2_groups:
+            break
+
+    s1_products, s2_products = [], []
+    if s1_groups:
+        s1_best = s1_groups[0]
+        s1_products = s1_best["products"]
+        print(f"S1 {s1_best['date']}: {len(s1_products)} scene(s), {100 * s1_best['coverage']:.1f}% of AOI")
+        s2_best = closest_group(s2_groups, s1_best["date"], args.min_coverage)
+    else:
+        s2_best = s2_groups[0] if s2_groups else None
+    if s2_best:
+        s2_products = s2_best["products"]
+        print(f"S2 {s2_best['date']}: {len(s2_products)} scene(s), {100 * s2_best['coverage']:.1f}% of AOI, {100 * s2_best['cloud']:.0f}% cloud")
+
+    # --- Overlapped download -> extract -> features pipeline ---
+    # each S1 scene is paired with the S2 scene at the same position (as before), if any
+    jobs = [(s1, s2_products[i] if i < len(s2_products) else None) for i, s1 in enumerate(s1_products)]
+    store.pin(p["id"] for p in s1_products + s2_products)
+    processor = SafeProcessor(download_dir=download_dir, aoi_wkt=aoi_wkt if args.clip_aoi else None,
+                              feature_cache_dir=None if args.no_feature_cache else args.feature_cache,
+                              band_cache_dir=args.band_cache, band_cache_gb=args.band_cache_gb,
+                              s2_resolution=args.s2_resolution)
+    pipeline = ProductPipeline(
+        client, processor, download_dir, store=store,
+        segments=args.segments,
+        extract=not args.no_extract,
+        full_extract=args.full_extract,
+        s2_resolution=args.s2_resolution,
+        download_workers=args.download_workers,
+        extract_workers=args.extract_workers,
+        feature_workers=args.feature_workers,
+        feature_processes=args.feature_processes,
+        memory_budget_mb=args.memory_budget_mb,
     )
-    if not s2_products:
-        s2_products = search_products(
-            headers, aoi_wkt, start_date, end_date,
-            collection="Sentinel2",
-            extra_params={"productType": "S2MSI1C"},
-            maxRecords=1
-        )
-
-    all_products = []
-    all_products.extend(s1_products)
-    all_products.extend(s2_products)
-
-    # --- Parallel download + extraction ---
-    paths = []
-    if all_products:
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            future_to_product = {
-                executor.submit(download_and_extract, product, headers, download_dir): product
-                for product in all_products
-            }
-            for future in as_completed(future_to_product):
-                product = future_to_product[future]
-                try:
-                    path = future.result()
-                    print(f"{product['properties']['title']} downloaded and extracted to: {path}")
-                    paths.append(path)
-                except Exception as e:
-                    print(f"Error downloading {product['properties']['title']}: {e}")
-
-    # split into S1 / S2 paths
-    s1_paths = [p for p in paths if "S1" in os.path.basename(p)]
-    s2_paths = [p for p in paths if "S2" in os.path.basename(p)]
-    processor = SafeProcessor(download_dir=download_dir)
-    '''
-    # --- Link S1–S2 by closest acquisition date ---
-    
-    s2_map = {}
-    for s1_path in s1_paths:
-        dt1 = processor.extract_datetime_from_safe(s1_path)
-        if not dt1:
-            continue
-        closest_s2 = None
-        min_diff = None
-        for s2_path in s2_paths:
-            dt2 = processor.extract_datetime_from_safe(s2_path)
-            if not dt2:
-                continue
-            diff = abs((dt1 - dt2).total_seconds())
-            if min_diff is None or diff < min_diff:
-                min_diff = diff
-                closest_s2 = s2_path
-        if closest_s2:
-            s2_map[s1_path] = closest_s2
-    '''
-    s2_map = dict(zip(s1_paths, s2_paths))
-    # --- Process and save ---
-        # --- Process and save ---
+    rows, s1_paths = pipeline.run(jobs)
+
     # --- Process and save ---
     if s1_paths:
-        df = processor.process_safe_folders(
-            s1_paths, output_prefix="bucharest_flood", s2_mapping=s2_map
-        )
+        df = processor.rows_to_dataframe(rows, output_prefix="bucharest_flood")
         print(df)
 
         # Ensure new data always has safe_name
         if "safe_name" not in df.columns:
-            df["safe_name"] = [os.path.basename(p) for p in s1_paths]
+            df["safe_name"] = [product_name(p) for p in s1_paths]
 
         # --- Save to CSV (merge + deduplicate) ---
         csv_file = "bucharest_flood.csv"
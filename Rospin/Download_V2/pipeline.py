@@ -0,0 +1,182 @@
+# pipeline.py
+"""
+Staged producer/consumer pipeline: plan -> download -> extract -> features.
+
+Each S1 product (with its paired S2 product, if any) is one job. Jobs travel
+through bounded queues, so a job moves to the next stage as soon as it is
+ready: rasters of the first scene are processed while later scenes are still
+downloading. A product shared by several jobs (typically one S2 tile paired
+with several S1 scenes) is downloaded and extracted only once. Jobs whose
+features are already in the processor's feature cache skip every stage.
+With feature_processes > 1 the feature stage hands its jobs to a pool of
+worker processes (sized to the memory budget), one feature thread per process.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from downloader import download_product, extract_product, product_member_filter, product_paths
+
+_DONE = object()
+
+
+class ProductPipeline:
+    def __init__(self, client, processor, download_dir, store=None, segments=1, extract=True,
+                 full_extract=False, s2_resolution=10, download_workers=4, extract_workers=2,
+                 feature_workers=1, feature_processes=1, memory_budget_mb=None, queue_size=2):
+        """
+        :param download_workers / extract_workers / feature_workers: threads per stage.
+        :param feature_processes: worker processes computing features (1 = in the feature
+                                  threads). Capped by SafeProcessor.pool_size so that the
+                                  workers fit memory_budget_mb (default: available memory).
+        :param queue_size: max jobs waiting between two stages (back-pressure on the
+                           faster stage, so finished downloads do not pile up on disk).
+        """
+        self.client = client
+        self.processor = processor
+        self.download_dir = download_dir
+        self.store = store
+        self.segments = segments
+        self.extract = extract
+        self.full_extract = full_extract
+        self.s2_resolution = s2_resolution
+        self.workers = {"download": download_workers, "extract": extract_workers, "features": feature_workers}
+        self.feature_processes = feature_processes
+        self.memory_budget_mb = memory_budget_mb
+        self.queue_size = queue_size
+        self._pool = None
+
+        self._lock = threading.Lock()
+        self._downloads: Dict[str, Future] = {}
+        self._extractions: Dict[str, Future] = {}
+
+    # ------------------------
+    # Shared per-product work
+    # ------------------------
+    def _once(self, cache: Dict[str, Future], key: str, fn):
+        """Run fn once per key across all worker threads; other callers wait for its result."""
+        with self._lock:
+            fut = cache.get(key)
+            owner = fut is None
+            if owner:
+                fut = cache[key] = Future()
+        if owner:
+            try:
+                fut.set_result(fn())
+            except Exception as e:
+                fut.set_exception(e)
+        return fut.result()
+
+    def _download(self, product):
+        return self._once(self._downloads, product["id"], lambda: download_product(
+            product, self.client, self.download_dir, segments=self.segments, store=self.store))
+
+    def _extract(self, product, zip_path):
+        if not self.extract:
+            return zip_path
+        member_filter = None if self.full_extract else product_member_filter(
+            product["properties"]["title"], self.s2_resolution)
+        return self._once(self._extractions, product["id"], lambda: extract_product(
+            product, self.download_dir, member_filter=member_filter, store=self.store))
+
+    # ------------------------
+    # Stages (job = [index, s1_product, s2_product, s1_path, s2_path])
+    # ------------------------
+    def _stage_download(self, job):
+        _, s1, s2, _, _ = job
+        job[3] = self._download(s1)
+        if s2 is not None:
+            try:
+                job[4] = self._download(s2)
+            except Exception as e:
+                print(f"Error downloading {s2['properties']['title']}: {e} (continuing without S2)")
+                job[2] = None
+        return job
+
+    def _stage_extract(self, job):
+        _, s1, s2, s1_zip, s2_zip = job
+        job[3] = self._extract(s1, s1_zip)
+        if s2 is not None:
+            try:
+                job[4] = self._extract(s2, s2_zip)
+            except Exception as e:
+                print(f"Error extracting {s2['properties']['title']}: {e} (continuing without S2)")
+                job[4] = None
+        print(f"{s1['properties']['title']} ready at: {job[3]}")
+        return job
+
+    def _stage_features(self, job):
+        index, _, _, s1_path, s2_path = job
+        if self._pool is not None:
+            return index, s1_path, self.processor.process_in_pool(self._pool, s1_path, s2_path)
+        return index, s1_path, self.processor.process_one(s1_path, s2_path)
+
+    def _worker(self, fn, in_q, out_q, results):
+        while True:
+            job = in_q.get()
+            if job is _DONE:
+                return
+            try:
+                out = fn(job)
+            except Exception as e:
+                print(f"Error on {job[1]['properties']['title']}: {e}")
+                continue
+            if out_q is not None:
+                out_q.put(out)
+            else:
+                results.append(out)
+
+    def run(self, jobs: List[Tuple[dict, Optional[dict]]]) -> Tuple[List[dict], List[str]]:
+        """
+        Push (s1_product, s2_product_or_None) jobs through all stages.
+        Returns (rows, s1_paths) in job order, for jobs whose S1 product made it through.
+        """
+        stages = [("download", self._stage_download), ("extract", self._stage_extract),
+                  ("features", self._stage_features)]
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in stages]
+        results: List[tuple] = []
+
+        workers = dict(self.workers)
+        n_processes = min(self.processor.pool_size(self.feature_processes, self.memory_budget_mb), len(jobs)) \
+            if self.feature_processes > 1 else 1
+        if n_processes > 1:
+            print(f"Computing features with {n_processes} worker processes")
+            self._pool = self.processor.process_pool(n_processes)
+            workers["features"] = n_processes  # each feature thread waits on one process
+
+        threads = []
+        for i, (name, fn) in enumerate(stages):
+            out_q = queues[i + 1] if i + 1 < len(stages) else None
+            threads.append([
+                threading.Thread(target=self._worker, args=(fn, queues[i], out_q, results),
+                                 name=f"{name}-{k}", daemon=True)
+                for k in range(max(1, workers[name]))
+            ])
+        for group in threads:
+            for t in group:
+                t.start()
+
+        # plan stage: answer cached jobs directly, feed the rest, then close each stage
+        # once the previous one drained
+        for index, (s1, s2) in enumerate(jobs):
+            cached = self.processor.cached_row(s1["properties"]["title"],
+                                               s2["properties"]["title"] if s2 is not None else None)
+            if cached is not None:
+                print(f"{s1['properties']['title']}: features cached, skipping download")
+                results.append((index, product_paths(s1, self.download_dir, self.store)[1], cached))
+                continue
+            queues[0].put([index, s1, s2, None, None])
+        try:
+            for i, group in enumerate(threads):
+                for _ in group:
+                    queues[i].put(_DONE)
+                for t in group:
+                    t.join()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+        results.sort(key=lambda r: r[0])
+        return [r[2] for r in results], [r[1] for r in results]
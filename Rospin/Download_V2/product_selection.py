@@ -0,0 +1,142 @@
+# product_selection.py
+"""
+Footprint-aware choice of catalogue products.
+
+Each catalogue feature carries its footprint as GeoJSON. Products are grouped by
+acquisition date and, per date, the smallest set of scenes whose footprints
+cover the AOI above a threshold is chosen greedily. Products already on disk
+win ties, since picking them costs no download.
+"""
+import os
+from datetime import date as _date
+from typing import Dict, List, Optional
+
+from shapely import wkt
+from shapely.geometry import box, shape
+from shapely.ops import unary_union
+
+
+def aoi_geometry(aoi_wkt: Optional[str] = None, bbox: Optional[str] = None):
+    """AOI as a shapely geometry, from WKT or a 'minLon,minLat,maxLon,maxLat' string."""
+    if bbox:
+        minx, miny, maxx, maxy = map(float, str(bbox).split(","))
+        return box(minx, miny, maxx, maxy)
+    if aoi_wkt:
+        return wkt.loads(aoi_wkt)
+    raise ValueError("Missing AOI")
+
+
+def footprint(product: dict):
+    geom = product.get("geometry")
+    if not geom:
+        return None
+    try:
+        fp = shape(geom)
+        return fp if fp.is_valid else fp.buffer(0)
+    except Exception:
+        return None
+
+
+def acquisition_date(product: dict) -> str:
+    return str(product["properties"].get("startDate", ""))[:10]
+
+
+def coverage_fraction(product: dict, aoi) -> float:
+    """Share of the AOI area inside the product footprint (planar lon/lat, fine for small AOIs)."""
+    fp = footprint(product)
+    if fp is None or aoi.area == 0:
+        return 0.0
+    return float(fp.intersection(aoi).area / aoi.area)
+
+
+def is_local(product: dict, download_dir: Optional[str] = None, store=None) -> bool:
+    """
+    Whether the product needs no download. With a store only the store is asked (it
+    also knows flat-layout copies it will adopt); download_dir is the storeless layout.
+    """
+    if store is not None:
+        return store.has_product(product["id"], product["properties"]["title"])
+    if download_dir:
+        title = product["properties"]["title"]
+        return os.path.exists(os.path.join(download_dir, title)) or os.path.exists(os.path.join(download_dir, f"{title}.zip"))
+    return False
+
+
+def select_cover(products: List[dict], aoi, threshold: float = 0.95, max_scenes: Optional[int] = None,
+                 download_dir: Optional[str] = None, store=None,
+                 cloud: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """
+    Per acquisition date, greedily add the scene that covers the most still-uncovered
+    AOI area (local products first, then the clearest, on equal gain) until
+    `threshold` is reached. `cloud` maps product ids to a cloud score in [0, 1]
+    (see cloud_screen.screen_s2_candidates); products missing from it score 1.
+
+    Returns one group per date:
+        {"date", "products", "coverage", "local", "cloud"}
+    where "cloud" is the score of the chosen scenes weighted by the AOI area each
+    adds (0 without `cloud`), ordered best first: groups reaching the threshold,
+    then higher coverage, less cloud, fewer scenes, more local scenes and the most
+    recent date.
+    """
+    def score(p):
+        return 0.0 if cloud is None else float(cloud.get(p["id"], 1.0))
+
+    def share(area):
+        """Fraction of the AOI area; 0 for a degenerate (zero-area) AOI, like coverage_fraction."""
+        return float(area / aoi.area) if aoi.area else 0.0
+
+    by_date: Dict[str, List[dict]] = {}
+    for p in products:
+        by_date.setdefault(acquisition_date(p), []).append(p)
+
+    groups = []
+    for date, candidates in by_date.items():
+        cands = []
+        for p in candidates:
+            fp = footprint(p)
+            if fp is None:
+                continue
+            part = fp.intersection(aoi)
+            if not part.is_empty:
+                cands.append((p, part, is_local(p, download_dir, store)))
+
+        chosen, gains, covered = [], [], None
+        while cands and (max_scenes is None or len(chosen) < max_scenes):
+            def gain(c):
+                new = c[1] if covered is None else c[1].difference(covered)
+                return new.area
+            best = max(cands, key=lambda c: (round(share(gain(c)), 3), c[2], -score(c[0])))
+            best_gain = gain(best)
+            if best_gain <= 0:
+                break
+            chosen.append(best)
+            gains.append(best_gain)
+            cands.remove(best)
+            covered = best[1] if covered is None else unary_union([covered, best[1]])
+            if share(covered.area) >= threshold:
+                break
+
+        if chosen:
+            groups.append({
+                "date": date,
+                "products": [c[0] for c in chosen],
+                "coverage": share(covered.area),
+                "local": sum(1 for c in chosen if c[2]),
+                "cloud": sum(score(c[0]) * a for c, a in zip(chosen, gains)) / sum(gains),
+            })
+
+    groups.sort(key=lambda g: (g["coverage"] >= threshold, round(g["coverage"], 3), -round(g["cloud"], 2),
+                               -len(g["products"]), g["local"], g["date"]), reverse=True)
+    return groups
+
+
+def closest_group(groups: List[Dict], date: str, threshold: float = 0.95) -> Optional[Dict]:
+    """
+    Group acquired closest to `date` (YYYY-MM-DD) among those meeting the threshold,
+    the clearest one on equal distance; else the best one.
+    """
+    if not groups:
+        return None
+    target = _date.fromisoformat(date)
+    good = [g for g in groups if g["coverage"] >= threshold] or groups[:1]
+    return min(good, key=lambda g: (abs((_date.fromisoformat(g["date"]) - target).days), g.get("cloud", 0.0)))
@@ -0,0 +1,374 @@
+# product_store.py
+"""
+Local product store keyed by Copernicus product id.
+
+Layout under the store root:
+    <root>/<product_id>/<title>.zip      downloaded archive
+    <root>/<product_id>/<title>/         extracted (possibly partial) SAFE tree
+    <root>/.store/index.json             size / last access / extraction state
+    <root>/.store/pins.json              products in use, per owning process
+    <root>/.store/lock                   inter-process lock (CLI + Flask service)
+
+When a byte quota is set, space is reclaimed in LRU order, dropping extracted
+trees before any zip, since a tree can be rebuilt from its zip without network.
+Pins are shared through pins.json under the same lock, so one process never
+evicts a product another one is using. A pin is dropped once its process is
+gone (checked on the same host) or after PIN_MAX_AGE (owners on other hosts).
+Zips found in the store but missing from the index (e.g. written before the
+index existed, or by an interrupted run) are registered when the store opens.
+So are products of the older flat layout (<root>/<title>.zip, <root>/<title>),
+under a "legacy:<title>" key since their id is unknown: they count against the
+quota and are evicted like any other product, and adopt_legacy() moves one into
+its id folder the first time the product is asked for again.
+"""
+import os
+import json
+import time
+import shutil
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+# advisory file locking (POSIX only); on other platforms only the in-process lock applies
+try:
+    import fcntl
+    _HAS_FCNTL = True
+except Exception:
+    _HAS_FCNTL = False
+
+PIN_MAX_AGE = 24 * 3600  # seconds; pins whose owner cannot be checked expire after this
+LEGACY_PREFIX = "legacy:"  # index key prefix of flat-layout products, followed by the title
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+def _pin_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: str, since: float) -> bool:
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or os.name != "posix":
+        return time.time() - since < PIN_MAX_AGE
+    try:
+        os.kill(int(pid), 0)  # signal 0: existence check only
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        pass
+    return True
+
+
+class ProductStore:
+    def __init__(self, root: str = "downloads", quota_bytes: Optional[int] = None):
+        """
+        :param quota_bytes: upper bound on bytes held by the store (zips + extracted trees).
+                            None disables eviction.
+        """
+        self.root = root
+        self.quota_bytes = int(quota_bytes) if quota_bytes else None
+        self._meta_dir = os.path.join(root, ".store")
+        self._index_path = os.path.join(self._meta_dir, "index.json")
+        self._pins_path = os.path.join(self._meta_dir, "pins.json")
+        self._lock_path = os.path.join(self._meta_dir, "lock")
+        self._thread_lock = threading.RLock()
+        os.makedirs(self._meta_dir, exist_ok=True)
+        self._register_untracked()
+
+    # ------------------------
+    # Locking + index I/O
+    # ------------------------
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            with open(self._lock_path, "a") as lock_file:
+                if _HAS_FCNTL:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if _HAS_FCNTL:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self) -> Dict[str, dict]:
+        if not os.path.exists(self._index_path):
+            return {}
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️ Product store index unreadable, starting empty: {e}")
+            return {}
+
+    def _save(self, index: Dict[str, dict], path: Optional[str] = None):
+        path = path or self._index_path
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp, path)
+
+    def _load_pins(self) -> Dict[str, Dict[str, float]]:
+        """product id -> {owner: pinned at}, without owners that are gone (call under the lock)."""
+        try:
+            with open(self._pins_path) as f:
+                pins = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        live = {}
+        for pid, owners in pins.items():
+            owners = {o: t for o, t in owners.items() if _owner_alive(o, t)}
+            if owners:
+                live[pid] = owners
+        return live
+
+    def _register_untracked(self):
+        """
+        Add products the index does not know about: <root>/<product_id>/<title>.zip
+        archives, and flat-layout <root>/<title>.zip / <root>/<title> (.SAFE) leftovers.
+        """
+        try:
+            names = [n for n in os.listdir(self.root) if not n.startswith(".")]
+        except OSError:
+            return
+        found = {}
+        for name in names:
+            path = os.path.join(self.root, name)
+            if os.path.isfile(path) and name.endswith(".zip"):
+                found[LEGACY_PREFIX + name[:-len(".zip")]] = name[:-len(".zip")]
+            elif os.path.isdir(path) and name.upper().endswith(".SAFE"):
+                found[LEGACY_PREFIX + name] = name
+            elif os.path.isdir(path):
+                for member in os.listdir(path):
+                    if member.endswith(".zip") and os.path.isfile(os.path.join(path, member)):
+                        found[name] = member[:-len(".zip")]
+                        break
+        if not found:
+            return
+        with self._locked():
+            index = self._load()
+            added = 0
+            for pid, title in found.items():
+                if pid in index:
+                    continue
+                entry = {"title": title, "legacy": True} if pid.startswith(LEGACY_PREFIX) else {"title": title}
+                zip_path, extract_path = self._entry_paths(pid, entry)
+                has_zip = os.path.isfile(zip_path)
+                extracted = os.path.isdir(extract_path)
+                entry.update({
+                    "has_zip": has_zip,
+                    "zip_size": os.path.getsize(zip_path) if has_zip else 0,
+                    "extracted": extracted,
+                    "extract_size": _tree_size(extract_path) if extracted else 0,
+                    "last_access": os.path.getmtime(zip_path if has_zip else extract_path),
+                })
+                index[pid] = entry
+                added += 1
+            if added:
+                self._save(index)
+                print(f"Product store: registered {added} product(s) missing from the index")
+
+    # ------------------------
+    # Paths + lookups
+    # ------------------------
+    def paths(self, product_id: str, title: str) -> Tuple[str, str]:
+        """(zip_path, extract_path) for a product; the folder is keyed by id, files keep the title."""
+        base = os.path.join(self.root, product_id)
+        return os.path.join(base, f"{title}.zip"), os.path.join(base, title)
+
+    def _entry_paths(self, key: str, entry: dict) -> Tuple[str, str]:
+        """paths() of an index entry, flat-layout ones included."""
+        if entry.get("legacy"):
+            return os.path.join(self.root, f"{entry['title']}.zip"), os.path.join(self.root, entry["title"])
+        return self.paths(key, entry["title"])
+
+    def _remove_files(self, key: str, entry: dict):
+        if entry.get("legacy"):
+            zip_path, extract_path = self._entry_paths(key, entry)
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+            shutil.rmtree(extract_path, ignore_errors=True)
+        else:
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+    def adopt_legacy(self, product_id: str, title: str) -> bool:
+        """
+        Move a flat-layout copy of the product (<root>/<title>.zip and/or <root>/<title>)
+        into its id folder and index entry, so it is reused instead of downloaded again.
+        Returns whether anything was adopted.
+        """
+        key = LEGACY_PREFIX + title
+        with self._locked():
+            index = self._load()
+            entry = index.get(key)
+            if entry is None:
+                return False
+            old_zip, old_tree = self._entry_paths(key, entry)
+            new_zip, new_tree = self.paths(product_id, title)
+            os.makedirs(os.path.dirname(new_zip), exist_ok=True)
+            if os.path.isfile(old_zip) and not os.path.exists(new_zip):
+                os.replace(old_zip, new_zip)
+            if os.path.isdir(old_tree) and not os.path.exists(new_tree):
+                os.replace(old_tree, new_tree)
+            del index[key]
+            entry.pop("legacy", None)
+            current = index.get(product_id, {})  # the id folder may already hold part of it
+            has_zip, extracted = os.path.isfile(new_zip), os.path.isdir(new_tree)
+            entry.update({
+                "has_zip": has_zip,
+                "zip_size": os.path.getsize(new_zip) if has_zip else 0,
+                "extracted": extracted,
+                "extract_size": _tree_size(new_tree) if extracted else 0,
+                "last_access": max(entry.get("last_access", 0), current.get("last_access", 0)),
+            })
+            index[product_id] = entry
+            self._save(index)
+            self._remove_files(key, {"title": title, "legacy": True})  # copies the id folder already had
+            print(f"Product store: adopted {title} from the flat download layout")
+            return True
+
+    def lookup(self, product_id: str) -> Optional[dict]:
+        """Index entry for a product whose files are still on disk, refreshing its last access."""
+        with self._locked():
+            index = self._load()
+            entry = index.get(product_id)
+            if entry is None:
+                return None
+            zip_path, extract_path = self._entry_paths(product_id, entry)
+            entry["has_zip"] = os.path.exists(zip_path)
+            entry["extracted"] = entry.get("extracted", False) and os.path.isdir(extract_path)
+            if not entry["has_zip"] and not entry["extracted"]:
+                del index[product_id]
+                self._save(index)
+                return None
+            entry["last_access"] = time.time()
+            self._save(index)
+            return dict(entry)
+
+    def has_product(self, product_id: str, title: Optional[str] = None) -> bool:
+        """
+        Whether the product's files are on disk, under its id or, given its title, in the
+        flat layout (which download_product adopts instead of downloading). Read-only:
+        unlike lookup() it neither refreshes the last access nor rewrites the index, so
+        probing candidates (see product_selection.is_local) leaves the LRU order alone.
+        """
+        index = self._load()  # index.json is replaced atomically, no lock needed to read it
+        keys = [product_id] + ([LEGACY_PREFIX + title] if title else [])
+        for key in keys:
+            entry = index.get(key)
+            if entry is None:
+                continue
+            zip_path, extract_path = self._entry_paths(key, entry)
+            if os.path.exists(zip_path) or (entry.get("extracted", False) and os.path.isdir(extract_path)):
+                return True
+        return False
+
+    def total_bytes(self) -> int:
+        with self._locked():
+            return sum(e.get("zip_size", 0) + e.get("extract_size", 0) for e in self._load().values())
+
+    # ------------------------
+    # Recording state
+    # ------------------------
+    def record_zip(self, product_id: str, title: str):
+        zip_path, _ = self.paths(product_id, title)
+        with self._locked():
+            index = self._load()
+            entry = index.setdefault(product_id, {"title": title, "extracted": False, "extract_size": 0})
+            entry.update({
+                "title": title,
+                "has_zip": True,
+                "zip_size": os.path.getsize(zip_path),
+                "last_access": time.time(),
+            })
+            self._save(index)
+
+    def record_extracted(self, product_id: str, title: str):
+        _, extract_path = self.paths(product_id, title)
+        size = _tree_size(extract_path)
+        with self._locked():
+            index = self._load()
+            entry = index.setdefault(product_id, {"title": title, "has_zip": False, "zip_size": 0})
+            entry.update({
+                "title": title,
+                "extracted": True,
+                "extract_size": size,
+                "last_access": time.time(),
+            })
+            self._save(index)
+
+    # ------------------------
+    # Eviction
+    # ------------------------
+    def pin(self, product_ids: Iterable[str]):
+        """Protect products used by the running job from eviction, in every process using the store."""
+        owner, now = _pin_owner(), time.time()
+        with self._locked():
+            pins = self._load_pins()
+            for pid in product_ids:
+                pins.setdefault(pid, {})[owner] = now
+            self._save(pins, self._pins_path)
+
+    def unpin(self, product_ids: Iterable[str]):
+        owner = _pin_owner()
+        with self._locked():
+            pins = self._load_pins()
+            for pid in product_ids:
+                owners = pins.get(pid, {})
+                owners.pop(owner, None)
+                if not owners:
+                    pins.pop(pid, None)
+            self._save(pins, self._pins_path)
+
+    def ensure_space(self, needed_bytes: int = 0, keep: Iterable[str] = ()):
+        """
+        Evict least-recently-used data until `needed_bytes` more fit under the quota.
+        Extracted trees go first, zips only once no evictable tree is left.
+        Products listed in `keep` are never touched.
+        """
+        if not self.quota_bytes:
+            return
+        with self._locked():
+            keep = set(keep) | set(self._load_pins())
+            index = self._load()
+            used = sum(e.get("zip_size", 0) + e.get("extract_size", 0) for e in index.values())
+
+            trees = sorted(
+                (e["last_access"], pid) for pid, e in index.items()
+                if pid not in keep and e.get("extracted")
+            )
+            for _, pid in trees:
+                if used + needed_bytes <= self.quota_bytes:
+                    break
+                entry = index[pid]
+                if not entry.get("has_zip"):
+                    continue  # the tree is the only copy; handled with the zips below
+                _, extract_path = self._entry_paths(pid, entry)
+                shutil.rmtree(extract_path, ignore_errors=True)
+                used -= entry.get("extract_size", 0)
+                entry.update({"extracted": False, "extract_size": 0})
+                print(f"🧹 Evicted extracted tree of {entry['title']}")
+
+            products = sorted(
+                (e["last_access"], pid) for pid, e in index.items() if pid not in keep
+            )
+            for _, pid in products:
+                if used + needed_bytes <= self.quota_bytes:
+                    break
+                entry = index.pop(pid)
+                self._remove_files(pid, entry)
+                used -= entry.get("zip_size", 0) + entry.get("extract_size", 0)
+                print(f"🧹 Evicted {entry['title']}")
+
+            self._save(index)
+            if used + needed_bytes > self.quota_bytes:
+                print(f"⚠️ Product store over quota: {used + needed_bytes} > {self.quota_bytes} bytes")
@@ -0,0 +1,147 @@
+# raster_stats.py
+"""
+Exact, bounded-memory statistics over full-resolution rasters.
+
+RunningStats keeps count / mean / M2 / min / max / NaN count and merges partial
+results with the pairwise update of Chan et al., so statistics accumulated per
+window (or per worker) combine into exactly the full-raster values without
+the catastrophic cancellation of a naive sum of squares.
+
+Data is consumed in its native dtype (uint16 DNs, float32 reflectances) in
+cache-sized slices: each slice is converted once into a per-thread float64
+scratch buffer and all four statistics are taken while it is still in cache,
+so no full-size temporary is ever allocated.
+"""
+import math
+import threading
+from typing import Iterator, Tuple
+
+import numpy as np
+from rasterio.windows import Window
+
+NAN_STATS = (np.nan, np.nan, np.nan, np.nan)
+STATS_SLICE = 1 << 16   # elements per cache-resident slice (512 KiB of float64)
+
+_local = threading.local()
+
+
+def _scratch() -> Tuple[np.ndarray, np.ndarray]:
+    """Per-thread (float64, bool) scratch buffers of STATS_SLICE elements."""
+    bufs = getattr(_local, "bufs", None)
+    if bufs is None:
+        bufs = _local.bufs = (np.empty(STATS_SLICE, dtype=np.float64), np.empty(STATS_SLICE, dtype=bool))
+    return bufs
+
+
+class RunningStats:
+    __slots__ = ("count", "mean", "m2", "min", "max", "nan_count")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.nan_count = 0
+
+    def _merge_parts(self, n: int, mean: float, m2: float, vmin: float, vmax: float):
+        if n == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2, self.min, self.max = n, mean, m2, vmin, vmax
+            return
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+
+    def update(self, arr: np.ndarray):
+        """
+        Add the finite values of a block; non-finite values are counted as NaN.
+        The block is walked in STATS_SLICE pieces without copying or upcasting it.
+        """
+        a = np.asarray(arr).reshape(-1)
+        check_finite = a.dtype.kind == "f"
+        buf, finite = _scratch()
+        for start in range(0, a.size, STATS_SLICE):
+            piece = a[start:start + STATS_SLICE]
+            n = piece.size
+            if check_finite:
+                ok = np.isfinite(piece, out=finite[:n])
+                n_ok = int(np.count_nonzero(ok))
+                if n_ok != n:
+                    self.nan_count += n - n_ok
+                    piece = piece[ok]  # bounded by STATS_SLICE
+                    n = n_ok
+            if n == 0:
+                continue
+            work = buf[:n]
+            np.copyto(work, piece, casting="unsafe")
+            mean = float(work.sum()) / n
+            vmin = float(work.min())
+            vmax = float(work.max())
+            np.subtract(work, mean, out=work)
+            self._merge_parts(n, mean, float(np.dot(work, work)), vmin, vmax)
+
+    def merge(self, other: "RunningStats"):
+        self.nan_count += other.nan_count
+        self._merge_parts(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def result(self) -> Tuple[float, float, float, float]:
+        """(mean, std, min, max) with population std, like np.std; NaNs if no finite value."""
+        if self.count == 0:
+            return NAN_STATS
+        return (self.mean, math.sqrt(max(self.m2, 0.0) / self.count), self.min, self.max)
+
+
+def normalized_stats(raw: Tuple[float, float, float, float]) -> Tuple[float, float, float, float]:
+    """
+    Stats of (a - min) / (max - min) derived exactly from the stats of a, so a
+    min-max normalisation needs no second pass over the data.
+    """
+    mean, std, vmin, vmax = raw
+    if not np.isfinite(vmin) or not np.isfinite(vmax) or vmax == vmin:
+        return NAN_STATS
+    span = vmax - vmin
+    return ((mean - vmin) / span, std / span, 0.0, 1.0)
+
+
+def fraction_stats(n_true: int, n_total: int) -> Tuple[float, float, float, float]:
+    """(mean, std, min, max) of a 0/1 mask with n_true ones among n_total pixels."""
+    if n_total == 0:
+        return NAN_STATS
+    p = n_true / n_total
+    return (p, math.sqrt(p * (1.0 - p)), 0.0 if n_true < n_total else 1.0, 1.0 if n_true > 0 else 0.0)
+
+
+def chunk_windows(src, target_pixels: int = 4_000_000, window: Window = None) -> Iterator[Window]:
+    """
+    Windows covering `window` (default: the whole raster), aligned to the native
+    block layout and grouped to roughly target_pixels each, so every native tile
+    or strip is decoded exactly once.
+    """
+    full = window or Window(0, 0, src.width, src.height)
+    col0, row0 = int(full.col_off), int(full.row_off)
+    width, height = int(full.width), int(full.height)
+    bh, bw = src.block_shapes[0]
+    bh, bw = max(1, bh), max(1, bw)
+
+    if width * bh <= target_pixels:
+        chunk_w = width
+    else:
+        chunk_w = max(bw, (target_pixels // bh) // bw * bw)
+    chunk_h = max(bh, (target_pixels // max(1, chunk_w)) // bh * bh)
+
+    # start on a block boundary so chunks line up with the file's tiles
+    first_row = row0 - (row0 % bh)
+    first_col = col0 - (col0 % bw)
+    for r in range(first_row, row0 + height, chunk_h):
+        r_lo, r_hi = max(r, row0), min(r + chunk_h, row0 + height)
+        for c in range(first_col, col0 + width, chunk_w):
+            c_lo, c_hi = max(c, col0), min(c + chunk_w, col0 + width)
+            if r_hi > r_lo and c_hi > c_lo:
+                yield Window(c_lo, r_lo, c_hi - c_lo, r_hi - r_lo)
@@ -0,0 +1,200 @@
+# s1_annotation.py
+"""
+Streaming, cached reader of the Sentinel-1 annotation geolocation grid.
+
+Each annotation XML (one per swath and polarisation) carries a coarse grid
+of geolocationGridPoint tie points (image line/pixel -> lat/lon/height). The
+grid is read with iterparse: elements are cleared as soon as they are
+consumed and reading stops at the end of <geolocationGrid>, so the rest of the
+(large) document is never built. Polarisations of one swath share their grid,
+so only one file per swath is parsed.
+
+The result is kept per product both in memory and as a small .npz in
+ANNOTATION_CACHE_DIR, and serves as centre, footprint and GCP source.
+"""
+import os
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from rasterio.control import GroundControlPoint
+from shapely.geometry import Polygon
+from shapely.ops import unary_union
+
+import safe_archive
+
+ANNOTATION_CACHE_DIR = "annotation_cache"
+_POINT_FIELDS = ("line", "pixel", "latitude", "longitude", "height")
+
+
+class GeolocationGrid:
+    """Tie points of one swath, sorted by (line, pixel)."""
+    __slots__ = ("line", "pixel", "lat", "lon", "height")
+
+    def __init__(self, line, pixel, lat, lon, height):
+        order = np.lexsort((pixel, line))
+        self.line = np.asarray(line, dtype=np.int32)[order]
+        self.pixel = np.asarray(pixel, dtype=np.int32)[order]
+        self.lat = np.asarray(lat, dtype=np.float64)[order]
+        self.lon = np.asarray(lon, dtype=np.float64)[order]
+        self.height = np.asarray(height, dtype=np.float64)[order]
+
+    def __len__(self):
+        return len(self.line)
+
+    def footprint(self) -> Optional[Polygon]:
+        """Outline of the grid in lon/lat (all border tie points, not only the corners)."""
+        n_cols = len(np.unique(self.pixel))
+        if n_cols < 2 or len(self) % n_cols:
+            return None
+        lon = self.lon.reshape(-1, n_cols)
+        lat = self.lat.reshape(-1, n_cols)
+        if lon.shape[0] < 2:
+            return None
+        ring = ([(lon[0, j], lat[0, j]) for j in range(n_cols)] +
+                [(lon[i, -1], lat[i, -1]) for i in range(1, lon.shape[0])] +
+                [(lon[-1, j], lat[-1, j]) for j in range(n_cols - 2, -1, -1)] +
+                [(lon[i, 0], lat[i, 0]) for i in range(lon.shape[0] - 2, 0, -1)])
+        poly = Polygon(ring)
+        return poly if poly.is_valid else poly.buffer(0)
+
+    def gcps(self) -> List[GroundControlPoint]:
+        """GCPs (row = line, col = pixel, x = lon, y = lat, z = height), EPSG:4326."""
+        return [GroundControlPoint(row=float(r), col=float(c), x=float(x), y=float(y), z=float(z))
+                for r, c, x, y, z in zip(self.line, self.pixel, self.lon, self.lat, self.height)]
+
+
+def parse_geolocation_grid(fh) -> Optional[GeolocationGrid]:
+    """Stream one annotation XML (file object) and return its geolocation grid."""
+    values = {k: [] for k in _POINT_FIELDS}
+    point: Dict[str, str] = {}
+    in_grid = False
+    for event, elem in ET.iterparse(fh, events=("start", "end")):
+        name = elem.tag.rpartition("}")[2]
+        if event == "start":
+            if name == "geolocationGrid":
+                in_grid = True
+            continue
+        if not in_grid:
+            elem.clear()   # keep memory flat while skipping the rest of the document
+        elif name in _POINT_FIELDS:
+            point[name] = elem.text
+        elif name == "geolocationGridPoint":
+            try:
+                row = [float(point[k]) for k in _POINT_FIELDS]
+            except (KeyError, TypeError, ValueError):
+                row = None
+            if row is not None:
+                for k, v in zip(_POINT_FIELDS, row):
+                    values[k].append(v)
+            point.clear()
+            elem.clear()
+        elif name == "geolocationGrid":
+            break          # nothing else is needed from this file
+    if not values["line"]:
+        return None
+    return GeolocationGrid(values["line"], values["pixel"], values["latitude"],
+                           values["longitude"], values["height"])
+
+
+def _swath(rel: str) -> str:
+    """'s1a-iw-grd-vv-....xml' -> 'iw'; 's1a-iw1-slc-vh-....xml' -> 'iw1'."""
+    parts = rel.rsplit("/", 1)[-1].split("-")
+    return parts[1].lower() if len(parts) > 1 else rel
+
+
+class ProductGeolocation:
+    """Geolocation grids of one S1 product, by swath."""
+
+    def __init__(self, grids: Dict[str, GeolocationGrid]):
+        self.grids = grids
+
+    def center(self) -> Tuple[Optional[float], Optional[float]]:
+        """(lat, lon) mean of all tie points."""
+        lats = [g.lat for g in self.grids.values()]
+        lons = [g.lon for g in self.grids.values()]
+        if not lats:
+            return (None, None)
+        return (float(np.mean(np.concatenate(lats))), float(np.mean(np.concatenate(lons))))
+
+    def footprint(self):
+        parts = [fp for fp in (g.footprint() for g in self.grids.values()) if fp is not None]
+        return unary_union(parts) if parts else None
+
+    def gcps(self, swath: Optional[str] = None) -> List[GroundControlPoint]:
+        """GCPs of one swath (the only one for GRD products when swath is None)."""
+        if swath is None:
+            if len(self.grids) != 1:
+                return []
+            return next(iter(self.grids.values())).gcps()
+        grid = self.grids.get(swath.lower())
+        return grid.gcps() if grid is not None else []
+
+
+def _cache_path(cache_dir: str, safe_dir: str) -> str:
+    return os.path.join(cache_dir, f"{safe_archive.product_name(safe_dir)}.npz")
+
+
+def _load_cached(path: str) -> Optional[ProductGeolocation]:
+    try:
+        with np.load(path) as data:
+            swaths = sorted({k.split(".", 1)[0] for k in data.files})
+            return ProductGeolocation({
+                s: GeolocationGrid(*(data[f"{s}.{k}"] for k in ("line", "pixel", "lat", "lon", "height")))
+                for s in swaths
+            })
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save_cached(path: str, geo: ProductGeolocation):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    arrays = {f"{s}.{k}": getattr(g, k) for s, g in geo.grids.items()
+              for k in ("line", "pixel", "lat", "lon", "height")}
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+@lru_cache(maxsize=64)
+def _product_geolocation(safe_dir: str, mtime: float, cache_dir: Optional[str]) -> Optional[ProductGeolocation]:
+    path = _cache_path(cache_dir, safe_dir) if cache_dir else None
+    if path and os.path.exists(path):
+        geo = _load_cached(path)
+        if geo is not None:
+            return geo
+
+    grids: Dict[str, GeolocationGrid] = {}
+    for rel in sorted(safe_archive.list_dir(safe_dir, "annotation")):
+        if not rel.lower().endswith(".xml") or _swath(rel) in grids:
+            continue
+        try:
+            with safe_archive.open_file(safe_dir, rel) as fh:
+                grid = parse_geolocation_grid(fh)
+        except Exception:
+            continue  # skip malformed xml
+        if grid is not None:
+            grids[_swath(rel)] = grid
+    if not grids:
+        return None
+
+    geo = ProductGeolocation(grids)
+    if path:
+        try:
+            _save_cached(path, geo)
+        except OSError:
+            pass
+    return geo
+
+
+def product_geolocation(safe_dir: str, cache_dir: Optional[str] = ANNOTATION_CACHE_DIR) -> Optional[ProductGeolocation]:
+    """
+    Geolocation grids of an S1 product (extracted .SAFE folder or .zip), parsed
+    once and then served from memory / the on-disk cache; None if unavailable.
+    """
+    try:
+        mtime = os.path.getmtime(safe_dir)
+    except OSError:
+        return None
+    return _product_geolocation(safe_dir, mtime, cache_dir)
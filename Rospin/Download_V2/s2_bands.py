@@ -0,0 +1,126 @@
+# s2_bands.py
+"""
+Band index of a Sentinel-2 product: (band, resolution) -> file.
+
+The index is built from manifest.safe (every file is listed there as a
+<fileLocation href=...>), or from the IMAGE_FILE entries of the product
+metadata (MTD_MSIL1C.xml / MTD_MSIL2A.xml), and only falls back to listing
+the product tree when neither is usable. Both XML files are streamed.
+Entries that are not present on disk (selective extraction keeps only the
+bands we read) are dropped. The index is cached per product version.
+
+L2A products hold most bands at several resolutions (R10m/R20m/R60m); L1C
+products hold each band once at its native resolution.
+"""
+import os
+import re
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import safe_archive
+
+S2_NATIVE_RESOLUTION = {
+    "B01": 60, "B02": 10, "B03": 10, "B04": 10, "B05": 20, "B06": 20, "B07": 20,
+    "B08": 10, "B8A": 20, "B09": 60, "B10": 60, "B11": 20, "B12": 20,
+}
+# ..._B03_10m.jp2 (L2A) or ..._B03.jp2 (L1C); IMG_DATA only, so QI masks (MSK_*_B03.jp2) never match
+_BAND_FILE_RE = re.compile(r"/IMG_DATA/(?:.*/)?[^/]*_(B\d{2}|B8A)(?:_(\d+)m)?\.(?:jp2|tiff?)$", re.IGNORECASE)
+
+
+def band_of(path: str) -> Optional[Tuple[str, int]]:
+    """(band, resolution in m) of a band image path, or None for any other file."""
+    m = _BAND_FILE_RE.search("/" + path.replace("\\", "/"))
+    if not m:
+        return None
+    band = m.group(1).upper()
+    res = int(m.group(2)) if m.group(2) else S2_NATIVE_RESOLUTION.get(band)
+    return (band, res) if res else None
+
+
+def closest_resolution(available: Iterable[int], resolution: int) -> Optional[int]:
+    """Available resolution closest to the target, the finer one on ties."""
+    available = list(available)
+    if not available:
+        return None
+    return min(available, key=lambda r: (abs(r - resolution), r))
+
+
+def _manifest_files(fh) -> List[str]:
+    out = []
+    for _, elem in ET.iterparse(fh, events=("end",)):
+        if elem.tag.rpartition("}")[2] == "fileLocation":
+            href = elem.get("href")
+            if href:
+                out.append(href[2:] if href.startswith("./") else href)
+        elem.clear()
+    return out
+
+
+def _metadata_files(fh) -> List[str]:
+    """IMAGE_FILE / IMAGE_FILE_2A entries have no extension; all band images are JPEG2000."""
+    out = []
+    for _, elem in ET.iterparse(fh, events=("end",)):
+        if elem.tag.rpartition("}")[2].startswith("IMAGE_FILE") and elem.text:
+            out.append(elem.text.strip() + ".jp2")
+        elem.clear()
+    return out
+
+
+class S2BandIndex:
+    def __init__(self, safe_dir: str, files: Dict[Tuple[str, int], str]):
+        self.safe_dir = safe_dir
+        self.files = files  # (band, resolution) -> path relative to the SAFE root
+
+    def resolutions(self, band: str) -> List[int]:
+        return sorted(r for b, r in self.files if b == band.upper())
+
+    def relpath(self, band: str, resolution: int = 10) -> Optional[str]:
+        res = closest_resolution(self.resolutions(band), resolution)
+        return self.files[(band.upper(), res)] if res is not None else None
+
+    def path(self, band: str, resolution: int = 10) -> Optional[str]:
+        """Openable path (/vsizip/ for zips) of the band at the resolution closest to the target."""
+        rel = self.relpath(band, resolution)
+        return safe_archive.raster_path(self.safe_dir, rel) if rel else None
+
+    def select(self, bands: Iterable[str], resolution: int = 10) -> Dict[str, Optional[str]]:
+        return {b: self.path(b, resolution) for b in bands}
+
+
+def _index_from(safe_dir: str, names: Iterable[str]) -> Dict[Tuple[str, int], str]:
+    files = {}
+    for rel in names:
+        key = band_of(rel)
+        if key and key not in files and safe_archive.exists(safe_dir, rel):
+            files[key] = rel
+    return files
+
+
+def _metadata_sources(safe_dir: str) -> List[Tuple[str, object]]:
+    sources = [("manifest.safe", _manifest_files)]
+    for rel in safe_archive.list_dir(safe_dir, ""):
+        if rel.upper().startswith("MTD_MSIL") and rel.lower().endswith(".xml"):
+            sources.append((rel, _metadata_files))
+    return sources
+
+
+@lru_cache(maxsize=64)
+def _band_index(safe_dir: str, mtime: float) -> S2BandIndex:
+    for rel, parse in _metadata_sources(safe_dir):
+        try:
+            if not safe_archive.exists(safe_dir, rel):
+                continue
+            with safe_archive.open_file(safe_dir, rel) as fh:
+                files = _index_from(safe_dir, parse(fh))
+        except (OSError, ET.ParseError, KeyError):
+            continue
+        if files:
+            return S2BandIndex(safe_dir, files)
+    # no usable metadata (e.g. a hand-assembled folder): list the tree once
+    return S2BandIndex(safe_dir, _index_from(safe_dir, safe_archive.list_files(safe_dir)))
+
+
+def band_index(safe_dir: str) -> S2BandIndex:
+    """Band index of an S2 product (extracted .SAFE folder or .zip), cached per product version."""
+    return _band_index(safe_dir, os.path.getmtime(safe_dir))
@@ -0,0 +1,106 @@
+# safe_archive.py
+"""
+Uniform access to Sentinel .SAFE products, whether they are an extracted folder
+or still packed in the downloaded .zip.
+
+Files are addressed by their path relative to the SAFE root, e.g.
+"measurement/s1a-iw-grd-vv-....tiff" or "annotation/s1a-iw-grd-vv-....xml".
+For zips the listing comes from the central directory and rasters are opened
+in place through GDAL's /vsizip/ virtual file system, so nothing is extracted.
+"""
+import os
+import zipfile
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, List
+
+
+def is_zip(path: str) -> bool:
+    return str(path).lower().endswith(".zip") and os.path.isfile(path)
+
+
+def product_name(path: str) -> str:
+    """Product folder name without a trailing .zip (matches the extracted folder name)."""
+    name = os.path.basename(os.path.normpath(path))
+    return name[:-4] if name.lower().endswith(".zip") else name
+
+
+def _strip_safe_root(name: str) -> str:
+    parts = name.split("/", 1)
+    if len(parts) > 1 and parts[0].upper().endswith(".SAFE"):
+        return parts[1]
+    return name
+
+
+@lru_cache(maxsize=64)
+def _zip_index(path: str, mtime: float) -> Dict[str, str]:
+    """relative path -> zip member name, read once per archive version."""
+    with zipfile.ZipFile(path, "r") as zf:
+        return {
+            _strip_safe_root(info.filename): info.filename
+            for info in zf.infolist()
+            if not info.is_dir()
+        }
+
+
+def _dir_root(path: str) -> str:
+    """Folders extracted with extractall() keep the nested NAME.SAFE folder; step into it."""
+    if not os.path.isdir(os.path.join(path, "measurement")) and not os.path.isfile(os.path.join(path, "manifest.safe")):
+        for item in os.listdir(path):
+            inner = os.path.join(path, item)
+            if item.upper().endswith(".SAFE") and os.path.isdir(inner):
+                return inner
+    return path
+
+
+def list_files(safe_path: str) -> List[str]:
+    """All files in the product, as '/'-separated paths relative to the SAFE root."""
+    if is_zip(safe_path):
+        return list(_zip_index(safe_path, os.path.getmtime(safe_path)).keys())
+
+    root = _dir_root(safe_path)
+    out = []
+    for dirpath, _, files in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        for f in files:
+            out.append(f if rel_dir == "." else f"{rel_dir}/{f}")
+    return out
+
+
+def list_dir(safe_path: str, subdir: str) -> List[str]:
+    """Files directly inside a top-level folder of the product (e.g. 'measurement'; '' = the SAFE root)."""
+    prefix = subdir.strip("/") + "/" if subdir.strip("/") else ""
+    if is_zip(safe_path):
+        return [r for r in list_files(safe_path) if r.startswith(prefix) and "/" not in r[len(prefix):]]
+
+    folder = os.path.join(_dir_root(safe_path), subdir)
+    if not os.path.isdir(folder):
+        return []
+    return [prefix + f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))]
+
+
+def exists(safe_path: str, rel: str) -> bool:
+    """Whether a product file is present (selective extraction leaves most files out)."""
+    if is_zip(safe_path):
+        return rel in _zip_index(safe_path, os.path.getmtime(safe_path))
+    return os.path.isfile(os.path.join(_dir_root(safe_path), *rel.split("/")))
+
+
+def raster_path(safe_path: str, rel: str) -> str:
+    """Path that rasterio/GDAL can open for a file of the product."""
+    if is_zip(safe_path):
+        member = _zip_index(safe_path, os.path.getmtime(safe_path))[rel]
+        return f"/vsizip/{os.path.abspath(safe_path)}/{member}"
+    return os.path.join(_dir_root(safe_path), *rel.split("/"))
+
+
+@contextmanager
+def open_file(safe_path: str, rel: str):
+    """Binary file object for a product file, read in place from the zip when packed."""
+    if is_zip(safe_path):
+        member = _zip_index(safe_path, os.path.getmtime(safe_path))[rel]
+        with zipfile.ZipFile(safe_path, "r") as zf, zf.open(member) as f:
+            yield f
+    else:
+        with open(os.path.join(_dir_root(safe_path), *rel.split("/")), "rb") as f:
+            yield f
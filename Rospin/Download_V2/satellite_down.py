@@ -1,12 +1,22 @@
 import os
-import xml.etree.ElementTree as ET
-from typing import Tuple, Optional, Dict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Tuple, Optional, Dict, Iterator, List
 
 import numpy as np
 import pandas as pd
 import rasterio
-from rasterio.warp import transform
 from rasterio.enums import Resampling
+from rasterio.windows import Window
+from shapely import wkt as shapely_wkt
+
+import safe_archive
+from aoi_window import aoi_window, window_center_latlon
+from feature_cache import FeatureCache
+from band_cache import BandCache
+from s1_annotation import product_geolocation
+from s2_bands import band_index
+from grid_engine import TargetGrid, Layer, run_tiles
+from raster_stats import RunningStats, NAN_STATS, normalized_stats, fraction_stats, chunk_windows
 
 # optional distance transform (only used if installed)
 try:
@@ -15,17 +25,73 @@ try:
 except Exception:
     _HAS_SCIPY = False
 
+WORKER_GDAL_CACHE_MB = 64   # GDAL block cache per worker process (default is 5% of RAM *each*)
+
+# Bump whenever a change alters feature values, so cached rows are recomputed.
+FEATURE_VERSION = 1
+
+# mask thresholds (part of the feature-cache key)
+URBAN_VV_THRESHOLD = 0.75    # SAR urban mask: normalised VV above this
+WATER_NDWI_THRESHOLD = 0.0   # water mask: NDWI above this
+DRY_NDVI_THRESHOLD = 0.2     # dry mask: NDVI below this
+DROUGHT_NDMI_THRESHOLD = 0.0 # drought mask: NDMI below this
+
 
 class SafeProcessor:
-    def __init__(self, download_dir="downloads", max_pixels: int = 2_000_000):
+    def __init__(self, download_dir="downloads", max_pixels: int = 2_000_000, window_pixels: int = 4_000_000,
+                 io_workers: int = 4, aoi_wkt: Optional[str] = None, feature_cache_dir: Optional[str] = None,
+                 band_cache_dir: Optional[str] = None, band_cache_gb: Optional[float] = None,
+                 s2_resolution: int = 10):
         """
         :param max_pixels: maximum number of pixels to read per band in-memory.
                            if a band has more pixels than this, it will be downsampled
                            (using rasterio.read(..., out_shape=...)) to approximately max_pixels.
+                           Only the water-distance transform still works on such a
+                           downsampled array; all other statistics are exact.
+        :param window_pixels: approximate pixels per window when streaming full-resolution
+                              statistics (bounds memory per band to a few window buffers).
+        :param io_workers: threads reading the bands of one product concurrently (GDAL
+                           releases the GIL while decoding). 1 reads them one after another.
+        :param aoi_wkt: optional AOI (lon/lat WKT). Only the raster window covering its
+                        bounding box is read, so every feature describes the AOI rather
+                        than the whole swath / tile. None processes full scenes.
+        :param feature_cache_dir: optional directory of cached feature rows (see
+                                  feature_cache.py); products already computed with the
+                                  same settings are returned without reading any raster.
+        :param band_cache_dir: optional directory of decoded band arrays (see band_cache.py),
+                               memory-mapped back on later runs instead of decoding again;
+                               kept under band_cache_gb by LRU eviction (unbounded if None).
+        :param s2_resolution: target S2 resolution (m); each band is read from the file
+                              whose resolution is closest to it (see s2_bands.py).
         """
         self.download_dir = download_dir
         self.max_pixels = int(max_pixels)
+        self.window_pixels = int(window_pixels)
+        self.io_workers = max(1, int(io_workers))
+        self.aoi_wkt = aoi_wkt
+        self.s2_resolution = int(s2_resolution)
+        self.feature_cache = FeatureCache(feature_cache_dir) if feature_cache_dir else None
+        self.band_cache = BandCache(
+            band_cache_dir, quota_bytes=int(band_cache_gb * 1024 ** 3) if band_cache_gb else None
+        ) if band_cache_dir else None
         os.makedirs(download_dir, exist_ok=True)
+        # enough to rebuild an identical processor inside a worker process
+        self._init_kwargs = {"download_dir": download_dir, "max_pixels": self.max_pixels,
+                             "window_pixels": self.window_pixels, "io_workers": self.io_workers,
+                             "aoi_wkt": aoi_wkt, "feature_cache_dir": feature_cache_dir,
+                             "band_cache_dir": band_cache_dir, "band_cache_gb": band_cache_gb,
+                             "s2_resolution": self.s2_resolution}
+
+    def worker_memory_bytes(self) -> int:
+        """
+        Rough peak memory of one product: the limited-grid water-distance step
+        (2 uint16 bands, float32 index, bool mask, float64 EDT output and its int
+        index arrays) or the windowed pass (4 native bands double-buffered, 2 float32
+        + 1 bool buffers), whichever is larger, plus the GDAL block cache.
+        """
+        limited = self.max_pixels * (2 * 2 + 4 + 1 + 8 + 2 * 8)
+        windowed = self.window_pixels * (2 * 4 * 2 + 2 * 4 + 1)
+        return max(limited, windowed) + WORKER_GDAL_CACHE_MB * 1024 ** 2
 
     # ------------------------
     # Utility helpers
@@ -35,158 +101,244 @@ class SafeProcessor:
         """Return mean, std, min, max ignoring NaNs. Returns NaN for empty arrays."""
         if arr is None:
             return (np.nan, np.nan, np.nan, np.nan)
-        # flatten and ignore NaN
+        # single cache-blocked pass in the native dtype (no float copy of the array)
         try:
-            a = arr.astype(float)
-            a = a[np.isfinite(a)]
-            if a.size == 0:
-                return (np.nan, np.nan, np.nan, np.nan)
-            return (float(np.mean(a)), float(np.std(a)), float(np.min(a)), float(np.max(a)))
+            run = RunningStats()
+            run.update(arr)
+            return run.result()
         except Exception:
             return (np.nan, np.nan, np.nan, np.nan)
 
-    def _parse_annotation_latlon(self, safe_dir: str) -> Tuple[Optional[float], Optional[float]]:
-        """
-        Robustly parse annotation XML(s) and gather geolocationGridPoint lat/lon values.
-        Handles namespaced XML by checking tag local-names.
+    @staticmethod
+    def _buffer(bufs: dict, name: str, shape: Tuple[int, int], dtype) -> np.ndarray:
+        """Reusable array of `shape`, backed by a flat per-name buffer that only ever grows."""
+        n = int(shape[0]) * int(shape[1])
+        flat = bufs.get(name)
+        if flat is None or flat.size < n or flat.dtype != np.dtype(dtype):
+            flat = bufs[name] = np.empty(n, dtype=dtype)
+        return flat[:n].reshape(shape)
+
+    def _read_band_limited(self, src, window: Optional[Window] = None,
+                           ref=None) -> Tuple[Optional[np.ndarray], Optional[dict]]:
         """
-        annot_dir = os.path.join(safe_dir, "annotation")
-        if not os.path.isdir(annot_dir):
-            return (None, None)
-
-        lat_list = []
-        lon_list = []
+        Read band of the open dataset `src` (or only `window` of it) into memory, but
+        limit memory usage by downsampling when very large. With `ref`, `window` is a
+        window of ref's grid and src is read onto that grid (see _read_aligned).
 
-        for fn in os.listdir(annot_dir):
-            if not fn.lower().endswith(".xml"):
-                continue
-            p = os.path.join(annot_dir, fn)
-            try:
-                tree = ET.parse(p)
-                root = tree.getroot()
-            except Exception:
-                # skip malformed xml
-                continue
-
-            # iterate all elements and find any element with local-name 'geolocationGridPoint'
-            for gp in root.iter():
-                tag_local = gp.tag.split("}")[-1] if "}" in gp.tag else gp.tag
-                if tag_local == "geolocationGridPoint":
-                    lat_el = None
-                    lon_el = None
-                    # find children by local-name
-                    for child in gp:
-                        child_local = child.tag.split("}")[-1] if "}" in child.tag else child.tag
-                        if child_local == "latitude":
-                            lat_el = child
-                        elif child_local == "longitude":
-                            lon_el = child
-                    if lat_el is not None and lon_el is not None:
-                        try:
-                            if lat_el.text is not None and lon_el.text is not None:
-                                lat_list.append(float(lat_el.text))
-                                lon_list.append(float(lon_el.text))
-                        except Exception:
-                            continue
-
-        if len(lat_list) == 0 or len(lon_list) == 0:
-            return (None, None)
-
-        return (float(np.mean(lat_list)), float(np.mean(lon_list)))
-
-    def _read_band_limited(self, path: str) -> Tuple[Optional[np.ndarray], Optional[dict]]:
-        """
-        Read band into memory, but limit memory usage by downsampling when very large.
-
-        Returns (array (2D float), profile) where array is downsampled if needed.
+        Returns (array (2D, native dtype), profile) where array is downsampled if needed.
         """
         try:
-            with rasterio.open(path) as src:
-                h, w = src.height, src.width
-                total = int(h) * int(w)
-                if total <= self.max_pixels:
-                    arr = src.read(1).astype(float)
-                    profile = src.profile
-                    return arr, profile
+            grid = ref if ref is not None else src
+            window = window or Window(0, 0, grid.width, grid.height)
+            src_window = window
+            params = {}
+            if grid is not src and (src.shape != grid.shape or src.transform != grid.transform):
+                src_window = rasterio.windows.from_bounds(*rasterio.windows.bounds(window, grid.transform),
+                                                          transform=src.transform)
+                params["grid"] = (tuple(grid.transform), grid.width, grid.height)
+            h, w = int(window.height), int(window.width)
+            total = int(h) * int(w)
+            if total <= self.max_pixels:
+                if src_window is window:
+                    arr = self._cached_read(src, lambda: src.read(1, window=window), window=window.flatten())
                 else:
-                    # compute scaling factor to approximate max_pixels
-                    scale = (self.max_pixels / float(total)) ** 0.5
-                    new_h = max(1, int(h * scale))
-                    new_w = max(1, int(w * scale))
-                    out_shape = (1, new_h, new_w)
-                    # use bilinear resampling for optical; okay for stats
-                    arr = src.read(1, out_shape=out_shape, resampling=Resampling.bilinear).astype(float)
-                    profile = src.profile.copy()
-                    profile.update({"height": new_h, "width": new_w, "transform": src.transform})  # transform is approximate
-                    return arr, profile
+                    arr = self._cached_read(
+                        src, lambda: src.read(1, window=src_window, out_shape=(1, h, w), resampling=Resampling.nearest),
+                        window=window.flatten(), resampling="nearest", **params)
+                profile = src.profile.copy()
+                profile.update({"height": h, "width": w,
+                                "transform": rasterio.windows.transform(window, grid.transform)})
+                return arr, profile
+            else:
+                # compute scaling factor to approximate max_pixels
+                scale = (self.max_pixels / float(total)) ** 0.5
+                new_h = max(1, int(h * scale))
+                new_w = max(1, int(w * scale))
+                out_shape = (1, new_h, new_w)
+                # use bilinear resampling for optical; okay for stats
+                arr = self._cached_read(
+                    src, lambda: src.read(1, window=src_window, out_shape=out_shape, resampling=Resampling.bilinear),
+                    window=window.flatten(), out_shape=out_shape, resampling="bilinear", **params)
+                profile = src.profile.copy()
+                profile.update({"height": new_h, "width": new_w,  # transform is approximate
+                                "transform": rasterio.windows.transform(window, grid.transform)})
+                return arr, profile
         except Exception as e:
-            print(f"⚠️ Failed to read {path}: {e}")
+            print(f"⚠️ Failed to read {src.name}: {e}")
             return None, None
 
+    def _cached_read(self, src, read, **params) -> np.ndarray:
+        """read() through the band cache (keyed by src and the read parameters), if enabled."""
+        if self.band_cache is None:
+            return read()
+        return self.band_cache.get_or_read(self.band_cache.key(src.name, **params), read)
+
     # ------------------------
-    # Sentinel-1 processing
+    # Windowed reading helpers
     # ------------------------
-    def _compute_s1_stats(self, vv_path: str, vh_path: str, safe_dir: str) -> Dict:
+    @staticmethod
+    def _read_aligned(src, ref, win, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Read from src the area covered by window `win` of the reference raster, on the
+        reference pixel grid (e.g. a 20 m S2 band replicated onto the 10 m grid).
+        `out` (native dtype, window shape) is filled in place when given.
+        """
+        if src.shape == ref.shape and src.transform == ref.transform:
+            return src.read(1, window=win, out=out)
+        bounds = rasterio.windows.bounds(win, ref.transform)
+        src_win = rasterio.windows.from_bounds(*bounds, transform=src.transform)
+        if out is None:
+            return src.read(
+                1, window=src_win, out_shape=(int(win.height), int(win.width)), resampling=Resampling.nearest
+            )
+        return src.read(1, window=src_win, out=out, resampling=Resampling.nearest)
+
+    def _aoi_window(self, src, gcps=None) -> Window:
+        """
+        Window of src to process: the AOI window, or the whole raster without an AOI.
+        gcps: fallback tie points for rasters without CRS or embedded GCPs.
         """
-        Read VV/VH with memory limit, normalize each band to [0,1], compute stats.
-        Returns dict with stats and a downsampled normalized array for mask detection (small).
+        if not self.aoi_wkt:
+            return Window(0, 0, src.width, src.height)
+        win = aoi_window(src, self.aoi_wkt, gcps=gcps)
+        if win is None:
+            raise RuntimeError(f"AOI does not intersect {src.name}")
+        return win
+
+    def _window_reads(self, executor, windows, readers, bufs: dict) -> Iterator[Tuple[object, List[np.ndarray]]]:
         """
-        # read limited
-        vv_arr, vv_prof = self._read_band_limited(vv_path)
-        vh_arr, vh_prof = self._read_band_limited(vh_path)
+        Yield (window, arrays) with one array per reader for each window.
 
-        if vv_arr is None or vh_arr is None:
-            raise RuntimeError("Failed reading S1 bands")
+        readers are (name, dtype, fn(window, out)) tuples, one per band/open file.
+        All bands of a window are read concurrently on `executor`, and the next
+        window is already being read while the caller works on the current one
+        (two alternating buffer sets). A file is never read by two threads at once.
+        """
+        def submit(win, slot):
+            shape = (int(win.height), int(win.width))
+            return [executor.submit(fn, win, self._buffer(bufs, f"{name}{slot}", shape, dtype))
+                    for name, dtype, fn in readers]
+
+        windows = iter(windows)
+        win, slot = next(windows, None), 0
+        pending = submit(win, slot) if win is not None else []
+        while win is not None:
+            arrays = [f.result() for f in pending]
+            nxt = next(windows, None)
+            if nxt is not None:
+                pending = submit(nxt, 1 - slot)
+            yield win, arrays
+            win, slot = nxt, 1 - slot
+
+    def _cached_region(self, src, ref, region: Window) -> np.ndarray:
+        """
+        Whole `region` of src on ref's grid (src's own if ref is None) as a read-only
+        memory map from the band cache, decoded window by window on first use.
+        """
+        grid = ref if ref is not None else src
+        key = self.band_cache.key(src.name, region=region.flatten(), grid=(tuple(grid.transform), grid.width, grid.height),
+                                  resampling="nearest")
+        arr = self.band_cache.load(key)
+        if arr is not None:
+            return arr
 
-        # mask non-finite
-        vv_arr = np.where(np.isfinite(vv_arr), vv_arr, np.nan)
-        vh_arr = np.where(np.isfinite(vh_arr), vh_arr, np.nan)
+        r0, c0 = int(region.row_off), int(region.col_off)
 
-        def normalize_0_1(a):
-            if a is None:
-                return None
-            amin = np.nanmin(a)
-            amax = np.nanmax(a)
-            if np.isnan(amin) or np.isnan(amax) or amax == amin:
-                # return array of NaNs so stats become NaN
-                return np.full_like(a, np.nan, dtype=float)
-            return (a - amin) / (amax - amin)
+        def fill(mm):
+            for win in chunk_windows(grid, self.window_pixels, region):
+                block = src.read(1, window=win) if ref is None else self._read_aligned(src, ref, win)
+                r, c = int(win.row_off) - r0, int(win.col_off) - c0
+                mm[r:r + block.shape[0], c:c + block.shape[1]] = block
 
-        vv_n = normalize_0_1(vv_arr)
-        vh_n = normalize_0_1(vh_arr)
+        return self.band_cache.build(key, (int(region.height), int(region.width)), src.dtypes[0], fill)
 
-        vv_stats = self._band_stats(vv_n if vv_n is not None else np.array([]))
-        vh_stats = self._band_stats(vh_n if vh_n is not None else np.array([]))
+    def _band_readers(self, executor, region: Window, bands) -> List[tuple]:
+        """
+        Readers for _window_reads. `bands` are (name, src, ref) with ref the grid to
+        read onto (None = src's own grid). With a band cache each band's region is
+        fetched (or built, concurrently) as a memory map and every window becomes a
+        zero-copy slice of it; otherwise windows are decoded from the file.
+        """
+        def direct(src, ref):
+            if ref is None:
+                return lambda win, out: src.read(1, window=win, out=out)
+            return lambda win, out: self._read_aligned(src, ref, win, out)
 
-        # compute center lat/lon: prefer raster transform if crs present; else parse annotation
-        lat = lon = None
-        try:
-            with rasterio.open(vv_path) as src:
-                row = src.height // 2
-                col = src.width // 2
-                x, y = rasterio.transform.xy(src.transform, row, col)
-                if src.crs is not None:
-                    try:
-                        lon_arr, lat_arr = transform(src.crs, "EPSG:4326", [x], [y])
-                        lon = float(lon_arr[0])
-                        lat = float(lat_arr[0])
-                    except Exception:
-                        lat = lon = None
-                else:
-                    lat = lon = None
-        except Exception:
-            lat = lon = None
+        def sliced(arr):
+            r0, c0 = int(region.row_off), int(region.col_off)
+
+            def read(win, out):
+                r, c = int(win.row_off) - r0, int(win.col_off) - c0
+                return arr[r:r + int(win.height), c:c + int(win.width)]
+            return read
+
+        if self.band_cache is None:
+            return [(name, src.dtypes[0], direct(src, ref)) for name, src, ref in bands]
+        futures = [executor.submit(self._cached_region, src, ref, region) for _, src, ref in bands]
+        return [(name, src.dtypes[0], sliced(f.result())) for (name, src, _), f in zip(bands, futures)]
+
+    # ------------------------
+    # Sentinel-1 processing
+    # ------------------------
+    def _compute_s1_stats(self, vv_path: str, vh_path: str, safe_dir: str) -> Dict:
+        """
+        Exact full-resolution VV/VH statistics, streamed window by window.
+
+        Bands are min-max normalised to [0,1] as before; the normalised stats are
+        derived from the raw ones. The SAR urban mask (normalised VV > URBAN_VV_THRESHOLD) needs
+        the VV range first, so it is counted in a second pass over VV.
+        VV and VH windows are read concurrently; each file is opened once.
+        The annotation geolocation grid (parsed once per product, see s1_annotation.py)
+        rejects products whose footprint misses the AOI before any raster is read, and
+        stands in for the centre / GCPs when the measurement file lacks them.
+        """
+        geo = None
+        if self.aoi_wkt:
+            geo = product_geolocation(safe_dir)
+            fp = geo.footprint() if geo is not None else None
+            if fp is not None and not fp.intersects(shapely_wkt.loads(self.aoi_wkt)):
+                raise RuntimeError(f"AOI outside the footprint of {safe_archive.product_name(safe_dir)}")
+
+        vv_run, vh_run = RunningStats(), RunningStats()
+        with rasterio.open(vv_path) as vv_src, rasterio.open(vh_path) as vh_src, \
+                ThreadPoolExecutor(max_workers=self.io_workers) as executor:
+            if vv_src.shape != vh_src.shape:
+                raise RuntimeError(f"VV/VH shapes differ: {vv_src.shape} vs {vh_src.shape}")
+
+            gcps = None
+            if vv_src.crs is None and not vv_src.gcps[0]:
+                geo = geo or product_geolocation(safe_dir)
+                gcps = geo.gcps() if geo is not None else None
+            region = self._aoi_window(vv_src, gcps)
+            bufs = {}
+            readers = self._band_readers(executor, region, [("vv", vv_src, None), ("vh", vh_src, None)])
+            for _, (vv, vh) in self._window_reads(
+                    executor, chunk_windows(vv_src, self.window_pixels, region), readers, bufs):
+                vv_run.update(vv)
+                vh_run.update(vh)
+            vv_raw = vv_run.result()
+
+            # urban mask: vv_n > t  <=>  vv > min + t * (max - min)
+            n_urban = 0
+            n_total = int(region.width) * int(region.height)
+            vmin, vmax = vv_raw[2], vv_raw[3]
+            if np.isfinite(vmin) and np.isfinite(vmax) and vmax > vmin:
+                cut = vmin + URBAN_VV_THRESHOLD * (vmax - vmin)
+                for _, (block,) in self._window_reads(executor, chunk_windows(vv_src, self.window_pixels, region),
+                                                      readers[:1], bufs):
+                    mask = np.greater(block, cut, out=self._buffer(bufs, "mask", block.shape, bool))
+                    n_urban += int(np.count_nonzero(mask))
+
+            lat, lon = window_center_latlon(vv_src, region, gcps)
 
         if lat is None or lon is None:
-            lat, lon = self._parse_annotation_latlon(safe_dir)
+            geo = geo or product_geolocation(safe_dir)
+            lat, lon = geo.center() if geo is not None else (None, None)
 
-        # remove big arrays from memory by keeping only small normalized arrays
-        # (we returned downsampled arrays from _read_band_limited already)
         return {
-            "vv_stats": vv_stats,
-            "vh_stats": vh_stats,
-            "vv_norm_small": vv_n,  # small/downsampled array for mask detection
-            "vh_norm_small": vh_n,
+            "vv_stats": normalized_stats(vv_raw),
+            "vh_stats": normalized_stats(vh_run.result()),
+            "urban_stats": fraction_stats(n_urban, n_total),
             "lat": lat,
             "lon": lon,
         }
@@ -194,81 +346,150 @@ class SafeProcessor:
     # ------------------------
     # Sentinel-2 processing (optional)
     # ------------------------
-    def _find_s2_band_files(self, s2_safe_dir: str) -> Dict[str, Optional[str]]:
-        bands: Dict[str, Optional[str]] = {"B03": None, "B04": None, "B08": None, "B11": None}
-        for root, _, files in os.walk(s2_safe_dir):
-            for f in files:
-                fn = f.upper()
-                for b in bands:
-                    if b in fn and bands[b] is None:
-                        bands[b] = os.path.join(root, f)
-        return bands
+    @staticmethod
+    def _safe_index(a, b, out: Optional[np.ndarray] = None, den: Optional[np.ndarray] = None,
+                    bad: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        (a - b) / (a + b) in float32 straight from the native band dtype, written into
+        `out` with `den`/`bad` as scratch (all allocated if not given). Non-finite → NaN.
+        """
+        out = np.empty(a.shape, dtype=np.float32) if out is None else out
+        den = np.empty(a.shape, dtype=np.float32) if den is None else den
+        bad = np.empty(a.shape, dtype=bool) if bad is None else bad
+        np.subtract(a, b, out=out, dtype=np.float32)
+        np.add(a, b, out=den, dtype=np.float32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.divide(out, den, out=out)
+        np.isfinite(out, out=bad)
+        np.logical_not(bad, out=bad)
+        np.putmask(out, bad, np.nan)
+        return out
+
+    def _water_distance_bands(self, green_src, nir_src, window: Optional[Window] = None
+                              ) -> Optional[Tuple[np.ndarray, np.ndarray, float]]:
+        """
+        (green, nir, pixel size in m) on the max_pixels-limited grid, read from the
+        already-open B03/B08 datasets; `window` is on the B08 grid, and B03 is read onto
+        it (its file may be coarser, e.g. 20 m with s2_resolution=20). None if unreadable.
+        """
+        green, _ = self._read_band_limited(green_src, window, ref=nir_src)
+        nir, profile = self._read_band_limited(nir_src, window)
+        if green is None or nir is None or green.shape != nir.shape:
+            return None
+        full_width = window.width if window is not None else nir_src.width
+        px = abs(profile["transform"][0]) * full_width / float(nir.shape[1])  # native pixel size -> limited grid
+        return green, nir, px
+
+    def _water_distance_stats(self, green: np.ndarray, nir: np.ndarray,
+                              pixel_size: float) -> Tuple[float, float, float, float]:
+        """
+        Distance (m) from every pixel to the nearest NDWI > 0 pixel. The Euclidean
+        distance transform needs the whole mask at once, so this one feature is
+        computed on the max_pixels-limited grid (see _water_distance_bands).
+        """
+        if not _HAS_SCIPY:
+            return NAN_STATS
+        try:
+            # not (NDWI > threshold): NaN / no-data pixels count as land, as in the original mask
+            land_mask = ~(self._safe_index(green, nir) > WATER_NDWI_THRESHOLD)
+            # distance_transform_edt measures distance to the nearest zero, so zero = water
+            dist = distance_transform_edt(land_mask)
+            dist *= pixel_size
+            return self._band_stats(dist)
+        except Exception:
+            return NAN_STATS
 
     def _compute_s2_indices_stats(self, s2_safe_dir: str) -> Optional[Dict]:
-        bands = self._find_s2_band_files(s2_safe_dir)
+        """
+        Exact full-resolution NDVI/NDWI/NDMI statistics and water/dry/drought mask
+        fractions, streamed over windows of the B08 (10 m) grid; coarser bands are
+        read onto that grid. The four bands of a window are read concurrently, and the
+        limited-grid water-distance transform runs alongside the windowed pass.
+        """
+        # B08 (10 m) is the reference grid; the others are read onto it
+        bands = band_index(s2_safe_dir).select(["B03", "B04", "B08", "B11"], self.s2_resolution)
         if not bands or any(bands[b] is None for b in ["B04", "B03", "B08", "B11"]):
             return None
 
-        # read with limiting
-        red = None
-        if bands["B04"] is not None:
-            red, _ = self._read_band_limited(bands["B04"])
-        green = None
-        if bands["B03"] is not None:
-            green, _ = self._read_band_limited(bands["B03"])
-        nir = None
-        profile = None
-        if bands["B08"] is not None:
-            nir, profile = self._read_band_limited(bands["B08"])
-        swir = None
-        if bands["B11"] is not None:
-            swir, _ = self._read_band_limited(bands["B11"])
-
-        if any(x is None for x in [red, green, nir, swir]):
-            return None
-
-        # safe index calc with division handling
-        def safe_index(a, b):
-            with np.errstate(divide="ignore", invalid="ignore"):
-                res = (a - b) / (a + b)
-                res[~np.isfinite(res)] = np.nan
-                return res
-
-        ndvi = safe_index(nir, red)
-        ndwi = safe_index(green, nir)
-        ndmi = safe_index(nir, swir)
+        ndvi_run, ndwi_run, ndmi_run = RunningStats(), RunningStats(), RunningStats()
+        n_water = n_dry = n_drought = n_total = 0
+        with rasterio.open(bands["B04"]) as red_src, rasterio.open(bands["B03"]) as green_src, \
+                rasterio.open(bands["B08"]) as nir_src, rasterio.open(bands["B11"]) as swir_src, \
+                ThreadPoolExecutor(max_workers=self.io_workers + 1) as executor:
+            region = self._aoi_window(nir_src)
+            # the limited-grid bands come from the open handles, read before the windowed pass
+            # uses them (a GDAL handle is not shared between threads); only the transform overlaps it
+            water_bands = self._water_distance_bands(green_src, nir_src, region) if _HAS_SCIPY else None
+            water_distance = executor.submit(self._water_distance_stats, *water_bands) if water_bands else None
+
+            bufs = {}
+            readers = self._band_readers(executor, region, [
+                ("nir", nir_src, None), ("red", red_src, nir_src), ("green", green_src, nir_src), ("swir", swir_src, nir_src),
+            ])
+            for win, (nir, red, green, swir) in self._window_reads(
+                    executor, chunk_windows(nir_src, self.window_pixels, region), readers, bufs):
+                shape = nir.shape
+
+                # one float32 index buffer reused for NDVI, NDWI, NDMI in turn; bool mask scratch
+                idx = self._buffer(bufs, "idx", shape, np.float32)
+                den = self._buffer(bufs, "den", shape, np.float32)
+                mask = self._buffer(bufs, "mask", shape, bool)
+
+                # masks count NaN pixels as 0, like the comparisons always did
+                ndvi = self._safe_index(nir, red, idx, den, mask)
+                ndvi_run.update(ndvi)
+                n_dry += int(np.count_nonzero(np.less(ndvi, DRY_NDVI_THRESHOLD, out=mask)))
+
+                ndwi = self._safe_index(green, nir, idx, den, mask)
+                ndwi_run.update(ndwi)
+                n_water += int(np.count_nonzero(np.greater(ndwi, WATER_NDWI_THRESHOLD, out=mask)))
+
+                ndmi = self._safe_index(nir, swir, idx, den, mask)
+                ndmi_run.update(ndmi)
+                n_drought += int(np.count_nonzero(np.less(ndmi, DROUGHT_NDMI_THRESHOLD, out=mask)))
+                n_total += idx.size
+            water_distance_stats = water_distance.result() if water_distance is not None else NAN_STATS
 
         return {
-            "ndvi": ndvi,
-            "ndwi": ndwi,
-            "ndmi": ndmi,
-            "ndvi_stats": self._band_stats(ndvi),
-            "ndwi_stats": self._band_stats(ndwi),
-            "ndmi_stats": self._band_stats(ndmi),
-            "s2_profile": profile,
+            "ndvi_stats": ndvi_run.result(),
+            "ndwi_stats": ndwi_run.result(),
+            "ndmi_stats": ndmi_run.result(),
+            "water_stats": fraction_stats(n_water, n_total),
+            "dry_stats": fraction_stats(n_dry, n_total),
+            "drought_stats": fraction_stats(n_drought, n_total),
+            "water_distance_stats": water_distance_stats,
         }
 
     # ------------------------
     # High-level product processing
     # ------------------------
-    def process_safe_product(self, safe_dir: str, sentinel2_safe_dir: Optional[str] = None) -> Dict:
-        meas_dir = os.path.join(safe_dir, "measurement")
-        if not os.path.isdir(meas_dir):
+    def _s1_measurements(self, safe_dir: str) -> Tuple[str, str]:
+        """Openable paths of the VV and VH measurement rasters of an S1 product."""
+        meas_files = safe_archive.list_dir(safe_dir, "measurement")
+        if not meas_files:
             raise FileNotFoundError(f"No measurement dir in {safe_dir}")
 
         vv_file = vh_file = None
-        for fn in os.listdir(meas_dir):
+        for rel in meas_files:
+            fn = rel.rsplit("/", 1)[-1]
             if not fn.lower().endswith((".tif", ".tiff", ".img", ".tiff.aux.xml")):
                 continue
             name = fn.upper()
             if "VV" in name and vv_file is None:
-                vv_file = os.path.join(meas_dir, fn)
+                vv_file = safe_archive.raster_path(safe_dir, rel)
             elif "VH" in name and vh_file is None:
-                vh_file = os.path.join(meas_dir, fn)
+                vh_file = safe_archive.raster_path(safe_dir, rel)
 
         if not vv_file or not vh_file:
             raise FileNotFoundError("Missing VV/VH TIFFs in measurement directory")
+        return vv_file, vh_file
 
+    def process_safe_product(self, safe_dir: str, sentinel2_safe_dir: Optional[str] = None) -> Dict:
+        """
+        Compute the feature row for one S1 product (optionally paired with an S2 product).
+        Both may be extracted .SAFE folders or the downloaded .zip archives.
+        """
+        vv_file, vh_file = self._s1_measurements(safe_dir)
         s1_res = self._compute_s1_stats(vv_file, vh_file, safe_dir)
         s2_res = None
         if sentinel2_safe_dir:
@@ -278,79 +499,21 @@ class SafeProcessor:
                 print(f"⚠️ S2 processing failed for {sentinel2_safe_dir}: {e}")
                 s2_res = None
 
-        # water mask from NDWI > 0
-        if s2_res is not None:
-            ndwi = s2_res["ndwi"]
-            water_mask = (ndwi > 0).astype(float)
-            water_stats = self._band_stats(water_mask)
-        else:
-            water_mask = None
-            water_stats = (np.nan, np.nan, np.nan, np.nan)
-
-        # dry mask from NDVI < 0.2
-        if s2_res is not None:
-            ndvi = s2_res["ndvi"]
-            dry_mask = (ndvi < 0.2).astype(float)
-            dry_stats = self._band_stats(dry_mask)
-        else:
-            dry_mask = None
-            dry_stats = (np.nan, np.nan, np.nan, np.nan)
-
-        # drought mask from NDMI < 0.0
-        if s2_res is not None:
-            ndmi = s2_res["ndmi"]
-            drought_mask = (ndmi < 0.0).astype(float)
-            drought_stats = self._band_stats(drought_mask)
-        else:
-            drought_mask = None
-            drought_stats = (np.nan, np.nan, np.nan, np.nan)
-
-        # SAR urban mask using normalized downsampled VV (threshold tunable)
-        vv_n_small = s1_res.get("vv_norm_small")
-        if vv_n_small is not None:
-            try:
-                urban_mask = (vv_n_small > 0.75).astype(float)
-                urban_stats = self._band_stats(urban_mask)
-            except Exception:
-                urban_mask = None
-                urban_stats = (np.nan, np.nan, np.nan, np.nan)
-        else:
-            urban_mask = None
-            urban_stats = (np.nan, np.nan, np.nan, np.nan)
-
-        # water distance - only if scipy available and we have water_mask
-        if _HAS_SCIPY and water_mask is not None:
-            try:
-                # distance_transform_edt expects boolean (non-zero = feature), we want distance to water pixels,
-                # so invert: distance from non-water pixels to nearest water pixel.
-                not_water = 1.0 - water_mask
-                if _HAS_SCIPY:
-                    dist_pixels = distance_transform_edt(not_water)
-                else:
-                    dist_pixels = np.nan
-                # approximate pixel size: try from profile (if available)
-                prof = s2_res.get("s2_profile") if s2_res else None
-                if prof and "transform" in prof:
-                    px = abs(prof["transform"][0])
-                else:
-                    px = 1.0
-                if isinstance(dist_pixels, np.ndarray):
-                    dist_m = dist_pixels * px
-                else:
-                    dist_m = np.nan
-                water_distance_stats = self._band_stats(np.array(dist_m) if not isinstance(dist_m, np.ndarray) else dist_m)
-            except Exception:
-                water_distance_stats = (np.nan, np.nan, np.nan, np.nan)
-        else:
-            water_distance_stats = (np.nan, np.nan, np.nan, np.nan)
-
-        # ND stats (if s2 available)
+        # water mask from NDWI > 0, dry mask from NDVI < 0.2, drought mask from NDMI < 0.0
         if s2_res is not None:
             ndvi_stats = s2_res["ndvi_stats"]
             ndwi_stats = s2_res["ndwi_stats"]
             ndmi_stats = s2_res["ndmi_stats"]
+            water_stats = s2_res["water_stats"]
+            dry_stats = s2_res["dry_stats"]
+            drought_stats = s2_res["drought_stats"]
+            water_distance_stats = s2_res["water_distance_stats"]
         else:
-            ndvi_stats = ndwi_stats = ndmi_stats = (np.nan, np.nan, np.nan, np.nan)
+            ndvi_stats = ndwi_stats = ndmi_stats = NAN_STATS
+            water_stats = dry_stats = drought_stats = water_distance_stats = NAN_STATS
+
+        # SAR urban mask from normalized VV > 0.75 (threshold tunable)
+        urban_stats = s1_res["urban_stats"]
 
         row = {
             "label": -1,
@@ -422,22 +585,92 @@ class SafeProcessor:
             "lon_rounded": round(float(s1_res["lon"]), 3) if s1_res.get("lon") is not None else None,
         }
 
-        # explicitly delete big arrays (if any) to free memory
-        for k in ("vv_norm_small", "vh_norm_small"):
-            if k in s1_res:
-                del s1_res[k]
-        if s2_res:
-            for k in ("ndvi", "ndwi", "ndmi"):
-                if k in s2_res:
-                    del s2_res[k]
-
         return row
 
+    # ------------------------
+    # Co-registered S1 + S2 on a common grid
+    # ------------------------
+    @staticmethod
+    def _grid_mask(cond: np.ndarray, valid: np.ndarray) -> np.ndarray:
+        """0/1 float32 mask with NaN where the inputs are missing (outside swath / tile)."""
+        out = cond.astype(np.float32)
+        out[~valid] = np.nan
+        return out
+
+    def coregistered_stats(self, safe_dir: str, s2_dir: Optional[str] = None, resolution: float = 10.0,
+                           tile_size: int = 1024, workers: Optional[int] = None,
+                           output_dir: Optional[str] = None) -> Dict[str, Tuple[float, float, float, float]]:
+        """
+        S1 and S2 features on one common grid over the AOI (see grid_engine.py), so the
+        sensors can be combined per pixel, e.g. SAR_Urban_Water = SAR urban mask AND
+        NDWI water. Tiles are processed in parallel (workers, default io_workers).
+        Returns name -> (mean, std, min, max) over valid pixels; with output_dir every
+        per-pixel layer is also streamed to <output_dir>/<name>.tif.
+        """
+        if not self.aoi_wkt:
+            raise ValueError("coregistered_stats needs an AOI (aoi_wkt)")
+        grid = TargetGrid.from_aoi(self.aoi_wkt, resolution, tile_size=tile_size)
+        workers = workers or self.io_workers
+
+        vv_path, vh_path = self._s1_measurements(safe_dir)
+        gcps = None
+        with rasterio.open(vv_path) as src:
+            if src.crs is None and not src.gcps[0]:
+                geo = product_geolocation(safe_dir)
+                gcps = geo.gcps() if geo is not None else None
+        # DN 0 is the GRD no-data value (swath borders); without it the zeros blend into edge pixels
+        layers = {"vv": Layer(vv_path, src_nodata=0, gcps=gcps), "vh": Layer(vh_path, src_nodata=0, gcps=gcps)}
+        if s2_dir:
+            bands = band_index(s2_dir).select(["B03", "B04", "B08", "B11"], int(resolution))
+            if any(p is None for p in bands.values()):
+                raise FileNotFoundError(f"Missing S2 bands in {s2_dir}")
+            # DN 0 is the S2 no-data value
+            layers.update({b: Layer(p, src_nodata=0) for b, p in bands.items()})
+
+        # pass 1: S1 ranges for the min-max normalisation used by the scene features
+        s1_raw = run_tiles(grid, {"vv": layers["vv"], "vh": layers["vh"]},
+                           lambda a, w: {"vv": a["vv"], "vh": a["vh"]}, workers)
+        ranges = {}
+        for name in ("vv", "vh"):
+            vmin, vmax = s1_raw[name].result()[2:]
+            ranges[name] = (vmin, vmax - vmin if np.isfinite(vmax) and vmax > vmin else np.nan)
+
+        def tile(a, window):
+            vv = (a["vv"] - ranges["vv"][0]) / ranges["vv"][1]
+            vh = (a["vh"] - ranges["vh"][0]) / ranges["vh"][1]
+            s1_ok = np.isfinite(vv)
+            urban = vv > URBAN_VV_THRESHOLD
+            out = {"VV_Band": vv, "VH_Band": vh, "SAR_Urban_Mask": self._grid_mask(urban, s1_ok)}
+            if s2_dir:
+                ndvi = self._safe_index(a["B08"], a["B04"])
+                ndwi = self._safe_index(a["B03"], a["B08"])
+                ndmi = self._safe_index(a["B08"], a["B11"])
+                s2_ok = np.isfinite(ndwi)
+                water = ndwi > WATER_NDWI_THRESHOLD
+                out.update({
+                    "NDVI": ndvi, "NDWI": ndwi, "NDMI": ndmi,
+                    "Water_Percentage": self._grid_mask(water, s2_ok),
+                    "Dry_Percentage": self._grid_mask(ndvi < DRY_NDVI_THRESHOLD, np.isfinite(ndvi)),
+                    "Drought_Mask": self._grid_mask(ndmi < DROUGHT_NDMI_THRESHOLD, np.isfinite(ndmi)),
+                    "SAR_Urban_Water": self._grid_mask(urban & water, s1_ok & s2_ok),
+                })
+            return out
+
+        outputs = None
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            names = ["VV_Band", "VH_Band", "SAR_Urban_Mask"] + (
+                ["NDVI", "NDWI", "NDMI", "Water_Percentage", "Dry_Percentage", "Drought_Mask", "SAR_Urban_Water"]
+                if s2_dir else [])
+            outputs = {n: os.path.join(output_dir, f"{n}.tif") for n in names}
+        totals = run_tiles(grid, layers, tile, workers, outputs)
+        return {name: run.result() for name, run in totals.items()}
+
     # ------------------------
     # Batch processing + CSV
     # ------------------------
     def extract_datetime_from_safe(self, safe_dir: str) -> Optional[pd.Timestamp]:
-        basename = os.path.basename(safe_dir)
+        basename = safe_archive.product_name(safe_dir)
         parts = basename.split("_")
         if len(parts) >= 6:
             try:
@@ -446,42 +679,80 @@ class SafeProcessor:
                 return None
         return None
 
-    def process_safe_folders(self, safe_folders: list, output_prefix="output", s2_mapping: Optional[dict] = None) -> pd.DataFrame:
-        rows = []
-        for safe_dir in safe_folders:
-            try:
-                s2_dir = s2_mapping.get(safe_dir) if s2_mapping else None
-                row = self.process_safe_product(safe_dir, sentinel2_safe_dir=s2_dir)
-                dt = self.extract_datetime_from_safe(safe_dir)
-                row["year"] = dt.year if dt is not None else None
-                row["safe_name"] = os.path.basename(safe_dir)   # 🔑 add here
-                rows.append(row)
-                print(f"Processed {safe_dir}")
-            except Exception as e:
-                print(f"Failed {safe_dir}: {e}")
-                empty = {c: np.nan for c in [
-                    "label", "year", "lat", "lon",
-                    "single_NDVI_mean", "single_NDVI_std", "single_NDVI_min", "single_NDVI_max",
-                    "single_NDWI_mean", "single_NDWI_std", "single_NDWI_min", "single_NDWI_max",
-                    "single_NDMI_mean", "single_NDMI_std", "single_NDMI_min", "single_NDMI_max",
-                    "single_VV_Band_mean", "single_VV_Band_std", "single_VV_Band_min", "single_VV_Band_max",
-                    "single_VH_Band_mean", "single_VH_Band_std", "single_VH_Band_min", "single_VH_Band_max",
-                    "single_Water_Percentage_mean", "single_Water_Percentage_std", "single_Water_Percentage_min", "single_Water_Percentage_max",
-                    "single_Water_Distance_mean", "single_Water_Distance_std", "single_Water_Distance_min", "single_Water_Distance_max",
-                    "single_Dry_Percentage_mean", "single_Dry_Percentage_std", "single_Dry_Percentage_min", "single_Dry_Percentage_max",
-                    "single_Drought_Mask_mean", "single_Drought_Mask_std", "single_Drought_Mask_min", "single_Drought_Mask_max",
-                    "single_SAR_Urban_Mask_mean", "single_SAR_Urban_Mask_std", "single_SAR_Urban_Mask_min", "single_SAR_Urban_Mask_max",
-                    "lat_rounded", "lon_rounded", "safe_name"
-                ]}
-                dt = self.extract_datetime_from_safe(safe_dir)
-                empty["year"] = dt.year if dt else np.nan
-                empty["label"] = -1
-                empty["safe_name"] = os.path.basename(safe_dir)   # 🔑 also here
-                rows.append(empty)
+    def process_one(self, safe_dir: str, s2_dir: Optional[str] = None) -> Dict:
+        """
+        Feature row for one S1 product (+ optional S2), with year and safe_name set.
+        Failures are reported as a row of NaNs so the output keeps one row per product.
+        With a feature cache, cached rows are returned as they are and new rows stored.
+        """
+        cached = self.cached_row(safe_dir, s2_dir)
+        if cached is not None:
+            print(f"Cached {safe_dir}")
+            return cached
+        try:
+            row = self.process_safe_product(safe_dir, sentinel2_safe_dir=s2_dir)
+            dt = self.extract_datetime_from_safe(safe_dir)
+            row["year"] = dt.year if dt is not None else None
+            row["safe_name"] = safe_archive.product_name(safe_dir)   # 🔑 add here
+            print(f"Processed {safe_dir}")
+            # an S2 read that failed leaves NaN indices: retry it next run instead of caching
+            if self.feature_cache is not None and not (s2_dir and pd.isna(row["single_NDVI_mean"])):
+                self.feature_cache.put(self._cache_key(safe_dir, s2_dir), row)
+            return row
+        except Exception as e:
+            print(f"Failed {safe_dir}: {e}")
+            return self._failure_row(safe_dir)
 
-        df = pd.DataFrame(rows)
-    
+    def feature_settings(self) -> Dict:
+        """Everything besides the input products that changes the feature values."""
+        return {
+            "version": FEATURE_VERSION,
+            "max_pixels": self.max_pixels,   # water-distance grid
+            "aoi_wkt": self.aoi_wkt,
+            "s2_resolution": self.s2_resolution,
+            "urban_vv": URBAN_VV_THRESHOLD,
+            "water_ndwi": WATER_NDWI_THRESHOLD,
+            "dry_ndvi": DRY_NDVI_THRESHOLD,
+            "drought_ndmi": DROUGHT_NDMI_THRESHOLD,
+        }
 
+    def _cache_key(self, safe_dir: str, s2_dir: Optional[str]) -> str:
+        # identity is the product name, so an extracted folder and its .zip share an entry
+        return FeatureCache.key(safe_archive.product_name(safe_dir),
+                                safe_archive.product_name(s2_dir) if s2_dir else None,
+                                self.feature_settings())
+
+    def cached_row(self, safe_dir: str, s2_dir: Optional[str] = None) -> Optional[Dict]:
+        """Cached feature row of this S1 (+ S2) pair, or None (also without a cache)."""
+        if self.feature_cache is None:
+            return None
+        return self.feature_cache.get(self._cache_key(safe_dir, s2_dir))
+
+    def _failure_row(self, safe_dir: str) -> Dict:
+        """Row of NaNs (label -1) standing in for a product that could not be processed."""
+        empty = {c: np.nan for c in [
+            "label", "year", "lat", "lon",
+            "single_NDVI_mean", "single_NDVI_std", "single_NDVI_min", "single_NDVI_max",
+            "single_NDWI_mean", "single_NDWI_std", "single_NDWI_min", "single_NDWI_max",
+            "single_NDMI_mean", "single_NDMI_std", "single_NDMI_min", "single_NDMI_max",
+            "single_VV_Band_mean", "single_VV_Band_std", "single_VV_Band_min", "single_VV_Band_max",
+            "single_VH_Band_mean", "single_VH_Band_std", "single_VH_Band_min", "single_VH_Band_max",
+            "single_Water_Percentage_mean", "single_Water_Percentage_std", "single_Water_Percentage_min", "single_Water_Percentage_max",
+            "single_Water_Distance_mean", "single_Water_Distance_std", "single_Water_Distance_min", "single_Water_Distance_max",
+            "single_Dry_Percentage_mean", "single_Dry_Percentage_std", "single_Dry_Percentage_min", "single_Dry_Percentage_max",
+            "single_Drought_Mask_mean", "single_Drought_Mask_std", "single_Drought_Mask_min", "single_Drought_Mask_max",
+            "single_SAR_Urban_Mask_mean", "single_SAR_Urban_Mask_std", "single_SAR_Urban_Mask_min", "single_SAR_Urban_Mask_max",
+            "lat_rounded", "lon_rounded", "safe_name"
+        ]}
+        dt = self.extract_datetime_from_safe(safe_dir)
+        empty["year"] = dt.year if dt else np.nan
+        empty["label"] = -1
+        empty["safe_name"] = safe_archive.product_name(safe_dir)   # 🔑 also here
+        return empty
+
+    def rows_to_dataframe(self, rows: list, output_prefix="output") -> pd.DataFrame:
+        """Order the feature columns and save them to `<output_prefix>.csv`."""
+        df = pd.DataFrame(rows)
 
         cols_order = [
             "label", "year", "lat", "lon",
@@ -505,6 +776,81 @@ class SafeProcessor:
         print(f"Saved results to {csv_file}")
         return df
 
+    def pool_size(self, workers: int, memory_budget_mb: Optional[float] = None) -> int:
+        """Cap the requested worker count so workers * worker_memory_bytes() fits the budget."""
+        if memory_budget_mb is None:
+            try:
+                budget = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+            except (ValueError, OSError, AttributeError):
+                return workers
+        else:
+            budget = memory_budget_mb * 1024 ** 2
+        return max(1, min(workers, int(budget // self.worker_memory_bytes())))
+
+    def process_pool(self, n_workers: int) -> ProcessPoolExecutor:
+        """Worker processes that each hold a copy of this processor (see process_in_pool)."""
+        return ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                   initargs=(self._init_kwargs,))
+
+    def process_in_pool(self, pool: ProcessPoolExecutor, safe_dir: str, s2_dir: Optional[str] = None) -> Dict:
+        """process_one() in a worker of `pool`; a dead worker gives the usual failure row."""
+        try:
+            return pool.submit(_process_pair, safe_dir, s2_dir).result()
+        except Exception as e:   # worker died (e.g. OOM-killed): same row as any failure
+            print(f"Failed {safe_dir}: {e}")
+            return self._failure_row(safe_dir)
+
+    def process_safe_folders(self, safe_folders: list, output_prefix="output", s2_mapping: Optional[dict] = None,
+                             workers: int = 1, memory_budget_mb: Optional[float] = None) -> pd.DataFrame:
+        """
+        :param workers: processes to spread products over (1 = in this process, as before).
+        :param memory_budget_mb: total memory the workers may use; the pool is shrunk so
+                                 that workers * worker_memory_bytes() fits. Defaults to the
+                                 currently available physical memory.
+        Rows are returned in the order of safe_folders whatever the worker count.
+        """
+        pairs = [(safe_dir, s2_mapping.get(safe_dir) if s2_mapping else None) for safe_dir in safe_folders]
+        # cached rows are filled in right away; only the misses are computed
+        rows = [self.cached_row(safe_dir, s2_dir) for safe_dir, s2_dir in pairs]
+        todo = [i for i, row in enumerate(rows) if row is None]
+        if len(todo) < len(pairs):
+            print(f"Feature cache: {len(pairs) - len(todo)} of {len(pairs)} products already computed")
+
+        n_workers = self.pool_size(workers, memory_budget_mb) if workers > 1 else 1
+        n_workers = min(n_workers, len(todo))
+
+        if n_workers <= 1:
+            for i in todo:
+                rows[i] = self.process_one(*pairs[i])
+            return self.rows_to_dataframe(rows, output_prefix)
+
+        print(f"Processing {len(todo)} products with {n_workers} worker processes")
+        with self.process_pool(n_workers) as executor:
+            futures = {i: executor.submit(_process_pair, *pairs[i]) for i in todo}
+            for i in todo:
+                try:
+                    rows[i] = futures[i].result()
+                except Exception as e:   # worker died (e.g. OOM-killed): same row as any failure
+                    print(f"Failed {pairs[i][0]}: {e}")
+                    rows[i] = self._failure_row(pairs[i][0])
+        return self.rows_to_dataframe(rows, output_prefix)
+
+
+# -----------------------------
+# Process-pool workers (top level so they can be pickled)
+# -----------------------------
+_worker_processor: Optional[SafeProcessor] = None
+
+
+def _init_worker(init_kwargs: dict):
+    global _worker_processor
+    os.environ["GDAL_CACHEMAX"] = str(WORKER_GDAL_CACHE_MB)
+    _worker_processor = SafeProcessor(**init_kwargs)
+
+
+def _process_pair(safe_dir: str, s2_dir: Optional[str]) -> Dict:
+    return _worker_processor.process_one(safe_dir, s2_dir)
+
 
 # -----------------------------
 # Example usage
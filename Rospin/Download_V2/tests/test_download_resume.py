@@ -0,0 +1,110 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import download_file  # noqa: E402
+
+CONTENT = bytes(range(256)) * 1000  # 256000 bytes, no zero runs
+
+
+class _Response:
+    def __init__(self, body, status, headers):
+        self.body, self.status_code, self.headers = body, status, headers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, size):
+        for i in range(0, len(self.body), size):
+            yield self.body[i:i + size]
+
+
+class _Server:
+    """Serves CONTENT with Range support and records the ranges asked for."""
+    def __init__(self):
+        self.ranges = []
+
+    def get(self, url, headers=None, stream=False):
+        spec = (headers or {}).get("Range")
+        if spec is None:
+            return _Response(CONTENT, 200, {"Content-Length": str(len(CONTENT))})
+        lo, hi = spec.split("=")[1].split("-")
+        lo, hi = int(lo), int(hi)
+        if (lo, hi) != (0, 0):
+            self.ranges.append((lo, hi))
+        return _Response(CONTENT[lo:hi + 1], 206, {"Content-Range": f"bytes {lo}-{hi}/{len(CONTENT)}"})
+
+
+def _download(tmp_path, server, segments=4):
+    dest = str(tmp_path / "product.zip")
+    download_file(server, "https://example/product", dest, segments=segments)
+    with open(dest, "rb") as f:
+        return f.read()
+
+
+def test_presized_part_without_state_starts_over(tmp_path):
+    # a previous segmented run pre-sized the .part and died before its state was written
+    with open(tmp_path / "product.zip.part", "wb") as f:
+        f.truncate(len(CONTENT))
+    server = _Server()
+    assert _download(tmp_path, server) == CONTENT
+    assert sum(hi - lo + 1 for lo, hi in server.ranges) == len(CONTENT)
+
+
+def test_stale_state_and_presized_part_start_over(tmp_path):
+    with open(tmp_path / "product.zip.part", "wb") as f:
+        f.truncate(len(CONTENT))
+    with open(tmp_path / "product.zip.part.json", "w") as f:
+        json.dump({"size": len(CONTENT) + 1, "segments": [[0, len(CONTENT), len(CONTENT) + 1]]}, f)
+    assert _download(tmp_path, _Server()) == CONTENT
+
+
+def test_state_without_part_starts_over(tmp_path):
+    n = len(CONTENT)
+    with open(tmp_path / "product.zip.part.json", "w") as f:
+        json.dump({"size": n, "segments": [[0, n - 1, n]]}, f)
+    assert _download(tmp_path, _Server()) == CONTENT
+
+
+def test_single_stream_prefix_is_resumed(tmp_path):
+    prefix = 100000
+    with open(tmp_path / "product.zip.part", "wb") as f:
+        f.write(CONTENT[:prefix])
+    server = _Server()
+    assert _download(tmp_path, server, segments=1) == CONTENT
+    assert server.ranges == [(prefix, len(CONTENT) - 1)]
+
+
+def test_valid_state_is_resumed(tmp_path):
+    n, half = len(CONTENT), len(CONTENT) // 2
+    with open(tmp_path / "product.zip.part", "wb") as f:
+        f.write(CONTENT[:half])
+        f.truncate(n)
+    with open(tmp_path / "product.zip.part.json", "w") as f:
+        json.dump({"size": n, "segments": [[0, half - 1, half], [half, n - 1, 0]]}, f)
+    server = _Server()
+    assert _download(tmp_path, server) == CONTENT
+    assert server.ranges == [(half, n - 1)]
+
+
+def test_incomplete_segments_are_not_renamed(tmp_path):
+    class _Short(_Server):
+        def get(self, url, headers=None, stream=False):
+            r = super().get(url, headers, stream)
+            if r.status_code == 206 and (headers or {}).get("Range") != "bytes=0-0":
+                r.body = r.body[:-10]  # connection closed early
+            return r
+
+    with pytest.raises(RuntimeError):
+        _download(tmp_path, _Short())
+    assert not os.path.exists(tmp_path / "product.zip")
@@ -0,0 +1,61 @@
+import os
+import sys
+
+from shapely.geometry import Point, box, mapping
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from product_selection import is_local, select_cover  # noqa: E402
+from product_store import ProductStore  # noqa: E402
+
+TITLE = "S1A_IW_GRDH_1SDV_20230116T043009_20230116T043034_046804_059C91_925E.SAFE"
+
+
+def _product(pid, date="2023-01-16", bounds=(0, 0, 2, 2), title=TITLE):
+    return {"id": pid, "geometry": mapping(box(*bounds)),
+            "properties": {"title": title, "startDate": f"{date}T04:30:09Z"}}
+
+
+def test_with_a_store_only_the_store_is_asked(tmp_path):
+    root = str(tmp_path / "store")
+    store = ProductStore(root)
+    legacy_dir = tmp_path / "downloads"
+    legacy_dir.mkdir()
+    (legacy_dir / f"{TITLE}.zip").write_bytes(b"x")
+    assert not is_local(_product("abc"), str(legacy_dir), store)
+    assert is_local(_product("abc"), str(legacy_dir))
+
+
+def test_flat_layout_copy_in_the_store_counts_as_local(tmp_path):
+    root = tmp_path / "store"
+    root.mkdir()
+    (root / f"{TITLE}.zip").write_bytes(b"x")
+    store = ProductStore(str(root))
+    assert is_local(_product("abc"), str(root), store)
+
+
+def test_is_local_leaves_the_index_untouched(tmp_path):
+    root = str(tmp_path)
+    store = ProductStore(root)
+    zip_path, _ = store.paths("abc", TITLE)
+    os.makedirs(os.path.dirname(zip_path))
+    with open(zip_path, "wb") as f:
+        f.write(b"x")
+    store.record_zip("abc", TITLE)
+    index = os.path.join(root, ".store", "index.json")
+    before = open(index).read()
+    assert is_local(_product("abc"), root, store)
+    assert open(index).read() == before
+
+
+def test_degenerate_aoi_covers_nothing():
+    assert select_cover([_product("abc")], Point(1, 1)) == []
+
+
+def test_cover_prefers_fewer_scenes_and_clearer_ones():
+    aoi = box(0.5, 0.5, 1.5, 1.5)
+    products = [_product("a", bounds=(0, 0, 2, 2)), _product("b", bounds=(0, 0, 2, 2)),
+                _product("c", bounds=(0, 0, 1, 2)), _product("d", bounds=(1, 0, 2, 2))]
+    groups = select_cover(products, aoi, cloud={"a": 0.4, "b": 0.1, "c": 0.0, "d": 0.0})
+    assert [p["id"] for p in groups[0]["products"]] == ["b"]
+    assert groups[0]["coverage"] == 1.0
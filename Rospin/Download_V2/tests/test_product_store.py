@@ -0,0 +1,57 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from product_store import LEGACY_PREFIX, ProductStore  # noqa: E402
+
+TITLE = "S1A_IW_GRDH_1SDV_20230116T043009_20230116T043034_046804_059C91_925E.SAFE"
+
+
+def _write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+def _flat_product(root, title=TITLE):
+    _write(os.path.join(root, f"{title}.zip"), 100)
+    _write(os.path.join(root, title, "manifest.safe"), 50)
+
+
+def test_flat_layout_is_registered_and_counted(tmp_path):
+    root = str(tmp_path)
+    _flat_product(root)
+    store = ProductStore(root)
+    assert store.total_bytes() == 150
+    assert store.lookup(LEGACY_PREFIX + TITLE)["extracted"]
+
+
+def test_flat_layout_is_evicted_under_quota(tmp_path):
+    root = str(tmp_path)
+    _flat_product(root)
+    store = ProductStore(root, quota_bytes=10)
+    store.ensure_space(0)
+    assert not os.path.exists(os.path.join(root, f"{TITLE}.zip"))
+    assert not os.path.exists(os.path.join(root, TITLE))
+    assert store.total_bytes() == 0
+
+
+def test_flat_layout_is_adopted_by_product_id(tmp_path):
+    root = str(tmp_path)
+    _flat_product(root)
+    store = ProductStore(root)
+    assert store.adopt_legacy("abc", TITLE)
+    zip_path, extract_path = store.paths("abc", TITLE)
+    assert os.path.isfile(zip_path) and os.path.isdir(extract_path)
+    assert not os.path.exists(os.path.join(root, f"{TITLE}.zip"))
+    entry = store.lookup("abc")
+    assert entry["has_zip"] and entry["extracted"] and entry["zip_size"] == 100
+    assert store.lookup(LEGACY_PREFIX + TITLE) is None
+    assert not store.adopt_legacy("abc", TITLE)
+
+
+def test_untracked_id_folder_zip_is_registered(tmp_path):
+    root = str(tmp_path)
+    _write(os.path.join(root, "abc", f"{TITLE}.zip"), 100)
+    assert ProductStore(root).lookup("abc")["zip_size"] == 100
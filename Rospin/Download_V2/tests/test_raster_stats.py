@@ -0,0 +1,79 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+from rasterio.windows import Window
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from raster_stats import STATS_SLICE, RunningStats, chunk_windows  # noqa: E402
+
+
+def _data():
+    rng = np.random.default_rng(0)
+    data = (rng.normal(1000.0, 250.0, size=(600, 700))).astype(np.float32)
+    data[rng.random(data.shape) < 0.05] = np.nan
+    data[10, :] = np.inf
+    return data
+
+
+def _expected(data):
+    full = data.astype(np.float64)
+    return np.nanmean(full), np.nanstd(full), np.nanmin(full), np.nanmax(full)
+
+
+def _check(stats, data):
+    finite = np.isfinite(data)
+    assert stats.count == int(finite.sum())
+    assert stats.nan_count == data.size - stats.count
+    np.testing.assert_allclose(stats.result(), _expected(np.where(finite, data, np.nan)), rtol=1e-10)
+
+
+def test_chunked_updates_match_numpy():
+    data = _data()
+    assert data.size > STATS_SLICE  # several slices per block
+    stats = RunningStats()
+    for block in np.array_split(data, 7, axis=0):
+        stats.update(block)
+    _check(stats, data)
+
+
+def test_merged_workers_match_numpy():
+    data = _data()
+    parts = []
+    for block in np.array_split(data, 5, axis=1):
+        part = RunningStats()
+        part.update(block)
+        parts.append(part)
+    stats = RunningStats()
+    for part in parts:
+        stats.merge(part)
+    _check(stats, data)
+
+
+def test_integer_blocks_match_numpy():
+    data = np.random.default_rng(1).integers(0, 10000, size=(300, 500), dtype=np.uint16)
+    stats = RunningStats()
+    for block in np.array_split(data, 3):
+        stats.update(block)
+    np.testing.assert_allclose(stats.result(), (data.mean(), data.std(), data.min(), data.max()), rtol=1e-10)
+    assert stats.nan_count == 0
+
+
+def test_all_nan_gives_nan_stats():
+    stats = RunningStats()
+    stats.update(np.full((4, 4), np.nan, dtype=np.float32))
+    assert stats.nan_count == 16
+    assert all(np.isnan(v) for v in stats.result())
+
+
+def test_chunk_windows_cover_the_window_once():
+    src = SimpleNamespace(width=1000, height=700, block_shapes=[(256, 256)])
+    window = Window(130, 50, 700, 600)
+    hits = np.zeros((src.height, src.width), dtype=np.int32)
+    for w in chunk_windows(src, target_pixels=100_000, window=window):
+        hits[w.row_off:w.row_off + w.height, w.col_off:w.col_off + w.width] += 1
+    inside = hits[50:650, 130:830]
+    assert (inside == 1).all()
+    assert hits.sum() == inside.size
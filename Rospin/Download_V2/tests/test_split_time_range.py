@@ -0,0 +1,64 @@
+import os
+import sys
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from copernicus_client import _parse_utc, search_many, split_time_range  # noqa: E402
+
+START, END = "2023-01-10T00:00:00Z", "2023-04-01T00:00:00Z"
+BOUNDARY = "2023-01-23T00:00:00Z"  # first multiple of 30 days since 1970-01-01 after START
+
+
+class _Response:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class _Catalogue:
+    """Answers like resto: both date bounds inclusive, a single page."""
+    def __init__(self, features):
+        self.features = features
+
+    def get(self, url, params=None):
+        lo, hi = _parse_utc(params["startDate"]), _parse_utc(params["completionDate"])
+        page = [f for f in self.features if lo <= _parse_utc(f["properties"]["startDate"]) <= hi]
+        return _Response({"features": page, "properties": {"links": []}})
+
+
+def test_slices_are_contiguous():
+    slices = split_time_range(START, END, 30)
+    assert len(slices) > 1
+    assert slices[0] == (START, BOUNDARY) and slices[-1][1] == END
+    for (_, hi), (lo, _) in zip(slices, slices[1:]):
+        assert hi == lo
+
+
+def test_product_on_a_boundary_is_found_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # keep the search cache out of the source tree
+    # half a second before the edge used to fall between two slices
+    in_gap = (_parse_utc(BOUNDARY) - timedelta(milliseconds=500)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    features = [
+        {"id": "on-edge", "properties": {"startDate": BOUNDARY}},
+        {"id": "in-gap", "properties": {"startDate": in_gap}},
+    ]
+
+    found = search_many(_Catalogue(features), "POLYGON((0 0,1 0,1 1,0 0))", START, END,
+                        queries={"s1": ("Sentinel1", None)}, slice_days=30)
+    assert sorted(f["id"] for f in found["s1"]) == ["in-gap", "on-edge"]
+
+
+def test_cache_key_keeps_sub_seconds():
+    from copernicus_client import search_cache_key
+
+    a = search_cache_key("Sentinel1", "POLYGON((0 0,1 0,1 1,0 0))", "2023-01-01T00:00:00Z", "2023-01-23T00:00:00.250Z")
+    b = search_cache_key("Sentinel1", "POLYGON((0 0,1 0,1 1,0 0))", "2023-01-01T00:00:00Z", "2023-01-23T00:00:00Z")
+    c = search_cache_key("Sentinel1", "POLYGON((0 0,1 0,1 1,0 0))", "2023-01-01T02:00:00+02:00", "2023-01-23T00:00:00.000Z")
+    assert a != b
+    assert b == c
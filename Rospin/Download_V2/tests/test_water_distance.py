@@ -0,0 +1,71 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("scipy")
+
+from satellite_down import SafeProcessor  # noqa: E402
+
+
+def test_nodata_pixels_count_as_land(tmp_path):
+    # five 0/0 (NaN NDWI) pixels followed by one water pixel (NDWI = 0.5)
+    green = np.array([[0, 0, 0, 0, 0, 300]], dtype="uint16")
+    nir = np.array([[0, 0, 0, 0, 0, 100]], dtype="uint16")
+
+    processor = SafeProcessor(download_dir=str(tmp_path / "downloads"))
+    mean, std, vmin, vmax = processor._water_distance_stats(green, nir, 10.0)
+
+    expected = np.array([5, 4, 3, 2, 1, 0], dtype=float) * 10.0
+    assert vmin == pytest.approx(expected.min())
+    assert vmax == pytest.approx(expected.max())
+    assert mean == pytest.approx(expected.mean())
+    assert std == pytest.approx(expected.std())
+
+
+def test_limited_grid_pixel_size(tmp_path):
+    import rasterio
+    from rasterio.transform import from_origin
+
+    paths = []
+    for name in ("B03", "B08"):
+        path = str(tmp_path / f"{name}.tif")
+        with rasterio.open(path, "w", driver="GTiff", width=40, height=40, count=1, dtype="uint16",
+                           crs="EPSG:32635", transform=from_origin(500000, 5000000, 10, 10)) as dst:
+            dst.write(np.full((40, 40), 100, dtype="uint16"), 1)
+        paths.append(path)
+
+    # 1600 pixels read onto a 20 x 20 grid: every limited pixel spans 20 m
+    processor = SafeProcessor(download_dir=str(tmp_path / "downloads"), max_pixels=400)
+    with rasterio.open(paths[0]) as green_src, rasterio.open(paths[1]) as nir_src:
+        green, nir, px = processor._water_distance_bands(green_src, nir_src)
+    assert green.shape == nir.shape == (20, 20)
+    assert px == pytest.approx(20.0)
+
+
+def test_coarser_green_band_is_read_onto_the_nir_grid(tmp_path):
+    import rasterio
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+
+    def write(path, data, res):
+        with rasterio.open(path, "w", driver="GTiff", width=data.shape[1], height=data.shape[0], count=1,
+                           dtype=data.dtype, crs="EPSG:32635", transform=from_origin(500000, 5000000, res, res)) as dst:
+            dst.write(data, 1)
+
+    # B03 at 20 m: left half 1, right half 2; B08 at 10 m over the same ground
+    green = np.ones((20, 20), dtype="uint16")
+    green[:, 10:] = 2
+    write(str(tmp_path / "B03.tif"), green, 20)
+    write(str(tmp_path / "B08.tif"), np.full((40, 40), 5, dtype="uint16"), 10)
+
+    processor = SafeProcessor(download_dir=str(tmp_path / "downloads"))
+    with rasterio.open(str(tmp_path / "B03.tif")) as green_src, rasterio.open(str(tmp_path / "B08.tif")) as nir_src:
+        # right half of the B08 grid
+        green_arr, nir_arr, px = processor._water_distance_bands(green_src, nir_src, Window(20, 0, 20, 40))
+    assert green_arr.shape == nir_arr.shape == (40, 20)
+    assert (green_arr == 2).all()
+    assert px == pytest.approx(10.0)